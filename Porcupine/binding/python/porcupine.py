@@ -18,6 +18,9 @@ import os
 from ctypes import *
 from enum import Enum
 
+from pv_loader import check_file, load_library
+from pv_pcm import pcm_view
+
 
 class Porcupine(object):
     """Python binding for Picovoice's wake word detection (aka Porcupine) library."""
@@ -63,17 +66,12 @@ class Porcupine(object):
         parameter is used only when 'sensitivity' is not set.
         """
 
-        if not os.path.exists(library_path):
-            raise IOError("Could not find Porcupine's library at '%s'" % library_path)
-
-        library = cdll.LoadLibrary(library_path)
+        library = load_library(library_path, self._bind, "Porcupine's library")
 
-        if not os.path.exists(model_file_path):
-            raise IOError("Could not find model file at '%s'" % model_file_path)
+        check_file(model_file_path, 'model file')
 
         if sensitivity is not None and keyword_file_path is not None:
-            if not os.path.exists(keyword_file_path):
-                raise IOError("Could not find keyword file at '%s'" % keyword_file_path)
+            check_file(keyword_file_path, 'keyword file')
             keyword_file_paths = [keyword_file_path]
 
             if not (0 <= sensitivity <= 1):
@@ -84,8 +82,7 @@ class Porcupine(object):
                 raise ValueError("Different number of sensitivity and keyword file path parameters are provided.")
 
             for x in keyword_file_paths:
-                if not os.path.exists(os.path.expanduser(x)):
-                    raise IOError("Could not find keyword file at '%s'" % x)
+                check_file(x, 'keyword file')
 
             for x in sensitivities:
                 if not (0 <= x <= 1):
@@ -96,13 +93,6 @@ class Porcupine(object):
         self._num_keywords = len(keyword_file_paths)
 
         init_func = library.pv_porcupine_multiple_keywords_init
-        init_func.argtypes = [
-            c_char_p,
-            c_int,
-            POINTER(c_char_p),
-            POINTER(c_float),
-            POINTER(POINTER(self.CPorcupine))]
-        init_func.restype = self.PicovoiceStatuses
 
         self._handle = POINTER(self.CPorcupine)()
 
@@ -116,15 +106,38 @@ class Porcupine(object):
             raise self._PICOVOICE_STATUS_TO_EXCEPTION[status]('Initialization failed')
 
         self.process_func = library.pv_porcupine_multiple_keywords_process
-        self.process_func.argtypes = [POINTER(self.CPorcupine), POINTER(c_short), POINTER(c_int)]
-        self.process_func.restype = self.PicovoiceStatuses
-
         self._delete_func = library.pv_porcupine_delete
-        self._delete_func.argtypes = [POINTER(self.CPorcupine)]
-        self._delete_func.restype = None
 
-        self._sample_rate = library.pv_sample_rate()
-        self._frame_length = library.pv_porcupine_frame_length()
+        self._sample_rate = library.sample_rate
+        self._frame_length = library.frame_length
+
+        # reused by 'process_many' so that batches do not allocate per frame
+        self._frame_buffer = (c_short * self._frame_length)()
+        self._result = c_int()
+
+    @classmethod
+    def _bind(cls, library):
+        """Declares the prototypes of the library's functions; runs once per process (see 'pv_loader')."""
+
+        init_func = library.pv_porcupine_multiple_keywords_init
+        init_func.argtypes = [
+            c_char_p,
+            c_int,
+            POINTER(c_char_p),
+            POINTER(c_float),
+            POINTER(POINTER(cls.CPorcupine))]
+        init_func.restype = cls.PicovoiceStatuses
+
+        process_func = library.pv_porcupine_multiple_keywords_process
+        process_func.argtypes = [POINTER(cls.CPorcupine), POINTER(c_short), POINTER(c_int)]
+        process_func.restype = cls.PicovoiceStatuses
+
+        delete_func = library.pv_porcupine_delete
+        delete_func.argtypes = [POINTER(cls.CPorcupine)]
+        delete_func.restype = None
+
+        library.sample_rate = library.pv_sample_rate()
+        library.frame_length = library.pv_porcupine_frame_length()
 
     @property
     def sample_rate(self):
@@ -142,16 +155,21 @@ class Porcupine(object):
         """
         Monitors incoming audio stream for given wake word(s).
 
-        :param pcm: An array (or array-like) of consecutive audio samples. For more information regarding required audio
-        properties (i.e. sample rate, number of channels encoding, and number of samples per frame) please refer to
-        'include/pv_porcupine.h'.
+        :param pcm: An array (or array-like) of consecutive audio samples. Buffers of 16-bit samples (`bytes`,
+        `bytearray`, `memoryview`, `array('h')`, NumPy int16 arrays) are passed to the library without copying. For
+        more information regarding required audio properties (i.e. sample rate, number of channels encoding, and number
+        of samples per frame) please refer to 'include/pv_porcupine.h'.
         :return: For a single wake-word use cse True if wake word is detected. For multiple wake-word use case it
         returns the index of detected wake-word. Indexing is 0-based and according to ordering of input keyword file
         paths. It returns -1 when no keyword is detected.
         """
 
+        address, num_samples, pcm_owner = pcm_view(pcm)
+        if num_samples != self._frame_length:
+            raise ValueError('Expected a frame of %d samples, got %d' % (self._frame_length, num_samples))
+
         result = c_int()
-        status = self.process_func(self._handle, (c_short * len(pcm))(*pcm), byref(result))
+        status = self.process_func(self._handle, cast(address, POINTER(c_short)), byref(result))
         if status is not self.PicovoiceStatuses.SUCCESS:
             raise self._PICOVOICE_STATUS_TO_EXCEPTION[status]('Processing failed')
 
@@ -162,6 +180,40 @@ class Porcupine(object):
         else:
             return keyword_index
 
+    def process_many(self, pcm):
+        """
+        Monitors a contiguous block of several frames for given wake word(s) in a single call.
+
+        :param pcm: Consecutive 16-bit audio samples (see 'process' for accepted types). The number of samples must be
+        a multiple of 'frame_length'.
+        :return: List of '(frame_index, keyword_index)' tuples, one per detection, in order. 'frame_index' is the
+        0-based offset of the frame within 'pcm' and 'keyword_index' is ordered as the input keyword file paths (it is
+        always 0 for a single wake-word).
+        """
+
+        address, num_samples, pcm_owner = pcm_view(pcm)
+        if num_samples % self._frame_length:
+            raise ValueError('Expected a multiple of %d samples, got %d' % (self._frame_length, num_samples))
+
+        handle = self._handle
+        process_func = self.process_func
+        frame = self._frame_buffer
+        frame_bytes = sizeof(frame)
+        result = self._result
+        result_ref = byref(result)
+        success = self.PicovoiceStatuses.SUCCESS
+
+        detections = []
+        for frame_index in range(num_samples // self._frame_length):
+            memmove(frame, address + frame_index * frame_bytes, frame_bytes)
+            status = process_func(handle, frame, result_ref)
+            if status is not success:
+                raise self._PICOVOICE_STATUS_TO_EXCEPTION[status]('Processing failed')
+            if result.value >= 0:
+                detections.append((frame_index, result.value))
+
+        return detections
+
     def delete(self):
         """Releases resources acquired by Porcupine's library."""
 
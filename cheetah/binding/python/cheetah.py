@@ -1,9 +1,10 @@
 import ctypes
-import os
 from ctypes import *
-from ctypes import util as ctypes_util
 from enum import Enum
 
+from pv_loader import check_file, libc, load_library
+from pv_pcm import pcm_view
+
 
 class Cheetah(object):
     """Python binding for Picovoice's speech-to-text (a.k.a Cheetah) library."""
@@ -44,26 +45,15 @@ class Cheetah(object):
         :param license_file_path : Absolute path to license file.
         """
 
-        # self._libc = CDLL(util.find_library('c'))
-        self._libc = CDLL(ctypes_util.find_library('c'))
-
-        if not os.path.exists(library_path):
-            raise IOError("Could not find Cheetah's library at '%s'" % library_path)
-
-        library = cdll.LoadLibrary(library_path)
-
-        if not os.path.exists(acoustic_model_file_path):
-            raise IOError("Could not find acoustic model file at '%s'" % acoustic_model_file_path)
+        self._libc = libc()
 
-        if not os.path.exists(language_model_file_path):
-            raise IOError("Could not find language model file at '%s'" % language_model_file_path)
+        library = load_library(library_path, self._bind, "Cheetah's library")
 
-        if not os.path.exists(license_file_path):
-            raise IOError("Could not find license file at '%s'" % license_file_path)
+        check_file(acoustic_model_file_path, 'acoustic model file')
+        check_file(language_model_file_path, 'language model file')
+        check_file(license_file_path, 'license file')
 
         init_func = library.pv_cheetah_init
-        init_func.argtypes = [c_char_p, c_char_p, c_char_p, POINTER(POINTER(self.CCheetah))]
-        init_func.restype = self.PicovoiceStatuses
 
         self._handle = POINTER(self.CCheetah)()
 
@@ -76,20 +66,38 @@ class Cheetah(object):
             raise self._PICOVOICE_STATUS_TO_EXCEPTION[status]('Initialization failed')
 
         self._delete_func = library.pv_cheetah_delete
-        self._delete_func.argtypes = [POINTER(self.CCheetah)]
-        self._delete_func.restype = None
-
         self._process_func = library.pv_cheetah_process
-        self._process_func.argtypes = [POINTER(self.CCheetah), POINTER(c_short)]
-        self._process_func.restype = self.PicovoiceStatuses
-
         self._transcribe_func = library.pv_cheetah_transcribe
-        self._transcribe_func.argtypes = [POINTER(self.CCheetah), POINTER(c_char_p)]
-        self._transcribe_func.restype = self.PicovoiceStatuses
 
-        self._sample_rate = library.pv_sample_rate()
+        self._sample_rate = library.sample_rate
+
+        self._frame_length = library.frame_length
+
+        # reused by 'process_many' so that batches do not allocate per frame
+        self._frame_buffer = (c_short * self._frame_length)()
+
+    @classmethod
+    def _bind(cls, library):
+        """Declares the prototypes of the library's functions; runs once per process (see 'pv_loader')."""
+
+        init_func = library.pv_cheetah_init
+        init_func.argtypes = [c_char_p, c_char_p, c_char_p, POINTER(POINTER(cls.CCheetah))]
+        init_func.restype = cls.PicovoiceStatuses
+
+        delete_func = library.pv_cheetah_delete
+        delete_func.argtypes = [POINTER(cls.CCheetah)]
+        delete_func.restype = None
+
+        process_func = library.pv_cheetah_process
+        process_func.argtypes = [POINTER(cls.CCheetah), POINTER(c_short)]
+        process_func.restype = cls.PicovoiceStatuses
+
+        transcribe_func = library.pv_cheetah_transcribe
+        transcribe_func.argtypes = [POINTER(cls.CCheetah), POINTER(c_char_p)]
+        transcribe_func.restype = cls.PicovoiceStatuses
 
-        self._frame_length = library.pv_cheetah_frame_length()
+        library.sample_rate = library.pv_sample_rate()
+        library.frame_length = library.pv_cheetah_frame_length()
 
     @property
     def sample_rate(self):
@@ -100,12 +108,50 @@ class Cheetah(object):
         return self._frame_length
 
     def process(self, pcm):
-        assert len(pcm) == self.frame_length
-        status = self._process_func(self._handle, (c_short * len(pcm))(*pcm))
+        """
+        Feeds one frame of audio to the speech-to-text engine.
+
+        :param pcm: A frame of consecutive 16-bit audio samples. Buffers (`bytes`, `bytearray`, `memoryview`,
+        `array('h')`, NumPy int16 arrays) are passed to the library without copying; sequences of ints are packed.
+        """
+
+        address, num_samples, pcm_owner = pcm_view(pcm)
+        if num_samples != self.frame_length:
+            raise ValueError('Expected a frame of %d samples, got %d' % (self.frame_length, num_samples))
+
+        status = self._process_func(self._handle, cast(address, POINTER(c_short)))
 
         if status is not self.PicovoiceStatuses.SUCCESS:
             raise self._PICOVOICE_STATUS_TO_EXCEPTION[status]('Processing failed')
 
+    def process_many(self, pcm):
+        """
+        Feeds a contiguous block of several frames to the speech-to-text engine in a single call.
+
+        :param pcm: Consecutive 16-bit audio samples (see 'process' for accepted types). The number of samples must be
+        a multiple of 'frame_length'.
+        :return: Number of frames processed.
+        """
+
+        address, num_samples, pcm_owner = pcm_view(pcm)
+        if num_samples % self._frame_length:
+            raise ValueError('Expected a multiple of %d samples, got %d' % (self._frame_length, num_samples))
+
+        handle = self._handle
+        process_func = self._process_func
+        frame = self._frame_buffer
+        frame_bytes = sizeof(frame)
+        success = self.PicovoiceStatuses.SUCCESS
+
+        num_frames = num_samples // self._frame_length
+        for frame_index in range(num_frames):
+            memmove(frame, address + frame_index * frame_bytes, frame_bytes)
+            status = process_func(handle, frame)
+            if status is not success:
+                raise self._PICOVOICE_STATUS_TO_EXCEPTION[status]('Processing failed')
+
+        return num_frames
+
     def transcribe(self):
         transcript_pointer = c_char_p()
         status = self._transcribe_func(self._handle, byref(transcript_pointer))
@@ -1,26 +1,43 @@
 #!/bin/python3
 
 # standard imports
+from time import perf_counter, sleep
+STARTED = perf_counter()		# start of the startup timing report
 from os import path
-import struct
 from sys import stderr
 import signal
-from time import sleep
-from math import floor
+import argparse
+import threading
+import asyncio
+from contextlib import nullcontext
 
 # utils
 import cmdr_utils
-import cmdr_funcs
+import cmdr_audio
+import cmdr_vad
+import cmdr_dsp
+import cmdr_net
+import cmdr_registry
+import cmdr_intent
+import cmdr_transcribe
+import cmdr_recorder
+import cmdr_shard
+import cmdr_metrics
+import cmdr_async
+import cmdr_process
+import cmdr_tts
+import cmdr_config
+import cmdr_events
 
 # library imports
 from porcupine import Porcupine
 from cheetah import Cheetah
-import pyaudio
+import pv_loader
 
 
 
-def init_porcupine ( cfg ):
-	"""Set up Porcupine params, and return an instance of Porcupine"""
+def init_porcupine ( cfg, timer=None ):
+	"""Set up Porcupine params, and return an instance of Porcupine; phases are recorded with `timer`, if given"""
 	# determine paths to Porcupine binaries
 	PORCUPINE_ROOT_PATH = cfg['root_path']
 	porcupine_lib_path = path.join ( PORCUPINE_ROOT_PATH, cmdr_utils.rel_library_path() )
@@ -42,24 +59,60 @@ def init_porcupine ( cfg ):
 		kw['sensitivity'] for kw in cfg['keywords']['list']
 	]
 
+	# load and bind the library up front, so that its cost is reported apart from model init (the constructor then
+	# finds it in pv_loader's cache)
+	if timer:
+		with timer.phase('porcupine library load'):
+			pv_loader.load_library ( porcupine_lib_path, Porcupine._bind, "Porcupine's library" )
+
 	# initialize a Porcupine instance and return it
-	return Porcupine ( 
-		porcupine_lib_path, 
-		porcupine_model_file_path, 
-		keyword_file_paths=porcupine_keyword_file_paths, 
-		sensitivities=porcupine_kw_sensitivities
-	)
+	with timer.phase('porcupine model init') if timer else nullcontext():
+		return Porcupine ( 
+			porcupine_lib_path, 
+			porcupine_model_file_path, 
+			keyword_file_paths=porcupine_keyword_file_paths, 
+			sensitivities=porcupine_kw_sensitivities
+		)
+
+
+
+def reset_porcupine ( porcupine, seconds=1 ):
+	"""Flush a pooled Porcupine's internal state with silence, so that the next stream it serves starts clean"""
+	frames = cmdr_utils.ms_to_frames ( seconds * 1000, porcupine.sample_rate, porcupine.frame_length )
+	porcupine.process_many ( bytes(frames * porcupine.frame_length * 2) )
+
+
+
+def init_sharded_porcupine ( cfg, timer=None ):
+	"""
+	Return Porcupine, or with `shards` > 1 in config, a ShardedPorcupine spreading the keywords over that many worker
+	processes (for large keyword lists); it is used exactly like Porcupine
+	"""
+	if cfg.get('shards', 1) <= 1:
+		return init_porcupine ( cfg, timer )
+
+	# a throw-away engine with a single keyword, for the audio format
+	probe = init_porcupine ( dict(cfg, keywords=dict(cfg['keywords'], list=cfg['keywords']['list'][:1])), timer )
+	sample_rate, frame_length = probe.sample_rate, probe.frame_length
+	probe.delete()
+	with timer.phase('porcupine shards init') if timer else nullcontext():
+		return cmdr_shard.ShardedPorcupine ( cfg, cfg['shards'], sample_rate, frame_length )
 
 
 
-def init_cheetah ( cfg ):
-	"""Set up Cheetah params, and return an instance of Cheetah"""
+def init_cheetah ( cfg, timer=None ):
+	"""Set up Cheetah params, and return an instance of Cheetah; its library load is timed with `timer`, if given"""
 	root_path = cfg['root_path']
 	lib_path = path.join ( root_path, cfg['lib_path'] )
 	acoustic_model_path = path.join ( root_path, cfg['acoustic_model_path'] )
 	language_model_path = path.join ( root_path, cfg['language_model_path'] )
 	license_path = path.join ( root_path, cfg['license_path'] )
 
+	# load and bind the library first, so that its cost is reported apart from model init
+	if timer:
+		with timer.phase('cheetah library load'):
+			pv_loader.load_library ( lib_path, Cheetah._bind, "Cheetah's library" )
+
 	# init and return
 	return Cheetah (
 		lib_path, acoustic_model_path,
@@ -68,134 +121,653 @@ def init_cheetah ( cfg ):
 
 
 
-def init_input_audio_stream ( handler_instance, device=None ):
-	"""Init and return audio stream (pyaudio)"""
-	pa = pyaudio.PyAudio()
-	return pa.open(
-		rate=handler_instance.sample_rate,	# sample rate (samples/second)
-		channels=1,							# single channel input
-		format=pyaudio.paInt16,				# 16-bit encoding
-		input=True,							# use as input
-		frames_per_buffer=handler_instance.frame_length,	# samples/buffer
-		input_device_index=device			# leave as None to use sys default input device
-	)	# buffers/sec = (frames/sec) * (buffers/frames)
+def init_streaming_cheetah ( cfg, timer=None ):
+	"""Return a StreamingTranscriber over two Cheetah instances, or a single Cheetah if streaming is disabled"""
+	if not cfg.get('streaming', {}).get('enabled', False):
+		return init_cheetah(cfg, timer)
+	return cmdr_transcribe.StreamingTranscriber ( [init_cheetah(cfg, timer), init_cheetah(cfg)] )
+
+
+
+def init_lazy_cheetah ( cfg, timer=None ):
+	"""
+	Return a stand-in for Cheetah, built according to `load_policy` in config: 'eager', 'background' (default) or
+	'on-demand'. Its models are large and only needed after a wake word, so they need not delay listening
+	"""
+	return cmdr_utils.LazyEngine (
+		lambda: init_streaming_cheetah(cfg, timer), cfg.get('load_policy', 'background'), name='cheetah', timer=timer )
+
 
 
-interrupted = True
+def init_intent_parser ( cfg, timer=None ):
+	"""
+	Return a stand-in for the intent parser, built according to `load_policy` in the `intents` config (like Cheetah),
+	or None if no intents are configured
+	"""
+	if not cfg.get('list'):
+		return None
+	return cmdr_utils.LazyEngine (
+		lambda: cmdr_intent.IntentParser(cfg), cfg.get('load_policy', 'background'), name='intent parser', timer=timer )
+
+
+
+def init_input_audio_stream ( handler_instance, device=None, cfg=None ):
+	"""
+	Init and return the long-lived, callback-driven microphone capture (pyaudio), shared by Porcupine and Cheetah.  
+	Frames are pulled from the returned object with `read()`; `cfg` is the `audio` section of the config.  
+	`audio.device` names a profile in `audio.devices`, giving the device index and the rate, channel count, channels
+	to mix and gain it should be captured with; such devices are conditioned to what the engines expect
+	"""
+	cfg = cfg or {}
+	preroll_frames = cmdr_utils.ms_to_frames (
+		cfg.get('preroll_ms', 0), handler_instance.sample_rate, handler_instance.frame_length )
+	profile = cfg.get('devices', {}).get(cfg.get('device'), {})
+	return cmdr_audio.MicrophoneCapture (
+		handler_instance.sample_rate,		# sample rate (samples/second)
+		handler_instance.frame_length,		# samples/buffer
+		device=profile.get('index', device),	# leave as None to use sys default input device
+		ring_frames=cfg.get('ring_frames', 64),	# frames buffered between capture and processing
+		preroll_frames=preroll_frames,		# consumed frames kept for replay after a wake word
+		conditioner=cmdr_dsp.InputConditioner.from_config (
+			profile, handler_instance.sample_rate, handler_instance.frame_length )
+	)
+
+
+def init_replay_source ( handler_instance, file_path, cfg=None, realtime=False ):
+	"""
+	Init and return an AudioSource replaying `file_path` (WAV, raw PCM, or '-' for stdin) in place of the microphone.  
+	With `realtime`, frames are paced as if captured live; otherwise the file is processed as fast as possible
+	"""
+	cfg = cfg or {}
+	preroll_frames = cmdr_utils.ms_to_frames (
+		cfg.get('preroll_ms', 0), handler_instance.sample_rate, handler_instance.frame_length )
+	return cmdr_audio.open_source (
+		file_path, handler_instance.sample_rate, handler_instance.frame_length,
+		realtime=realtime, history=preroll_frames )
+
+
+# stop flags of the `cheetah_listen` calls in progress (one per call, so that satellite threads don't share one)
+listening = set()
 def break_loop (signal, frame):
 	"""
-	Set the `interrupted` flag to True if it not already True  
-	If `interrupted` is already set, gracefully exit program as normal.  
-	The `interrupted` flag should be checked by an infinite loop to conditionally break
+	Stop every `cheetah_listen` call in progress, by setting its stop flag
+	If none is in progress, gracefully exit program as normal.
 	"""
-	global interrupted
-	if interrupted:
-		exit(0)			# if interrupt flag already set, exit as normal
-	interrupted = True	# otherwise, set the interrupt flag
-# use `break_loop` to handle SIGINT (ctrl+C)
-signal.signal(signal.SIGINT, break_loop)
+	if not listening:
+		exit(0)			# nothing to interrupt, exit as normal
+	for stop in list(listening):
+		stop.set()
 
+# per-frame console output goes through a rate-limited sink, so that terminal writes never hold up the audio loop
+console = cmdr_metrics.PrintSink()
 
 
-def cheetah_listen (cmdr_state, audio_stream, cheetah):
-	"""Listen to audio stream until interrupted, then transcribe"""
-	# listen to command until interrupted (SIGINT) or user stops talking
-	global interrupted
-	interrupted = False
-	while not interrupted:
-		pcm = audio_stream.read ( cheetah.frame_length )
-		pcm = struct.unpack_from ("h" * cheetah.frame_length, pcm)
-		print ( floor(cmdr_utils.abs_list_avg(pcm)), end=", ", flush=True )
-		cheetah.process(pcm)
 
-	# set the interrupted flag to True (probably redundant)
-	interrupted = True
+def cheetah_listen (cmdr_state, audio_stream, cheetah, on_partial=None):
+	"""
+	Listen to audio stream until the user stops talking (or interrupted), then transcribe.
+	With streaming enabled, `cheetah` is a StreamingTranscriber: each pause closes a segment, which is decoded while
+	listening goes on, and `on_partial(transcript_so_far)` is called as segments come in; if it returns True, the
+	command has been handled and listening stops early
+	"""
+	cfg = cmdr_state.config['cheetah']
+	streaming = cfg.get('streaming', {})
+	pause_ms = streaming.get('pause_ms', 350) if streaming.get('enabled', False) else None
+	endpointer = cmdr_vad.Endpointer.from_config (
+		dict(cfg.get('endpoint', {}), pause_ms=pause_ms), cheetah.sample_rate, cheetah.frame_length )
+
+	# listen to command until interrupted (SIGINT) or user stops talking
+	stop = threading.Event()
+	listening.add(stop)
+	sink = cmdr_state.console or console
+	reader = cmdr_audio.frame_reader ( audio_stream, cheetah.frame_length )
+	try:
+		while not stop.is_set():
+			pcm = reader.read()
+			if pcm is None:			# replayed audio ran out
+				break
+			cheetah.process(pcm)	# raw bytes are handed to Cheetah as-is; no unpacking
+
+			done = endpointer.update(pcm)
+			sink.emit ( "%d, " % endpointer.energy )
+			if done:
+				break
+
+			if pause_ms:
+				if endpointer.paused:
+					cheetah.end_segment()
+				partial = cheetah.poll()
+				if partial is not None and on_partial and on_partial(partial):
+					break
+	finally:
+		listening.discard(stop)
+	sink.flush()
 
 	# transcribe with cheetah; return results
+	cmdr_state.state = cmdr_state.CmdrStateEnum.CHEETAH_TRANSCRIBING
 	return cheetah.transcribe()
 
 
 
-def handle_keyword_detected ( cmdr_state, kw_index, cheetah ):
-	"""Handle Porcupine keyword detection event"""
+def run_command ( cmdr_state, handler, *args, **kwargs ):
+	"""Run a command handler; commands that launch a background process hand it back, so that it can be stopped later"""
+	result = handler ( *args, **kwargs )
+	if hasattr(result, 'terminate'):
+		cmdr_state.active_process = result
+		cmdr_state.state = cmdr_state.CmdrStateEnum.ACTIVE_PROCESS
+	return result
+
+
+
+def handle_transcript ( cmdr_state, transcript, intent_parser, registry ):
+	"""Map `transcript` to an intent, and run the intent's command"""
+	start = perf_counter()
+	intent = intent_parser.match ( transcript )
+	elapsed_ms = (perf_counter() - start) * 1000
+	if cmdr_state.events:
+		cmdr_state.events.record ( 'intent', name=intent and intent.name, text=transcript, latency_ms=elapsed_ms )
+	if intent is None:
+		print ( "No command matches", repr(transcript) )
+		# the spoken reply is kept like a command's process, so that the next wake word cuts it short
+		return run_command ( cmdr_state, cmdr_tts.respond, 'no_match' )
+
+	print ( "Intent:", intent.name, intent.slots, "(%.2f ms)" % elapsed_ms )
+	return run_command ( cmdr_state, registry.get(intent.name), **intent.slots )
+
+
+
+def listen_for_command ( cmdr_state, audio_stream, cheetah, intent_parser=None, registry=None ):
+	"""
+	Built-in `listen` command: transcribe what the user says after the keyword, with Cheetah, and run the command
+	it maps to (if an `intent_parser` is given).  
+	`audio_stream` is the shared source Porcupine is reading from; return the transcript
+	"""
+	# Cheetah picks up the shared capture at the first frame after the keyword ended;
+	# optionally replay the configured pre-roll, in case the command started before detection
+	audio_stream.rewind ( audio_stream.history )
+
+	# both engines read the same 16-bit mono source (Cheetah may only just have finished loading)
+	if cheetah.sample_rate != audio_stream.sample_rate:
+		raise ValueError ( "Porcupine and Cheetah expect different sample rates" )
+
+	# with streaming transcription, a command can be dispatched as soon as the words so far match an intent
+	handled = []
+	def on_partial ( partial ):
+		print ( "\n...", partial, flush=True )
+		if intent_parser and intent_parser.match(partial):
+			handled.append ( handle_transcript(cmdr_state, partial, intent_parser, registry) )
+		return bool(handled)
+
+	# listen and transcribe from input stream
+	cmdr_state.state = cmdr_state.CmdrStateEnum.CHEETAH_LISTENING
+	transcript = cheetah_listen (cmdr_state, audio_stream, cheetah, on_partial)
+	report_transcript ( cmdr_state, transcript )
+
+	if intent_parser and not handled:
+		handle_transcript ( cmdr_state, transcript, intent_parser, registry )
+	return transcript
+
+
+
+async def listen_for_command_async ( assistant, cheetah, intent_parser=None, registry=None ):
+	"""Built-in `listen` command in asyncio mode (see `listen_for_command`); blocking steps run off the event loop"""
+	cmdr_state = assistant.cmdr
+	handled = []
+	async def on_partial ( partial ):
+		print ( "\n...", partial, flush=True )
+		if intent_parser and intent_parser.match(partial):
+			handled.append ( await assistant.run_blocking(handle_transcript, cmdr_state, partial, intent_parser, registry) )
+		return bool(handled)
+
+	transcript = await assistant.listen ( cheetah, cmdr_state.config['cheetah'], on_partial )
+	report_transcript ( cmdr_state, transcript )
+
+	if intent_parser and not handled:
+		await assistant.run_blocking ( handle_transcript, cmdr_state, transcript, intent_parser, registry )
+	return transcript
+
+
+
+def report_transcript ( cmdr_state, transcript ):
+	"""Print a transcript, keep the audio it came from (flight recorder), and add it to the event history"""
+	print (transcript)
+	if cmdr_state.recorder:
+		cmdr_state.recorder.snapshot ( 'transcript', transcript=transcript )
+	if cmdr_state.events:
+		cmdr_state.events.record ( 'transcript', text=transcript )
+
+
+
+def init_registry ( cmdr_state, audio_stream, cheetah, intent_parser=None, listen=None ):
+	"""
+	Build the keyword (and intent) → command dispatch table from config, with the built-in commands bound to these
+	engines (`listen` replaces the default built-in `listen` command)
+	"""
+	registry = cmdr_registry.CommandRegistry()
+	registry.register ( 'listen',
+		listen or (lambda: listen_for_command(cmdr_state, audio_stream, cheetah, intent_parser, registry)) )
+	registry.register ( 'say', cmdr_tts.say )
+	registry.load_keywords ( cmdr_state.config['porcupine']['keywords']['list'] )
+	registry.load_intents ( cmdr_state.config.get('intents', {}).get('list', []) )
+	return registry
+
+
+
+def handle_keyword_detected ( cmdr_state, kw_index, registry ):
+	"""
+	Handle Porcupine keyword detection event, by running the keyword's command from `registry`.  
+	Return the command's result (e.g. the transcript, for `listen`)
+	"""
+	handler = registry.get(kw_index)
+	if handler is None:
+		print ( "Error: no command for keyword index", kw_index, file=stderr, flush=True )
+		return None
+
+	announce_keyword ( cmdr_state, kw_index )
+	try:
+		return run_command ( cmdr_state, handler )
+	except Exception as e:		# a failed command (e.g. Cheetah failed to load) must not stop the listen loop
+		print ( "Error: command for keyword", kw_index, "failed -", e, file=stderr, flush=True )
+		return None
+
+
+
+async def handle_keyword_async ( assistant, kw_index, registry ):
+	"""
+	asyncio counterpart of `handle_keyword_detected`, run as a command task: the handler runs off the event loop,
+	and built-in async commands (`listen`) are awaited on it
+	"""
+	handler = registry.get(kw_index)
+	if handler is None:
+		print ( "Error: no command for keyword index", kw_index, file=stderr, flush=True )
+		return None
+
+	announce_keyword ( assistant.cmdr, kw_index )
 	try:
-		keyword_obj = cmdr_state.config['porcupine']['keywords']['list'][kw_index]
-	except:
-		print ( "Error: keyword index out of bounds", file=stderr, flush=True )
+		result = await assistant.run_blocking ( run_command, assistant.cmdr, handler )
+		if asyncio.iscoroutine(result):
+			result = await result
+	except Exception as e:		# as in `handle_keyword_detected`: the command fails, listening goes on
+		print ( "Error: command for keyword", kw_index, "failed -", e, file=stderr, flush=True )
+		return None
+	return result
+
 
+
+def announce_keyword ( cmdr_state, kw_index ):
+	"""
+	Print a keyword detection, keep the audio around it (flight recorder), e.g. to look into false triggers, and add
+	it to the event history
+	"""
+	keyword = cmdr_state.config['porcupine']['keywords']['list'][kw_index]
 	print ( 
 		"Keyword detected!", 
 		kw_index, 
-		keyword_obj['title'] )
+		keyword['title'] )
 
-	if kw_index == 3:
-		active_process = cmdr_funcs.play_despacito()
-		cmdr_state.state = cmdr_state.CmdrStateEnum.ACTIVE_PROCESS
-		cmdr_state.active_process = active_process
-	elif kw_index == 4:
-		cmdr_state.active_process = cmdr_funcs.play_audio_background("assets/music/untitled.mp3")
-		cmdr_state.state = cmdr_state.CmdrStateEnum.ACTIVE_PROCESS
-	else:
-		# init an audio input stream, using the mic input, with cheetah's params
-		audio_stream = init_input_audio_stream ( cheetah )
+	if cmdr_state.recorder:
+		cmdr_state.recorder.snapshot ( 'keyword', keyword_index=kw_index, keyword=keyword['title'],
+			sensitivity=keyword.get('sensitivity') )
+	if cmdr_state.events:
+		cmdr_state.events.record ( 'keyword', keyword=kw_index, name=keyword['title'],
+			sensitivity=keyword.get('sensitivity') )
 
-		# sleep for 0.2 seconds to avoid reading in noise from the wake word
-		sleep(0.2)
 
-		# listen and transcribe from input stream
-		cmdr_state.state = cmdr_state.CmdrStateEnum.CHEETAH_LISTENING
-		transcript = cheetah_listen (cmdr_state, audio_stream, cheetah)
-		print (transcript)
 
+def record_command ( cmdr, kw_index, detected_at, result, latencies ):
+	"""Account for a finished keyword command: wake-to-transcript latency, metrics, and event history"""
+	elapsed = perf_counter() - detected_at
+	if isinstance(result, str):		# a transcript
+		latencies.append(elapsed)
+	if cmdr.metrics:
+		cmdr.metrics.count ( 'keywords_total', labels='keyword="%d"' % kw_index )
+		cmdr.metrics.observe ( 'wake_to_action_seconds', elapsed )
+	if cmdr.events:
+		cmdr.events.record ( 'command', keyword=kw_index, latency_ms=elapsed * 1000,
+			text=result if isinstance(result, str) else None )
 
 
 
+def listen_loop ( cmdr, audio_stream, porcupine, registry, idle_gate=None ):
+	"""
+	Listen for keywords on `audio_stream` and handle them, until the stream is exhausted.  
+	Return the wake-to-transcript latency (seconds) of every spoken command
+	"""
+	cmdr.state = cmdr.CmdrStateEnum.PORCUPINE_LISTENING	# Porcupine begin listening
+	overruns = 0
+	latencies = []
 
+	# listen for keyword in a loop
+	while True:
+		# from the audio source (e.g. the capture ring buffer), read in the next frame
+		# the raw bytes are passed straight through to Porcupine's C library (zero-copy)
+		pcm = audio_stream.read()
+		if pcm is None:
+			return latencies
+
+		# warn if processing has fallen behind capture, and frames were dropped
+		if audio_stream.overruns != overruns:
+			overruns = audio_stream.overruns
+			print ( "Warning: audio ring buffer overrun;", audio_stream.stats(), file=stderr )
+
+		# with the idle gate, this is empty during sustained silence, or the held pre-roll + `pcm` on waking up
+		frames = idle_gate.feed(pcm) if idle_gate else (pcm,)
+		for frame in frames:
+			keyword_index = cmdr_utils.keyword_index ( porcupine.process(frame) )
+			# if a keyword is detected
+			if keyword_index >= 0:
+				break
+		else:
+			continue
+		detected_at = perf_counter()
+
+		# if there is an active background process, kill it
+		if cmdr.active_process:
+			cmdr.active_process.terminate()
+
+		# porcupine keyword detection event
+		result = handle_keyword_detected ( cmdr, keyword_index, registry )
+		record_command ( cmdr, keyword_index, detected_at, result, latencies )
+		cmdr.state = cmdr.CmdrStateEnum.PORCUPINE_LISTENING
+
+
+
+def init_metrics ( cmdr_state, cfg, audio_stream, idle_gate=None ):
+	"""
+	Start collecting metrics if the `metrics` config section enables them: time spent in each state, frame drops,
+	and wake-to-action latency (engine call latency is recorded by wrapping engines in `InstrumentedEngine`).
+	Return the running exporter, or None
+	"""
+	if not cfg.get('enabled', False):
+		return None
+	metrics = cmdr_state.metrics = cmdr_metrics.Metrics()
+	cmdr_state.state_hooks.append ( metrics.state_hook )
+	metrics.gauge ( 'audio_overruns', lambda: audio_stream.overruns )
+	if idle_gate:
+		metrics.gauge ( 'idle_gate_frames_skipped', lambda: idle_gate.frames_skipped )
+	metrics.gauge ( 'processes_running', lambda: len(cmdr_process.supervisor.running()) )
+	return cmdr_metrics.MetricsExporter.from_config ( metrics, cfg ).start()
 
-def main ():
-	# determine platform & machine
-	platform = cmdr_utils.get_platform(True)
-	machine = cmdr_utils.get_machine(True)
 
-	# track the state, including any active (background) process
-	cmdr = cmdr_utils.Cmdr()
 
-	# init Porcupine
-	porcupine = init_porcupine ( cmdr.config['porcupine'] )
+# config paths applied while running (see `reload_config`); anything else needs a restart
+HOT_RELOAD = ( 'porcupine.keywords', 'porcupine.shards', 'porcupine.root_path', 'porcupine.lib_path', 'processes' )
 
-	# init Cheetah
-	cheetah = init_cheetah ( cmdr.config['cheetah'] )
 
-	# init audio stream (pyaudio) for Porcupine
-	audio_stream = init_input_audio_stream(porcupine)
-	cmdr.cmdr = cmdr.CmdrStateEnum.PORCUPINE_LISTENING	# Porcupine begin listening
 
-	# listen for keyword in a loop
-	while True:
-		# from the input audio stream, read in a the specified number of frames
-		pcm = audio_stream.read(porcupine.frame_length)
-		pcm = struct.unpack_from("h" * porcupine.frame_length, pcm)
+def reload_config ( cmdr_state, porcupine, registry, cfg, changes ):
+	"""
+	Config watcher callback (on its thread): apply the `HOT_RELOAD` changes to config.json. Keyword changes build a
+	new Porcupine here, off the audio path, which is swapped into `porcupine` (an `EngineSlot`) between two frames,
+	together with the keyword → command table; Cheetah and the audio stream are left alone
+	"""
+	restart = [ change for change in changes if change not in cmdr_config.affects(changes, HOT_RELOAD) ]
+	if restart:
+		print ( "Config: restart to apply", ', '.join(restart), flush=True )
+
+	running = dict ( cmdr_state.config )
+	if cmdr_config.affects ( changes, ['processes'] ):
+		running['processes'] = cfg.get('processes', {})
+		cmdr_process.supervisor.configure ( running['processes'] )
+	if not cmdr_config.affects ( changes, [key for key in HOT_RELOAD if key.startswith('porcupine.')] ):
+		cmdr_state.config = running
+		return
+
+	start = perf_counter()
+	engine = init_sharded_porcupine ( cfg['porcupine'] )
+	try:
+		if (engine.sample_rate, engine.frame_length) != (porcupine.sample_rate, porcupine.frame_length):
+			raise ValueError ( "the new Porcupine expects a different audio format" )
+		table = registry.rebuilt ( cfg['porcupine']['keywords']['list'], running.get('intents', {}).get('list', []) )
+	except Exception:
+		engine.delete()
+		raise
 
-		keyword_index = porcupine.process(pcm)
-		# if a keyword is detected
-		if keyword_index >= 0:
-			# if there is an active background process, kill it
-			if cmdr.active_process:
-				cmdr.active_process.terminate()
+	running['porcupine'] = cfg['porcupine']
+	def apply ():
+		registry.replace(table)
+		cmdr_state.config = running
+	porcupine.swap ( engine, then=apply )
+	print ( "Config: Porcupine rebuilt with %d keywords in %.0f ms" % (
+		len(cfg['porcupine']['keywords']['list']), (perf_counter() - start) * 1000), flush=True )
 
-			# porcupine keyword detection event
-			handle_keyword_detected ( cmdr, keyword_index, cheetah )
-			cmdr.cmdr = cmdr.CmdrStateEnum.PORCUPINE_LISTENING
 
-	# cleanup
-	cleanup ( porcupine )
 
+def init_async_assistant ( cmdr, audio_stream, porcupine, cheetah, latencies, intent_parser=None, idle_gate=None ):
+	"""
+	Set up the assistant as asyncio tasks (see `cmdr_async.AsyncAssistant`), so that wake words are heard while a
+	command is in progress; ctrl+C cancels the command in progress, or exits. Wake-to-transcript latencies are added to
+	`latencies`. Return the assistant and its registry
+	"""
+	async def on_keyword ( assistant, kw_index, detected_at ):
+		result = await handle_keyword_async ( assistant, kw_index, registry )
+		record_command ( cmdr, kw_index, detected_at, result, latencies )
+
+	assistant = cmdr_async.AsyncAssistant ( cmdr, audio_stream, porcupine, on_keyword, idle_gate, console )
+	registry = init_registry ( cmdr, audio_stream, cheetah, intent_parser,
+		listen=lambda: listen_for_command_async(assistant, cheetah, intent_parser, registry) )
+	return assistant, registry
 
 
-def cleanup ( porcupine ):
+
+def init_config_watcher ( cmdr_state, porcupine, registry ):
+	"""Watch config.json, if the `reload` config section enables it, and apply changes as they come (`reload_config`)"""
+	cfg = cmdr_state.config.get('reload', {})
+	if not cfg.get('enabled', False):
+		return None
+	on_change = lambda new_cfg, changes: reload_config ( cmdr_state, porcupine, registry, new_cfg, changes )
+	return cmdr_config.ConfigWatcher ( cmdr_state.config_file, cmdr_state.config, on_change,
+		cfg.get('interval_s', 1.0) ).start()
+
+
+
+def report_replay ( audio_stream, elapsed, latencies ):
+	"""Print throughput and latency figures for a replayed file"""
+	duration = audio_stream.duration
+	print ( "\nReplayed %.2f s of audio in %.2f s; real-time factor %.3f" % (
+		duration, elapsed, elapsed / duration if duration else 0 ) )
+	for latency in latencies:
+		print ( "Wake-to-transcript latency: %.1f ms" % (latency * 1000) )
+
+
+
+def satellite_loop ( server, stream, porcupine_pool, cheetah_pool, intent_parser=None ):
+	"""
+	Run the keyword → command loop on one satellite's stream, with its own state (on the `server` state's config),
+	and engines leased from the pools (the intent parser is shared)
+	"""
+	cmdr = cmdr_utils.Cmdr ( server.config_file, server.config )
+	cmdr.console = cmdr_metrics.PrintSink ( console.rate_hz, prefix="Satellite %d: " % stream.stream_id )
+	with porcupine_pool.lease() as porcupine, cheetah_pool.lease() as cheetah:
+		print ( "Satellite %d connected" % stream.stream_id, flush=True )
+
+		registry = init_registry ( cmdr, stream, cheetah, intent_parser )
+		listen_loop ( cmdr, stream, porcupine, registry )
+
+		print ( "Satellite %d finished;" % stream.stream_id, stream.stats(), flush=True )
+		cleanup ( None, stream, registry=registry )
+
+
+
+def serve_satellites ( cmdr, urls ):
+	"""
+	Accept PCM from satellite microphones on each of `urls` (see `cmdr_net.parse_address`), and run the
+	keyword → command loop on every stream in its own thread, until interrupted
+	"""
+	cfg = cmdr.config.get('network', {})
+
+	# pre-warmed engines, so that a satellite starts without waiting for models to load
+	porcupine_pool = cmdr_utils.EnginePool ( lambda: init_porcupine(cmdr.config['porcupine']),
+		size=cfg.get('engine_pool', 2), max_size=cfg.get('max_engines'), reset=reset_porcupine, name='porcupine' )
+	cheetah_pool = cmdr_utils.EnginePool ( lambda: init_streaming_cheetah(cmdr.config['cheetah']),
+		size=cfg.get('engine_pool', 2), max_size=cfg.get('max_engines'), reset=lambda cheetah: cheetah.transcribe(),
+		name='cheetah' )
+
+	# the audio format satellites must send
+	with porcupine_pool.lease() as porcupine:
+		sample_rate, frame_length = porcupine.sample_rate, porcupine.frame_length
+
+	# one intent parser (and cache) serves every satellite
+	intent_parser = init_intent_parser ( cmdr.config.get('intents', {}) )
+
+	ingest = cmdr_net.IngestServer (
+		sample_rate, frame_length,
+		on_stream=lambda stream: threading.Thread (
+			target=satellite_loop, args=(cmdr, stream, porcupine_pool, cheetah_pool, intent_parser), daemon=True ).start(),
+		jitter_frames=cmdr_utils.ms_to_frames(cfg.get('jitter_ms', 128), sample_rate, frame_length),
+		ring_frames=cfg.get('ring_frames', 64), stream_timeout_s=cfg.get('stream_timeout_s', 5.0) )
+	for url in urls:
+		ingest.listen(url)
+		print ( "Listening for satellites on", url )
+	ingest.start()
+
+	# report per-stream loss and lag periodically
+	try:
+		while True:
+			sleep ( cfg.get('report_interval_s', 10) )
+			for stream_id, stats in ingest.stats().items():
+				print ( "Satellite %d:" % stream_id, stats, flush=True )
+	finally:
+		ingest.close()
+		porcupine_pool.delete()
+		cheetah_pool.delete()
+
+
+
+def main ( replay=None, realtime=False, listen=None, use_asyncio=False ):
+	# use `break_loop` to handle SIGINT (ctrl+C); set here rather than on import, so that worker processes importing
+	# this module keep ignoring it
+	signal.signal(signal.SIGINT, break_loop)
+
+	# determine platform & machine
+	platform = cmdr_utils.get_platform(True)
+	machine = cmdr_utils.get_machine(True)
+
+	# time each startup phase, from the first import on
+	timer = cmdr_utils.StartupTimer ( STARTED )
+	timer.record ( 'imports', perf_counter() - STARTED )
+
+	# track the state, including any active (background) process
+	cmdr = cmdr_utils.Cmdr()
+
+	# background processes launched by commands are reaped, and timed out, by the supervisor's own thread
+	cmdr_process.supervisor.configure ( cmdr.config.get('processes', {}) )
+
+	# audio comes in over the network from satellite microphones
+	if listen:
+		serve_satellites ( cmdr, listen )
+		return
+
+	# init Porcupine first, so that listening can start as soon as possible
+	porcupine = init_sharded_porcupine ( cmdr.config['porcupine'], timer )
+	porcupine_slot = None
+	if cmdr.config.get('reload', {}).get('enabled', False):
+		porcupine = porcupine_slot = cmdr_config.EngineSlot ( porcupine )		# swappable on config changes
+
+	# init Cheetah; by default it loads in the background, while Porcupine is already listening
+	cheetah = init_lazy_cheetah ( cmdr.config['cheetah'], timer )
+
+	# init the transcript → intent parser, also in the background by default
+	intent_parser = init_intent_parser ( cmdr.config.get('intents', {}), timer )
+
+	# spoken responses; the fixed phrases are rendered in the background, while listening starts
+	cmdr_tts.responder = cmdr_tts.Responder.from_config ( cmdr.config.get('responses', {}) )
+	if cmdr_tts.responder:
+		cmdr_tts.responder.prerender()
+
+	# init the audio source, shared by Porcupine and Cheetah: either a recording to replay, or
+	# the microphone (pyaudio), whose capture runs on its own thread, filling a ring buffer
+	with timer.phase('stream open'):
+		if replay:
+			audio_stream = init_replay_source ( porcupine, replay, cmdr.config.get('audio', {}), realtime )
+		else:
+			audio_stream = init_input_audio_stream ( porcupine, cfg=cmdr.config.get('audio', {}) )
+	timer.report ( "Time to first listen" )
+
+	# optional flight recorder: keep the last seconds of audio in a ring file, saved around each event
+	cmdr.recorder = cmdr_recorder.FlightRecorder.from_config (
+		cmdr.config.get('recorder', {}), porcupine.sample_rate, porcupine.frame_length )
+	if cmdr.recorder:
+		audio_stream = cmdr_recorder.RecordingSource ( audio_stream, cmdr.recorder )
+
+	# optional event history (keywords, transcripts, intents, commands), written in batches on its own thread
+	cmdr.events = cmdr_events.EventStore.from_config ( cmdr.config.get('events', {}) )
+
+	# optional idle mode: skip Porcupine while the room is silent
+	idle_gate = cmdr_vad.EnergyGate.from_config (
+		cmdr.config['porcupine'].get('idle_gate', {}), porcupine.sample_rate, porcupine.frame_length )
+
+	# optional metrics, with every engine call timed
+	console.rate_hz = cmdr.config.get('metrics', {}).get('console_rate_hz', 10)
+	exporter = init_metrics ( cmdr, cmdr.config.get('metrics', {}), audio_stream, idle_gate )
+	if exporter:
+		porcupine = cmdr_metrics.InstrumentedEngine ( porcupine, cmdr.metrics, 'porcupine' )
+		cheetah = cmdr_metrics.InstrumentedEngine ( cheetah, cmdr.metrics, 'cheetah' )
+
+	# keyword → command dispatch table
+	latencies = []
+	if use_asyncio:
+		assistant, registry = init_async_assistant (
+			cmdr, audio_stream, porcupine, cheetah, latencies, intent_parser, idle_gate )
+	else:
+		registry = init_registry ( cmdr, audio_stream, cheetah, intent_parser )
+
+	# optional hot reload of config.json: keyword changes swap in a new Porcupine between frames
+	watcher = init_config_watcher ( cmdr, porcupine_slot, registry ) if porcupine_slot else None
+
+	start = perf_counter()
+	if use_asyncio:
+		asyncio.run ( assistant.run() )
+	else:
+		latencies = listen_loop ( cmdr, audio_stream, porcupine, registry, idle_gate )
+	if replay:
+		report_replay ( audio_stream, perf_counter() - start, latencies )
+
+	# cleanup
+	if watcher:
+		watcher.stop()
+	cheetah.delete()
+	if intent_parser:
+		print ( "Intent cache:", intent_parser.cache_info() )
+		intent_parser.delete()
+	if cmdr_tts.responder:
+		print ( "Responses:", cmdr_tts.responder.stats() )
+		cmdr_tts.responder.close()
+	cleanup ( porcupine, audio_stream, idle_gate, registry )
+	if cmdr.events:
+		cmdr.events.close()
+		print ( "Events:", cmdr.events.stats() )
+	if exporter:
+		exporter.close()
+
+
+
+def cleanup ( porcupine, audio_stream=None, idle_gate=None, registry=None ):
+	if registry:
+		print ( "Command latencies:", registry.stats() )
+	if idle_gate:
+		print ( "Idle gate:", idle_gate.stats() )
+	if cmdr_process.supervisor.stats():
+		print ( "Processes:", cmdr_process.supervisor.stats() )
+	if audio_stream:
+		audio_stream.close()
+	if porcupine is None:		# leased from a pool
+		return
+	if hasattr(porcupine, 'stats'):
+		print ( "Porcupine shards:", porcupine.stats() )
 	porcupine.delete()
 
 
 
 if __name__ == "__main__":
-	main()
\ No newline at end of file
+	parser = argparse.ArgumentParser ( description="Cmdr, an offline voice assistant" )
+	parser.add_argument ( '--replay', metavar='FILE',
+		help="read audio from a 16-bit mono WAV or raw PCM file ('-' for stdin) instead of the microphone" )
+	parser.add_argument ( '--realtime', action='store_true',
+		help="with --replay, pace the audio in real time instead of processing it as fast as possible" )
+	parser.add_argument ( '--listen', metavar='URL', action='append',
+		help="accept audio from satellites on tcp://host:port, udp://host:port or unix:///path (repeatable)" )
+	parser.add_argument ( '--asyncio', action='store_true',
+		help="run capture, detection and commands as asyncio tasks, so wake words are heard during a command" )
+	args = parser.parse_args()
+	main ( replay=args.replay, realtime=args.realtime, listen=args.listen, use_asyncio=args.asyncio )
\ No newline at end of file
@@ -0,0 +1,290 @@
+# asyncio event loop: capture, wake-word detection, transcription and commands as cooperating tasks
+import asyncio
+import contextvars
+import signal
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from time import perf_counter
+
+import cmdr_audio
+import cmdr_utils
+import cmdr_vad
+
+
+# the frames subscribed for the command task in progress, from the frame after its keyword (see `_dispatch`)
+_command_frames = contextvars.ContextVar ( 'command_frames', default=None )
+
+
+
+class FrameBroadcast:
+	"""
+	Fan-out of captured frames to the tasks consuming them (Porcupine always, Cheetah while a command is spoken).
+	Frames are numbered as they are published, and each `(number, frame)` is put on every subscriber's queue; a
+	subscriber that falls `maxsize` frames behind loses its oldest frame (counted in `dropped`). Recent frames are
+	kept (`history`, plus as many as a subscriber may lag behind), so that a new subscriber can start from an earlier
+	frame, e.g. the one after a keyword that Porcupine has only just detected
+	"""
+
+	def __init__ ( self, history=0, maxsize=256 ):
+		self.maxsize = maxsize
+		self.dropped = 0
+		self.published = 0			# frames published so far; the next frame's number
+		self._subscribers = set()
+		self._recent = deque ( maxlen=history + maxsize )
+
+
+	def subscribe ( self, start=None ):
+		"""Return a new queue of frames, starting from frame number `start` if it is still kept (default: the next)"""
+		backlog = [ item for item in self._recent if item[0] >= start ] if start is not None else []
+		queue = asyncio.Queue ( self.maxsize + len(backlog) )
+		for item in backlog:
+			queue.put_nowait(item)
+		self._subscribers.add(queue)
+		return queue
+
+
+	def unsubscribe ( self, queue ):
+		self._subscribers.discard(queue)
+
+
+	def publish ( self, frame ):
+		"""Hand `frame` (or None, at the end of the stream) to every subscriber"""
+		item = None
+		if frame is not None:
+			item = (self.published, frame)
+			self.published += 1
+			self._recent.append(item)
+		for queue in self._subscribers:
+			if queue.full():
+				queue.get_nowait()
+				self.dropped += 1
+			queue.put_nowait(item)
+
+
+
+class _Subscription:
+	"""
+	Frames received from a broadcast subscription, as an audio source (for `cmdr_audio.Reframer`): `read` hands out
+	the frames pushed so far. `available` counts the bytes not yet read out, so that a reframer is only asked for a
+	frame once it can be filled without waiting
+	"""
+
+	def __init__ ( self, sample_rate, frame_length ):
+		self.sample_rate = sample_rate
+		self.frame_length = frame_length
+		self.available = 0
+		self._frames = deque()
+
+
+	def push ( self, frame ):
+		self._frames.append(frame)
+		self.available += len(frame)
+
+
+	def read ( self, timeout=None ):
+		return self._frames.popleft() if self._frames else None
+
+
+
+class AsyncAssistant:
+	"""
+	Runs the assistant as asyncio tasks: a capture task reads the source and broadcasts frames, the detection task
+	runs them through Porcupine, and each detected keyword starts a command task (`on_keyword`), so wake words are
+	still heard while a command is being listened to, transcribed or run. A new wake word cancels the command in
+	progress; so does ctrl+C, which shuts down when no command is running.
+	Engine calls go through ctypes, which releases the GIL, and run on one executor thread per engine (engines are
+	not thread-safe); `run_blocking` runs anything else that blocks (e.g. launching processes) on a shared pool
+	"""
+
+	def __init__ ( self, cmdr_state, audio_stream, porcupine, on_keyword, idle_gate=None, console=None ):
+		self.cmdr = cmdr_state
+		self.audio_stream = audio_stream
+		self.porcupine = porcupine
+		self.on_keyword = on_keyword		# coroutine function (assistant, keyword index, detection time)
+		self.idle_gate = idle_gate
+		self.console = console
+		self.frames = FrameBroadcast ( history=audio_stream.history )
+
+		self._capture_thread = ThreadPoolExecutor ( 1, thread_name_prefix='capture' )
+		self._porcupine_thread = ThreadPoolExecutor ( 1, thread_name_prefix='porcupine' )
+		self._cheetah_thread = ThreadPoolExecutor ( 1, thread_name_prefix='cheetah' )
+		self._commands = ThreadPoolExecutor ( thread_name_prefix='command' )
+		self._command = None		# task of the command in progress
+		self._main = None
+
+
+	async def run_blocking ( self, func, *args, **kwargs ):
+		"""Run a blocking call on the command pool"""
+		return await asyncio.get_running_loop().run_in_executor ( self._commands, partial(func, *args, **kwargs) )
+
+
+	def _read (self):
+		"""Capture thread: read the next frame, and copy it (it is shared with several tasks, for longer than a read)"""
+		pcm = self.audio_stream.read()
+		return None if pcm is None else bytes(pcm)
+
+
+	async def _capture (self):
+		loop = asyncio.get_running_loop()
+		while True:
+			frame = await loop.run_in_executor ( self._capture_thread, self._read )
+			self.frames.publish(frame)
+			if frame is None:
+				return
+
+
+	def _process ( self, frames ):
+		"""
+		Porcupine thread: process a batch of frames (from the idle gate); return the first keyword index (or -1), and
+		how many frames of the batch follow the one it was detected in
+		"""
+		for position, frame in enumerate(frames):
+			keyword_index = cmdr_utils.keyword_index ( self.porcupine.process(frame) )
+			if keyword_index >= 0:
+				return keyword_index, len(frames) - 1 - position
+		return -1, 0
+
+
+	async def _detect (self):
+		"""Run every frame through Porcupine, and start a command task for each keyword detected"""
+		loop = asyncio.get_running_loop()
+		frames = self.frames.subscribe()
+		self.cmdr.state = self.cmdr.CmdrStateEnum.PORCUPINE_LISTENING
+		while True:
+			item = await frames.get()
+			if item is None:
+				break
+			number, frame = item
+			batch = self.idle_gate.feed(frame) if self.idle_gate else (frame,)
+			if not batch:
+				continue
+			keyword_index, after = await loop.run_in_executor ( self._porcupine_thread, self._process, batch )
+			if keyword_index >= 0:
+				self._dispatch ( keyword_index, perf_counter(), number - after )
+
+		# the source ran dry: let the last command finish
+		if self._command:
+			await asyncio.gather ( self._command, return_exceptions=True )
+
+
+	def _dispatch ( self, keyword_index, detected_at, keyword_frame ):
+		# a new wake word interrupts the command in progress, and any background process
+		if self._command and not self._command.done():
+			self._command.cancel()
+		if self.cmdr.active_process:
+			self.cmdr.active_process.terminate()
+
+		# the command hears everything from the frame after its keyword (or the configured pre-roll before it), even
+		# if it only starts listening once Cheetah has loaded
+		frames = self.frames.subscribe ( max(0, keyword_frame + 1 - self.audio_stream.history) )
+		self._command = asyncio.create_task ( self._run_command(keyword_index, detected_at, frames) )
+
+
+	async def _run_command ( self, keyword_index, detected_at, frames ):
+		_command_frames.set(frames)		# this task's context only
+		try:
+			await self.on_keyword ( self, keyword_index, detected_at )
+		except asyncio.CancelledError:
+			print ( "\nCommand cancelled", flush=True )
+		finally:
+			self.frames.unsubscribe(frames)
+			self.cmdr.state = self.cmdr.CmdrStateEnum.PORCUPINE_LISTENING
+
+
+	async def listen ( self, cheetah, cfg, on_partial=None, frames=None ):
+		"""
+		Async counterpart of `cmdr.cheetah_listen`: feed frames to Cheetah until the user stops talking, then return
+		the transcript. `frames` is a subscription to the broadcast, by default the one made for this command when
+		its keyword was detected, so no frame is lost while Cheetah loads. With streaming, `on_partial` is a coroutine
+		function called with the transcript so far; if it returns True, listening stops early. Cancelling the task
+		discards what Cheetah heard
+		"""
+		loop = asyncio.get_running_loop()
+		call = partial ( loop.run_in_executor, self._cheetah_thread )
+		frames = frames or _command_frames.get() or self.frames.subscribe()
+
+		# Cheetah may still be loading: wait for it off the event loop (frames queue up meanwhile)
+		sample_rate, frame_length = await call ( lambda: (cheetah.sample_rate, cheetah.frame_length) )
+		if sample_rate != self.audio_stream.sample_rate:
+			raise ValueError ( "Porcupine and Cheetah expect different sample rates" )
+
+		streaming = cfg.get('streaming', {})
+		pause_ms = streaming.get('pause_ms', 350) if streaming.get('enabled', False) else None
+		endpointer = cmdr_vad.Endpointer.from_config (
+			dict(cfg.get('endpoint', {}), pause_ms=pause_ms), sample_rate, frame_length )
+
+		# re-block the broadcast frames to Cheetah's frame length, if it differs from the capture's
+		source = _Subscription ( self.audio_stream.sample_rate, self.audio_stream.frame_length )
+		reader = cmdr_audio.frame_reader ( source, frame_length )
+		frame_bytes = frame_length * 2
+		self.cmdr.state = self.cmdr.CmdrStateEnum.CHEETAH_LISTENING
+		try:
+			done = False
+			while not done:
+				item = await frames.get()
+				if item is None:
+					break
+				source.push ( item[1] )
+				while not done and source.available >= frame_bytes:
+					done = await self._listen_frame ( reader.read(), call, cheetah, endpointer, pause_ms, on_partial )
+					source.available -= frame_bytes
+
+			self.frames.unsubscribe(frames)
+			if self.console:
+				self.console.flush()
+			self.cmdr.state = self.cmdr.CmdrStateEnum.CHEETAH_TRANSCRIBING
+			return await call ( cheetah.transcribe )
+		except asyncio.CancelledError:
+			self._cheetah_thread.submit ( cheetah.transcribe )		# flush the partial utterance (result discarded)
+			raise
+		finally:
+			self.frames.unsubscribe(frames)
+
+
+	async def _listen_frame ( self, pcm, call, cheetah, endpointer, pause_ms, on_partial ):
+		"""One frame of `listen`; return True once listening is over"""
+		await call ( cheetah.process, pcm )
+
+		done = endpointer.update(pcm)
+		if self.console:
+			self.console.emit ( "%d, " % endpointer.energy )
+		if done:
+			return True
+
+		if pause_ms:
+			if endpointer.paused:
+				await call ( cheetah.end_segment )
+			partial_transcript = cheetah.poll()
+			if partial_transcript is not None and on_partial and await on_partial(partial_transcript):
+				return True
+		return False
+
+
+	def interrupt (self):
+		"""SIGINT: cancel the command in progress or, if there is none, shut down"""
+		if self._command and not self._command.done():
+			self._command.cancel()
+		elif self._main:
+			self._main.cancel()
+
+
+	async def run (self):
+		"""Run until the source is exhausted, or ctrl+C with no command in progress"""
+		loop = asyncio.get_running_loop()
+		self._main = asyncio.current_task()
+		loop.add_signal_handler ( signal.SIGINT, self.interrupt )
+		capture = asyncio.create_task ( self._capture() )
+		try:
+			await self._detect()
+		except asyncio.CancelledError:
+			pass
+		finally:
+			loop.remove_signal_handler ( signal.SIGINT )
+			capture.cancel()
+			if self._command and not self._command.done():
+				self._command.cancel()
+			await asyncio.gather ( capture, *(self._command,) if self._command else (), return_exceptions=True )
+			for executor in (self._porcupine_thread, self._cheetah_thread, self._commands):
+				executor.shutdown()
+			self._capture_thread.shutdown ( wait=False )		# may be blocked in `read` until the source closes
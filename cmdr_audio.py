@@ -0,0 +1,399 @@
+# audio sources, capture and buffering
+import sys
+import threading
+import wave
+from time import perf_counter, sleep
+
+import pyaudio
+
+
+
+class FrameRingBuffer:
+	"""
+	Fixed-capacity ring of equally sized 16-bit PCM frames, shared by one producer thread and one consumer thread.
+	All storage is allocated up front. No locks are taken: only the producer advances `head` and only the consumer
+	advances `tail`, so each index has a single writer.
+	When the ring is full, incoming frames are dropped and counted in `overruns` rather than blocking the producer.
+	The last `history` consumed frames are never overwritten, so the consumer can `rewind` into them (pre-roll)
+	"""
+
+	def __init__ ( self, frame_length, capacity, sample_width=2, history=0 ):
+		if not 0 <= history < capacity:
+			raise ValueError("Ring history (%d frames) must be smaller than its capacity (%d)" % (history, capacity))
+		self.frame_length = frame_length
+		self.frame_bytes = frame_length * sample_width
+		self.capacity = capacity
+		self.history = history
+
+		self._buffer = bytearray(self.frame_bytes * capacity)
+		view = memoryview(self._buffer)
+		self._slots = [ view[i * self.frame_bytes : (i + 1) * self.frame_bytes] for i in range(capacity) ]
+
+		self._head = 0			# total frames written (producer only)
+		self._tail = 0			# total frames consumed (consumer only)
+		self._held = False		# the consumer still holds the frame at `tail`
+		self._data_ready = threading.Event()
+		self._closed = False
+
+		# counters, for monitoring whether the consumer keeps up
+		self.overruns = 0		# frames dropped because the ring was full
+		self.max_depth = 0		# high-water mark of `depth`
+
+
+	@property
+	def depth (self):
+		"""Number of frames written but not yet handed to the consumer"""
+		return self._head - self._tail - self._held
+
+
+	@property
+	def free (self):
+		"""Number of frames that can be written before the ring is full"""
+		return self.capacity - self.history - (self._head - self._tail)
+
+
+	def write ( self, data ):
+		"""Copy one frame into the ring (producer side); return False and count an overrun if the ring is full"""
+		head = self._head
+		if head - self._tail >= self.capacity - self.history:
+			self.overruns += 1
+			return False
+
+		self._slots[head % self.capacity][:] = data
+		self._head = head + 1
+
+		depth = self._head - self._tail
+		if depth > self.max_depth:
+			self.max_depth = depth
+		self._data_ready.set()
+		return True
+
+
+	def read ( self, timeout=None ):
+		"""
+		Return the next frame as a writable memoryview into the ring (consumer side), or None on timeout/close.
+		The view stays valid until the next call to `read` or `release`; copy it if it must outlive that
+		"""
+		self.release()
+		while self._head == self._tail:
+			if self._closed:
+				return None
+			self._data_ready.clear()
+			if self._head != self._tail:
+				break
+			if not self._data_ready.wait(timeout):
+				return None
+
+		self._held = True
+		return self._slots[self._tail % self.capacity]
+
+
+	def release (self):
+		"""Hand the frame returned by the last `read` back to the producer"""
+		if self._held:
+			self._held = False
+			self._tail += 1
+
+
+	def rewind ( self, frames ):
+		"""
+		Step the consumer back over up to `frames` already consumed frames (at most `history`), so that they are
+		read again; return the number of frames actually rewound
+		"""
+		self.release()
+		frames = min(frames, self.history, self._tail)
+		self._tail -= frames
+		return frames
+
+
+	def close (self):
+		"""Wake up a blocked consumer; `read` returns None once the ring has drained"""
+		self._closed = True
+		self._data_ready.set()
+
+
+
+class AudioSource:
+	"""
+	Anything 16-bit mono PCM frames are read from: a microphone, a file, a pipe.
+	Subclasses set `sample_rate` and `frame_length` and implement `read`. Like `FrameRingBuffer.read`, a returned frame
+	is only valid until the next call to `read`
+	"""
+
+	sample_rate = None
+	frame_length = None
+	history = 0			# frames that can be replayed with `rewind`
+
+
+	def read ( self, timeout=None ):
+		"""Return the next frame of `frame_length` samples, or None once the source is exhausted (or on timeout)"""
+		raise NotImplementedError
+
+
+	def rewind ( self, frames ):
+		"""Replay up to `frames` (at most `history`) recently read frames on the next reads; return how many"""
+		return 0
+
+
+	@property
+	def overruns (self):
+		"""Frames lost because the consumer fell behind"""
+		return 0
+
+
+	def stats (self):
+		"""Return a dict of source counters"""
+		return {}
+
+
+	def close (self):
+		"""Release the underlying device or file"""
+		pass
+
+
+	def __enter__ (self):
+		return self
+
+
+	def __exit__ ( self, *exc_info ):
+		self.close()
+
+
+
+class MicrophoneCapture ( AudioSource ):
+	"""
+	Long-lived PyAudio input stream in callback mode.
+	PortAudio's capture thread copies each buffer into a `FrameRingBuffer`, so a slow consumer never stalls the
+	device read; consumers pull frames with `read`.
+	One capture is meant to be opened once and shared by every engine (see `frame_reader`).
+	Devices that can't deliver mono at `sample_rate` are opened at their own rate and channel count, and their
+	buffers go through a `cmdr_dsp.InputConditioner` on the way into the ring
+	"""
+
+	def __init__ ( self, sample_rate, frame_length, device=None, ring_frames=64, preroll_frames=0, conditioner=None ):
+		self.sample_rate = sample_rate
+		self.frame_length = frame_length
+		self.history = preroll_frames
+		self.ring = FrameRingBuffer(frame_length, ring_frames + preroll_frames, history=preroll_frames)
+		self.input_overflows = 0	# overflows reported by PortAudio itself
+		self._conditioner = conditioner
+
+		rate, channels, frames_per_buffer = sample_rate, 1, frame_length
+		if conditioner is not None:
+			rate, channels = conditioner.in_rate, conditioner.channels
+			frames_per_buffer = -(-frame_length * rate // sample_rate)		# about one engine frame per buffer
+
+		self._pa = pyaudio.PyAudio()
+		self._stream = self._pa.open(
+			rate=rate,						# sample rate (samples/second)
+			channels=channels,				# single channel input, unless conditioned
+			format=pyaudio.paInt16,			# 16-bit encoding
+			input=True,						# use as input
+			frames_per_buffer=frames_per_buffer,	# samples/buffer
+			input_device_index=device,		# leave as None to use sys default input device
+			stream_callback=self._callback
+		)
+
+
+	def _callback ( self, in_data, frame_count, time_info, status_flags ):
+		"""PortAudio capture thread: copy the buffer into the ring (conditioned, if need be) and return immediately"""
+		if status_flags & pyaudio.paInputOverflow:
+			self.input_overflows += 1
+		if self._conditioner is None:
+			self.ring.write(in_data)
+		else:
+			self._conditioner.process ( in_data, self.ring.write )
+		return (None, pyaudio.paContinue)
+
+
+	def read ( self, timeout=None ):
+		"""Return the next captured frame (see `FrameRingBuffer.read`)"""
+		return self.ring.read(timeout)
+
+
+	def rewind ( self, frames ):
+		"""Replay up to `frames` recently consumed frames (pre-roll) on the next reads"""
+		return self.ring.rewind(frames)
+
+
+	@property
+	def overruns (self):
+		return self.ring.overruns
+
+
+	def stats (self):
+		"""Return a dict of capture counters"""
+		return {
+			'overruns': self.ring.overruns,
+			'input_overflows': self.input_overflows,
+			'depth': self.ring.depth,
+			'max_depth': self.ring.max_depth,
+		}
+
+
+	def close (self):
+		"""Stop capturing and release the PortAudio instance"""
+		self._stream.stop_stream()
+		self._stream.close()
+		self._pa.terminate()
+		self.ring.close()
+
+
+
+class StreamSource ( AudioSource ):
+	"""
+	Raw 16-bit mono PCM read from a binary stream (file, pipe, stdin) with `readinto`, into preallocated frames.
+	The last partial frame is padded with silence. With `realtime`, reads are paced to the sample rate as if captured
+	live; otherwise the stream is consumed as fast as possible
+	"""
+
+	def __init__ ( self, stream, sample_rate, frame_length, realtime=False, history=0, close_stream=True ):
+		self.sample_rate = sample_rate
+		self.frame_length = frame_length
+		self.realtime = realtime
+		self.history = history
+		self.frame_bytes = frame_length * 2
+		self.frames_read = 0		# frames read from the stream so far
+
+		self._stream = stream
+		self._close_stream = close_stream
+		self._replay = 0			# rewound frames still to be served again
+		self._start = None			# wall clock time of the first read, for pacing
+
+		# the last `history` frames stay intact for `rewind`, plus the one being served
+		view = memoryview ( bytearray(self.frame_bytes * (history + 1)) )
+		self._slots = [ view[i * self.frame_bytes : (i + 1) * self.frame_bytes] for i in range(history + 1) ]
+
+
+	def read ( self, timeout=None ):
+		if self._replay:
+			self._replay -= 1
+			return self._slots[(self.frames_read - 1 - self._replay) % len(self._slots)]
+
+		slot = self._slots[self.frames_read % len(self._slots)]
+		filled = 0
+		while filled < self.frame_bytes:		# pipes may return short reads
+			count = self._stream.readinto(slot[filled:])
+			if not count:
+				break
+			filled += count
+		if not filled:
+			return None
+		if filled < self.frame_bytes:
+			slot[filled:] = bytes(self.frame_bytes - filled)
+
+		if self.realtime:
+			if self._start is None:
+				self._start = perf_counter()
+			ahead = self._start + self.frames_read * self.frame_length / self.sample_rate - perf_counter()
+			if ahead > 0:
+				sleep(ahead)
+
+		self.frames_read += 1
+		return slot
+
+
+	def rewind ( self, frames ):
+		frames = max ( 0, min(frames, self.history - self._replay, self.frames_read - self._replay) )
+		self._replay += frames
+		return frames
+
+
+	@property
+	def duration (self):
+		"""Seconds of audio read so far"""
+		return self.frames_read * self.frame_length / self.sample_rate
+
+
+	def stats (self):
+		return { 'frames_read': self.frames_read, 'duration': self.duration }
+
+
+	def close (self):
+		if self._close_stream:
+			self._stream.close()
+
+
+
+class _WaveStream:
+	"""Adapt a `wave.Wave_read` to the `readinto` interface used by StreamSource"""
+
+	def __init__ ( self, wav ):
+		self._wav = wav
+
+	def readinto ( self, buffer ):
+		data = self._wav.readframes ( len(buffer) // self._wav.getsampwidth() )
+		buffer[:len(data)] = data
+		return len(data)
+
+	def close (self):
+		self._wav.close()
+
+
+
+def open_wave ( file_path, sample_rate, frame_length, **kwargs ):
+	"""Return a StreamSource reading a 16-bit mono WAV file recorded at `sample_rate`"""
+	wav = wave.open ( file_path, 'rb' )
+	if wav.getnchannels() != 1 or wav.getsampwidth() != 2 or wav.getframerate() != sample_rate:
+		wav.close()
+		raise ValueError ( "%s: expected 16-bit mono audio at %d Hz" % (file_path, sample_rate) )
+	return StreamSource ( _WaveStream(wav), sample_rate, frame_length, **kwargs )
+
+
+
+def open_source ( spec, sample_rate, frame_length, **kwargs ):
+	"""
+	Return an AudioSource for `spec`: '-' reads raw PCM from stdin (e.g. a pipe), '*.wav' a WAV file,
+	and anything else is read as a raw 16-bit mono PCM file
+	"""
+	if spec == '-':
+		return StreamSource ( sys.stdin.buffer, sample_rate, frame_length, close_stream=False, **kwargs )
+	if spec.lower().endswith('.wav'):
+		return open_wave ( spec, sample_rate, frame_length, **kwargs )
+	return StreamSource ( open(spec, 'rb'), sample_rate, frame_length, **kwargs )
+
+
+
+class Reframer:
+	"""
+	Re-block frames read from `source` into frames of `frame_length` samples, for an engine whose frame length differs
+	from the capture's. Uses one preallocated output buffer; the returned view is valid until the next `read`
+	"""
+
+	def __init__ ( self, source, frame_length, sample_width=2 ):
+		self.source = source
+		self.frame_length = frame_length
+		self.sample_rate = source.sample_rate
+		self.frame_bytes = frame_length * sample_width
+
+		self._buffer = bytearray(self.frame_bytes)
+		self._view = memoryview(self._buffer)
+		self._pending = None	# the source frame currently being drained
+		self._offset = 0		# bytes of `_pending` already copied out
+
+
+	def read ( self, timeout=None ):
+		"""Return the next frame of `frame_length` samples, or None if the source ran dry"""
+		filled = 0
+		while filled < self.frame_bytes:
+			if self._pending is None or self._offset == len(self._pending):
+				self._pending = self.source.read(timeout)
+				self._offset = 0
+				if self._pending is None:
+					return None
+				self._pending = memoryview(self._pending).cast('B')
+
+			count = min(self.frame_bytes - filled, len(self._pending) - self._offset)
+			self._view[filled : filled + count] = self._pending[self._offset : self._offset + count]
+			self._offset += count
+			filled += count
+
+		return self._view
+
+
+
+def frame_reader ( source, frame_length ):
+	"""Return something with a `read()` that yields frames of `frame_length` samples from `source`"""
+	if source.frame_length == frame_length:
+		return source
+	return Reframer ( source, frame_length )
@@ -0,0 +1,304 @@
+#!/bin/python3
+# micro-benchmarks of cmdr's own audio hot path, with stand-in engines, compared against a JSON baseline
+import argparse
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from statistics import median
+from time import perf_counter_ns
+
+import numpy as np
+
+import cmdr_utils
+import cmdr_audio
+import cmdr_vad
+import cmdr_registry
+
+
+# stand-in for Porcupine's and Cheetah's libraries: the same entry points, doing next to nothing, so that what is
+# timed is cmdr's side of each call (reading, marshalling, dispatch). A frame starting with 12345 is a detection of
+# the keyword whose index is in the second sample
+FAKE_ENGINES_C = r'''
+#include <stdio.h>
+#include <stdlib.h>
+
+typedef struct { int num_keywords; long frames; } handle_t;
+
+int pv_sample_rate (void) { return 16000; }
+int pv_porcupine_frame_length (void) { return 512; }
+int pv_cheetah_frame_length (void) { return 512; }
+
+int pv_porcupine_multiple_keywords_init ( const char *model, int num_keywords, const char **keywords,
+		const float *sensitivities, handle_t **handle ) {
+	*handle = calloc ( 1, sizeof(handle_t) );
+	(*handle)->num_keywords = num_keywords;
+	return 0;
+}
+
+int pv_porcupine_multiple_keywords_process ( handle_t *handle, const short *pcm, int *result ) {
+	handle->frames++;
+	*result = pcm[0] == 12345 && pcm[1] >= 0 && pcm[1] < handle->num_keywords ? pcm[1] : -1;
+	return 0;
+}
+
+void pv_porcupine_delete ( handle_t *handle ) { free(handle); }
+
+int pv_cheetah_init ( const char *acoustic_model, const char *language_model, const char *license,
+		handle_t **handle ) {
+	*handle = calloc ( 1, sizeof(handle_t) );
+	return 0;
+}
+
+int pv_cheetah_process ( handle_t *handle, const short *pcm ) { handle->frames++; return 0; }
+
+int pv_cheetah_transcribe ( handle_t *handle, char **transcript ) {
+	*transcript = malloc ( 32 );
+	snprintf ( *transcript, 32, "%ld frames", handle->frames );
+	handle->frames = 0;
+	return 0;
+}
+
+void pv_cheetah_delete ( handle_t *handle ) { free(handle); }
+'''
+
+
+
+class FakeEngines:
+	"""
+	Builds the stand-in library with the system C compiler (`cc`, or $CC) into a scratch directory, next to empty model
+	and keyword files, and makes real Porcupine and Cheetah binding objects on top of it
+	"""
+
+	def __init__ ( self, keywords=5 ):
+		self.dir = tempfile.TemporaryDirectory ( prefix='cmdr_bench_' )
+		source = os.path.join ( self.dir.name, 'fake_engines.c' )
+		self.library_path = os.path.join ( self.dir.name, 'libfake_engines.so' )
+		with open ( source, 'w' ) as f:
+			f.write ( FAKE_ENGINES_C )
+		compiler = os.environ.get ( 'CC', 'cc' )
+		try:
+			subprocess.run ( [compiler, '-O2', '-shared', '-fPIC', '-o', self.library_path, source], check=True )
+		except (OSError, subprocess.CalledProcessError) as e:
+			raise RuntimeError ( "Could not build the stand-in engine library with '%s': %s" % (compiler, e) )
+
+		self.model_path = self._touch ( 'model.pv' )
+		self.keyword_paths = [ self._touch('keyword_%d.ppn' % index) for index in range(keywords) ]
+
+
+	def _touch ( self, name ):
+		file_path = os.path.join ( self.dir.name, name )
+		open ( file_path, 'w' ).close()
+		return file_path
+
+
+	def porcupine (self):
+		from porcupine import Porcupine
+		return Porcupine ( self.library_path, self.model_path, keyword_file_paths=self.keyword_paths,
+			sensitivities=[0.5] * len(self.keyword_paths) )
+
+
+	def cheetah (self):
+		from cheetah import Cheetah
+		return Cheetah ( self.library_path, self.model_path, self.model_path, self.model_path )
+
+
+	def close (self):
+		self.dir.cleanup()
+
+
+
+def noise_frames ( count, frame_length, seed=1 ):
+	"""`count` frames of 16-bit noise, as one bytes object (deterministic, without NumPy's RNG)"""
+	samples = (np.arange(count * frame_length, dtype=np.int64) * 2654435761 + seed) % 6001 - 3000
+	return samples.astype('<i2').tobytes()
+
+
+
+# each benchmark: setup(engines) → (op, cleanup); `op()` is one unit of work, timed per call
+BENCHMARKS = {}
+
+def benchmark ( name ):
+	def register ( setup ):
+		BENCHMARKS[name] = setup
+		return setup
+	return register
+
+
+
+@benchmark ( 'frame_decode' )
+def _frame_decode ( engines ):
+	"""Read one frame of raw PCM from a stream (`StreamSource.read`), rewinding at the end"""
+	data = noise_frames ( 256, 512 )
+	stream = io.BytesIO(data)
+	source = cmdr_audio.StreamSource ( stream, 16000, 512, close_stream=False )
+	def op ():
+		if source.read() is None:
+			stream.seek(0)
+	return op, source.close
+
+
+@benchmark ( 'porcupine_process' )
+def _porcupine_process ( engines ):
+	"""`Porcupine.process` on a bytes frame: buffer resolution, the ctypes call and status check"""
+	porcupine = engines.porcupine()
+	frame = noise_frames ( 1, porcupine.frame_length )
+	return (lambda: porcupine.process(frame)), porcupine.delete
+
+
+@benchmark ( 'porcupine_process_list' )
+def _porcupine_process_list ( engines ):
+	"""`Porcupine.process` on a list of ints (the original, unpacked frames)"""
+	porcupine = engines.porcupine()
+	frame = list ( memoryview(noise_frames(1, porcupine.frame_length)).cast('h') )
+	return (lambda: porcupine.process(frame)), porcupine.delete
+
+
+@benchmark ( 'cheetah_process' )
+def _cheetah_process ( engines ):
+	cheetah = engines.cheetah()
+	frame = noise_frames ( 1, cheetah.frame_length )
+	return (lambda: cheetah.process(frame)), cheetah.delete
+
+
+@benchmark ( 'energy_abs_list_avg' )
+def _energy_abs_list_avg ( engines ):
+	"""Mean absolute amplitude in pure Python (`cmdr_utils.abs_list_avg`, as the original listen loop did)"""
+	frame = list ( memoryview(noise_frames(1, 512)).cast('h') )
+	return (lambda: cmdr_utils.abs_list_avg(frame)), None
+
+
+@benchmark ( 'energy_rms' )
+def _energy_rms ( engines ):
+	"""Frame RMS as computed now (`cmdr_vad.FrameEnergy`)"""
+	energy = cmdr_vad.FrameEnergy ( 512 )
+	frame = noise_frames ( 1, 512 )
+	return (lambda: energy.rms(frame)), None
+
+
+@benchmark ( 'keyword_dispatch' )
+def _keyword_dispatch ( engines ):
+	"""Keyword index → command: registry lookup and handler call (with its latency accounting)"""
+	registry = cmdr_registry.CommandRegistry()
+	registry.register ( 'noop', lambda: None )
+	registry.load_keywords ( [{}] * 5, default={'handler': 'noop'} )
+	return (lambda: registry.get(3)()), None
+
+
+@benchmark ( 'listen_loop_frame' )
+def _listen_loop_frame ( engines ):
+	"""One frame through `cmdr.listen_loop` (read, overrun check, Porcupine), with no keyword in the audio"""
+	import cmdr
+	porcupine = engines.porcupine()
+	frames = 256
+	data = noise_frames ( frames, porcupine.frame_length )
+	state = cmdr_utils.Cmdr()
+	registry = cmdr_registry.CommandRegistry()
+	def op ():
+		source = cmdr_audio.StreamSource ( io.BytesIO(data), porcupine.sample_rate, porcupine.frame_length )
+		cmdr.listen_loop ( state, source, porcupine, registry )
+	op.frames = frames		# one call covers this many frames
+	return op, porcupine.delete
+
+
+
+def run ( names, number, repeat ):
+	"""Run the named benchmarks; return {name: figures}, with per-operation times in microseconds"""
+	engines = FakeEngines()
+	results = {}
+	try:
+		for name in names:
+			op, cleanup = BENCHMARKS[name](engines)
+			per_call = getattr ( op, 'frames', 1 )
+			calls = max ( 1, number // per_call )
+			op()		# warm up (lazy imports, first-call caches)
+			times = []
+			for _ in range(repeat):
+				start = perf_counter_ns()
+				for _ in range(calls):
+					op()
+				times.append ( (perf_counter_ns() - start) / (calls * per_call) / 1000 )
+			if cleanup:
+				cleanup()
+			results[name] = {
+				'median_us': round(median(times), 4),
+				'min_us': round(min(times), 4),
+				'ops': calls * per_call,
+				'repeat': repeat,
+			}
+	finally:
+		engines.close()
+	return results
+
+
+
+def compare ( results, baseline, threshold ):
+	"""Return the benchmarks whose median is more than `threshold` (a fraction) slower than in `baseline`"""
+	regressions = []
+	for name, figures in results.items():
+		base = baseline.get('results', {}).get(name)
+		if base and figures['median_us'] > base['median_us'] * (1 + threshold):
+			regressions.append ( (name, base['median_us'], figures['median_us']) )
+	return regressions
+
+
+
+def environment ():
+	return {
+		'python': platform.python_version(),
+		'implementation': platform.python_implementation(),
+		'machine': platform.machine(),
+		'system': platform.system(),
+	}
+
+
+
+def main ():
+	parser = argparse.ArgumentParser ( description="Time cmdr's own audio hot path, with stand-in engines" )
+	parser.add_argument ( 'benchmarks', nargs='*', metavar='NAME',
+		help="benchmarks to run (default: all of %s)" % ', '.join(BENCHMARKS) )
+	parser.add_argument ( '--number', type=int, default=20000, help="operations per repeat" )
+	parser.add_argument ( '--repeat', type=int, default=5, help="repeats; the median is compared" )
+	parser.add_argument ( '--baseline', metavar='FILE', help="JSON baseline to compare against" )
+	parser.add_argument ( '--threshold', type=float, default=0.2,
+		help="fail if a median is more than this fraction slower than the baseline (default: 0.2)" )
+	parser.add_argument ( '--save', metavar='FILE', help="write the results as a new baseline" )
+	args = parser.parse_args()
+
+	names = args.benchmarks or list(BENCHMARKS)
+	unknown = [ name for name in names if name not in BENCHMARKS ]
+	if unknown:
+		parser.error ( "unknown benchmark(s): %s" % ', '.join(unknown) )
+
+	results = run ( names, args.number, args.repeat )
+	baseline = None
+	if args.baseline:
+		with open ( args.baseline ) as f:
+			baseline = json.load(f)
+
+	print ( "  %-24s %12s %12s %10s" % ('benchmark', 'median µs', 'min µs', 'baseline') )
+	for name, figures in results.items():
+		base = baseline and baseline.get('results', {}).get(name)
+		change = '%+9.1f%%' % ((figures['median_us'] / base['median_us'] - 1) * 100) if base else '%10s' % '-'
+		print ( "  %-24s %12.3f %12.3f %s" % (name, figures['median_us'], figures['min_us'], change) )
+
+	if args.save:
+		with open ( args.save, 'w' ) as f:
+			json.dump ( {'environment': environment(), 'results': results}, f, indent='\t' )
+
+	if baseline:
+		if baseline.get('environment') != environment():
+			print ( "Warning: the baseline was recorded on", baseline.get('environment'), file=sys.stderr )
+		regressions = compare ( results, baseline, args.threshold )
+		for name, before, after in regressions:
+			print ( "Regression: %s %.3f µs → %.3f µs" % (name, before, after), file=sys.stderr )
+		if regressions:
+			sys.exit(1)
+
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,191 @@
+# config hot reload: watch config.json, validate and diff new versions, and swap engines in between frames
+import json
+import os
+import threading
+from sys import stderr
+
+
+
+def load ( file ):
+	with open(file) as f:
+		return json.load(f)
+
+
+
+def validate ( cfg ):
+	"""Check the parts of `cfg` that a running Cmdr relies on; raise ValueError listing every problem found"""
+	problems = []
+	if not isinstance(cfg, dict):
+		raise ValueError ( "config must be a JSON object" )
+	porcupine = cfg.get('porcupine')
+	if not isinstance(porcupine, dict):
+		problems.append ( "missing 'porcupine' section" )
+	else:
+		for key in ('root_path', 'lib_path'):
+			if not isinstance(porcupine.get(key), str):
+				problems.append ( "porcupine.%s must be a path" % key )
+		if not isinstance(porcupine.get('shards', 1), int) or porcupine.get('shards', 1) < 1:
+			problems.append ( "porcupine.shards must be a positive integer" )
+		keywords = porcupine.get('keywords', {}).get('list')
+		if not keywords:
+			problems.append ( "porcupine.keywords.list must list at least one keyword" )
+		for index, keyword in enumerate(keywords or []):
+			for key in ('prefix', 'title'):
+				if not isinstance(keyword.get(key), str):
+					problems.append ( "keyword %d: '%s' must be a string" % (index, key) )
+			sensitivity = keyword.get('sensitivity')
+			if not isinstance(sensitivity, (int, float)) or not 0 <= sensitivity <= 1:
+				problems.append ( "keyword %d: sensitivity must be between 0 and 1" % index )
+			if 'action' in keyword and not isinstance(keyword['action'].get('handler'), str):
+				problems.append ( "keyword %d: action must name a handler" % index )
+	if problems:
+		raise ValueError ( '; '.join(problems) )
+	return cfg
+
+
+
+def diff ( old, new, prefix='' ):
+	"""Return the dotted paths of the leaves (non-dict values, lists included) that differ between `old` and `new`"""
+	changes = []
+	for key in sorted ( set(old) | set(new), key=str ):
+		path = prefix + str(key)
+		a, b = old.get(key), new.get(key)
+		if isinstance(a, dict) and isinstance(b, dict):
+			changes.extend ( diff(a, b, path + '.') )
+		elif a != b:
+			changes.append(path)
+	return changes
+
+
+
+def affects ( changes, prefixes ):
+	"""The changed paths under any of `prefixes` (dotted paths, matched whole component by component)"""
+	return [ change for change in changes
+		if any(change == prefix or change.startswith(prefix + '.') for prefix in prefixes) ]
+
+
+
+class EngineSlot:
+	"""
+	Stand-in for an engine that can be replaced while it is in use: `swap` only queues the new engine, and the thread
+	that runs the engine installs it at the start of its next `process` call, so no frame ever sees a half-swapped
+	engine. `then`, if given, runs at the same moment (on that thread), e.g. to swap the matching dispatch table.
+	The old engine is deleted on a thread of its own
+	"""
+
+	def __init__ ( self, engine ):
+		self.engine = engine
+		self.swaps = 0
+		self._pending = None
+		self._lock = threading.Lock()
+
+
+	def swap ( self, engine, then=None ):
+		with self._lock:
+			replaced, self._pending = self._pending, (engine, then)
+		if replaced:
+			replaced[0].delete()		# never installed
+
+
+	def _install (self):
+		with self._lock:
+			pending, self._pending = self._pending, None
+		if pending is None:			# taken by `delete` since the caller looked
+			return
+		engine, then = pending
+		old, self.engine = self.engine, engine
+		if then:
+			then()
+		self.swaps += 1
+		threading.Thread ( target=old.delete, daemon=True ).start()
+
+
+	def process ( self, pcm ):
+		if self._pending is not None:		# unlocked hint; `_install` takes it under the lock
+			self._install()
+		return self.engine.process(pcm)
+
+
+	def process_many ( self, pcm ):
+		if self._pending is not None:
+			self._install()
+		return self.engine.process_many(pcm)
+
+
+	def __getattr__ ( self, name ):
+		return getattr ( self.engine, name )
+
+
+	def delete (self):
+		with self._lock:
+			pending, self._pending = self._pending, None
+		if pending:
+			pending[0].delete()
+		self.engine.delete()
+
+
+
+class ConfigWatcher:
+	"""
+	Polls `path` every `interval_s` on a thread of its own. When the file changes, the new version is parsed and
+	validated; if it is valid and differs from the last valid version, `on_change(new config, changed paths)` is called
+	on the watcher thread. Invalid versions are reported and otherwise ignored, so a half-saved file does no harm
+	"""
+
+	def __init__ ( self, path, config, on_change, interval_s=1.0 ):
+		self.path = path
+		self.config = config			# last valid version
+		self.on_change = on_change
+		self.interval_s = interval_s
+		self._signature = self._stat()
+		self._stop = threading.Event()
+		self._thread = threading.Thread ( target=self._run, name='config-watcher', daemon=True )
+
+
+	def _stat (self):
+		try:
+			st = os.stat(self.path)
+		except FileNotFoundError:
+			return None
+		return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+	def start (self):
+		self._thread.start()
+		return self
+
+
+	def _run (self):
+		while not self._stop.wait(self.interval_s):
+			signature = self._stat()
+			if signature is None or signature == self._signature:
+				continue
+			self._signature = signature
+			self.check()
+
+
+	def check (self):
+		"""
+		Load, validate and diff the file now; return the changed paths (None if the new version is invalid or could not
+		be applied, in which case the last applied version is kept and diffed against next time)
+		"""
+		try:
+			config = validate ( load(self.path) )
+		except (ValueError, TypeError, AttributeError, OSError) as e:		# incl. JSON syntax errors
+			print ( "Config: ignoring invalid '%s' -" % self.path, e, file=stderr, flush=True )
+			return None
+		changes = diff ( self.config, config )
+		if changes:
+			try:
+				self.on_change ( config, changes )
+			except Exception as e:
+				print ( "Config: could not apply changes -", e, file=stderr, flush=True )
+				return None
+			self.config = config
+		return changes
+
+
+	def stop (self):
+		self._stop.set()
+		if self._thread.is_alive():
+			self._thread.join()
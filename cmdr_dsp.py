@@ -0,0 +1,148 @@
+# input conditioning: bring any capture device's PCM to the engines' rate and format (mono int16), with NumPy
+from math import gcd, ceil
+
+import numpy as np
+
+
+
+def polyphase_filter ( up, down, taps_per_phase=32, beta=8.0 ):
+	"""
+	Design the anti-aliasing low-pass (windowed sinc) for resampling by `up`/`down`, and return it split into its
+	`up` phases: row `p` holds taps `p, p + up, p + 2*up, ...` of the prototype filter.
+	The filter is sized by the larger of `up` and `down`: when decimating, each phase gets `taps_per_phase * down / up`
+	taps, so that the transition band stays as narrow relative to the output rate. With the defaults, the stopband is
+	at least 80 dB down from 1.11 times the lower Nyquist frequency (8.9 kHz for 48 → 16 kHz), and the passband loses
+	less than 1 dB up to 0.875 times it (7 kHz)
+	"""
+	taps_per_phase = ceil ( taps_per_phase * max(up, down) / up )
+	length = up * taps_per_phase
+	cutoff = 0.5 / max(up, down) * 0.95			# relative to the upsampled rate; a little below Nyquist
+	n = np.arange(length) - (length - 1) / 2
+	prototype = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, beta) * up
+	return prototype.reshape(taps_per_phase, up).T.astype(np.float32).copy()
+
+
+
+class InputConditioner:
+	"""
+	Turn blocks of interleaved int16 PCM from a capture device into frames for the engines: select or down-mix
+	channels, apply gain, and resample from `in_rate` to `out_rate` with a polyphase FIR filter.
+	Each block is processed as a whole with vectorized NumPy operations into buffers allocated up front for blocks of
+	up to `max_block` samples (per channel); filter state carries over between blocks, so the output is seamless.
+	`process` hands out full frames of `frame_length` samples
+	"""
+
+	def __init__ ( self, in_rate, out_rate, frame_length, channels=1, mix=None, gain_db=0.0, max_block=4096,
+			taps_per_phase=32 ):
+		self.in_rate = in_rate
+		self.out_rate = out_rate
+		self.frame_length = frame_length
+		self.channels = channels
+		self.max_block = max_block
+		self.gain = float(10 ** (gain_db / 20))
+
+		# channels to average; None means all of them
+		mix = list(range(channels)) if mix is None else ([mix] if isinstance(mix, int) else list(mix))
+		if not mix or not all(0 <= channel < channels for channel in mix):
+			raise ValueError ( "Channels to mix %s are out of range for a %d-channel device" % (mix, channels) )
+		self._weights = np.zeros(channels, np.float32)
+		self._weights[mix] = self.gain / len(mix)		# down-mix and gain are one matrix-vector product
+
+		divisor = gcd(in_rate, out_rate)
+		self.up = out_rate // divisor
+		self.down = in_rate // divisor
+		self.resampling = self.up != self.down
+		if self.resampling:
+			self._phases = polyphase_filter ( self.up, self.down, taps_per_phase )
+			self._taps = self._phases.shape[1]
+		else:
+			self._taps = 1
+		self._time = 0			# next output instant, in 1/up input samples, relative to the current block
+
+		# preallocated working buffers
+		max_out = ceil(max_block * self.up / self.down) + 1
+		self._mono = np.zeros(self._taps - 1 + max_block, np.float32)	# filter history, then the current block
+		self._gather = np.empty((max_out, self._taps), np.float32)
+		self._coeffs = np.empty((max_out, self._taps), np.float32)
+		self._out = np.empty(max_out, np.float32)
+		self._lag = np.arange(self._taps)[::-1]								# history samples covered by each tap
+		self._steps = self.down * np.arange(max_out)
+		self._instants = np.empty(max_out, np.int64)
+		self._phase = np.empty(max_out, np.int64)
+		self._index = np.empty((max_out, self._taps), np.int64)
+		self._frames = np.zeros(frame_length + max_out, np.int16)			# whole frames, plus a partial one
+		self._filled = 0		# samples in `_frames` from the partial frame left last time
+		self._frame_bytes = memoryview(self._frames).cast('B')
+
+
+	def _resample ( self, block ):
+		"""Run the polyphase filter over `block` (already in `_mono`); return a view of the output samples"""
+		taps = self._taps
+		limit = block * self.up
+		count = max(0, ceil((limit - self._time) / self.down))
+
+		# output instants, the input sample each one lines up with, and the filter phase it needs
+		instants = self._instants[:count]
+		np.add ( self._steps[:count], self._time, out=instants )
+		phase = self._phase[:count]
+		np.remainder ( instants, self.up, out=phase )
+		index = self._index[:count]
+		np.add ( (instants // self.up)[:, None], self._lag, out=index )
+
+		gather = self._gather[:count]
+		np.take ( self._mono, index, out=gather )
+		coeffs = self._coeffs[:count]
+		np.take ( self._phases, phase, axis=0, out=coeffs )
+		gather *= coeffs
+		out = self._out[:count]
+		np.sum ( gather, axis=1, out=out )
+
+		self._time += count * self.down - limit
+		# keep the last `taps - 1` input samples as history for the next block
+		self._mono[:taps - 1] = self._mono[block : block + taps - 1]
+		return out
+
+
+	def process ( self, data, write ):
+		"""
+		Condition one block of interleaved int16 samples (bytes-like), and pass each complete output frame to
+		`write` (e.g. `FrameRingBuffer.write`, which copies it); return the number of frames written
+		"""
+		samples = np.frombuffer(data, np.int16)
+		block = len(samples) // self.channels
+		if block > self.max_block:
+			raise ValueError ( "Block of %d samples exceeds the conditioner's %d" % (block, self.max_block) )
+
+		mono = self._mono[self._taps - 1 : self._taps - 1 + block]
+		np.dot ( samples.reshape(block, self.channels), self._weights, out=mono )
+		out = self._resample(block) if self.resampling else mono
+
+		# convert to int16 after the partial frame left over last time, and cut whole frames
+		np.clip ( out, -32768, 32767, out=out )
+		end = self._filled + len(out)
+		self._frames[self._filled : end] = out
+		frame_bytes = self.frame_length * 2
+		count = end // self.frame_length
+		for start in range(0, count * frame_bytes, frame_bytes):
+			write ( self._frame_bytes[start : start + frame_bytes] )
+
+		# move what is left of a partial frame to the front
+		whole = count * self.frame_length
+		self._frames[:end - whole] = self._frames[whole:end]
+		self._filled = end - whole
+		return count
+
+
+	@classmethod
+	def from_config ( cls, cfg, out_rate, frame_length ):
+		"""
+		Build a conditioner from a device profile in the `audio.devices` config section, or return None if the device
+		already delivers what the engines expect
+		"""
+		in_rate = cfg.get('sample_rate', out_rate)
+		channels = cfg.get('channels', 1)
+		if in_rate == out_rate and channels == 1 and not cfg.get('gain_db'):
+			return None
+		return cls ( in_rate, out_rate, frame_length, channels=channels, mix=cfg.get('mix'),
+			gain_db=cfg.get('gain_db', 0.0), taps_per_phase=cfg.get('taps_per_phase', 32),
+			max_block=cfg.get('max_block', 4096) )
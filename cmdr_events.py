@@ -0,0 +1,259 @@
+#!/bin/python3
+# event history: keyword, transcript, intent and command events in SQLite, written in batches off the audio path
+import argparse
+import json
+import queue
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from time import time, strftime, localtime
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS events (
+	id INTEGER PRIMARY KEY,
+	time REAL NOT NULL,			-- unix time (s)
+	kind TEXT NOT NULL,			-- keyword, transcript, intent, command
+	keyword INTEGER,			-- keyword index
+	name TEXT,					-- keyword title, intent name
+	text TEXT,					-- transcript
+	latency_ms REAL,
+	bucket INTEGER,				-- latency bucket (see `latency_bucket`)
+	data TEXT					-- anything else, as JSON
+);
+CREATE INDEX IF NOT EXISTS events_time ON events (time);
+CREATE INDEX IF NOT EXISTS events_kind_time ON events (kind, time);
+CREATE INDEX IF NOT EXISTS events_keyword_time ON events (keyword, time) WHERE keyword IS NOT NULL;
+CREATE INDEX IF NOT EXISTS events_bucket_time ON events (bucket, time) WHERE bucket IS NOT NULL;
+'''
+
+_INSERT = 'INSERT INTO events (time, kind, keyword, name, text, latency_ms, bucket, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?)'
+
+
+
+def latency_bucket ( latency_ms ):
+	"""Power-of-two latency bucket: 0 below 1 ms, then b for [2^(b-1), 2^b) ms"""
+	return None if latency_ms is None else int(latency_ms).bit_length()
+
+
+
+class EventHistory:
+	"""Queries over an event database written by `EventStore`"""
+
+	def __init__ ( self, path ):
+		self.path = path
+
+
+	def query ( self, since=None, until=None, kind=None, keyword=None, min_latency_ms=None, max_latency_ms=None,
+			limit=1000 ):
+		"""
+		Events (as dicts, newest first) in a time range, optionally of one `kind`, for one `keyword` and/or within a
+		latency range. Each filter maps onto an index; latency ranges are narrowed by bucket first
+		"""
+		where, args = self._filters ( since, until, kind, keyword, min_latency_ms, max_latency_ms )
+		sql = 'SELECT * FROM events%s ORDER BY time DESC LIMIT ?' % where
+		with self._read() as connection:
+			connection.row_factory = sqlite3.Row
+			rows = connection.execute ( sql, args + [limit] ).fetchall()
+		events = []
+		for row in rows:
+			event = dict(row)
+			event.update ( json.loads(event.pop('data') or '{}') )
+			events.append(event)
+		return events
+
+
+	def summary ( self, since=None, until=None, kind='command' ):
+		"""Per keyword: event count, and counts per latency bucket (upper bound in ms → count)"""
+		where, args = self._filters ( since, until, kind )
+		sql = 'SELECT keyword, bucket, count(*) FROM events%s GROUP BY keyword, bucket' % where
+		with self._read() as connection:
+			rows = connection.execute ( sql, args ).fetchall()
+		keywords = {}
+		for keyword, bucket, count in rows:
+			figures = keywords.setdefault ( keyword, {'count': 0, 'latency_ms': {}} )
+			figures['count'] += count
+			if bucket is not None:
+				figures['latency_ms'][1 << bucket] = count
+		return keywords
+
+
+	def _filters ( self, since=None, until=None, kind=None, keyword=None, min_latency_ms=None, max_latency_ms=None ):
+		clauses, args = [], []
+		def add ( clause, *values ):
+			clauses.append(clause)
+			args.extend(values)
+		if since is not None:
+			add ( 'time >= ?', since )
+		if until is not None:
+			add ( 'time < ?', until )
+		if kind is not None:
+			add ( 'kind = ?', kind )
+		if keyword is not None:
+			add ( 'keyword = ?', keyword )
+		if min_latency_ms is not None or max_latency_ms is not None:
+			low = latency_bucket ( min_latency_ms or 0 )
+			if max_latency_ms is None:
+				add ( 'bucket >= ? AND latency_ms >= ?', low, min_latency_ms or 0 )
+			else:
+				add ( 'bucket BETWEEN ? AND ? AND latency_ms BETWEEN ? AND ?',
+					low, latency_bucket(max_latency_ms), min_latency_ms or 0, max_latency_ms )
+		return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), args
+
+
+	@contextmanager
+	def _read (self):
+		"""Short-lived read-only connection"""
+		connection = sqlite3.connect ( 'file:%s?mode=ro' % self.path, uri=True )
+		try:
+			yield connection
+		finally:
+			connection.close()
+
+
+
+class EventStore ( EventHistory ):
+	"""
+	Append-only event history in a SQLite database (WAL mode), indexed by time, kind, keyword and latency bucket.
+	`record` only puts the event on a bounded queue (dropping, and counting, what overflows it); a writer thread
+	inserts queued events in batches of up to `batch_size`, one transaction each, at least every `flush_interval_s`.
+	Retention runs on the same thread every `retention_interval_s`: events older than `max_age_days` go, then the
+	oldest beyond `max_events`
+	"""
+
+	def __init__ ( self, path, batch_size=256, flush_interval_s=1.0, max_events=None, max_age_days=None,
+			retention_interval_s=60, max_queue=10000 ):
+		super().__init__(path)
+		self.batch_size = batch_size
+		self.flush_interval_s = flush_interval_s
+		self.max_events = max_events
+		self.max_age_days = max_age_days
+		self.retention_interval_s = retention_interval_s
+		self.written = 0
+		self.dropped = 0
+		self.deleted = 0
+
+		connection = self.connect()		# creates the schema up front, so that queries work before the first write
+		connection.close()
+		self._queue = queue.Queue ( max_queue )
+		self._thread = threading.Thread ( target=self._writer, name='event-writer', daemon=True )
+		self._thread.start()
+
+
+	@classmethod
+	def from_config ( cls, cfg ):
+		"""Build a store from the `events` config section, or return None if it is disabled"""
+		if not cfg.get('enabled', False):
+			return None
+		return cls ( cfg.get('path', 'events.db'), cfg.get('batch_size', 256), cfg.get('flush_interval_s', 1.0),
+			cfg.get('max_events'), cfg.get('max_age_days'), cfg.get('retention_interval_s', 60) )
+
+
+	def connect (self):
+		connection = sqlite3.connect ( self.path )
+		connection.execute ( 'PRAGMA journal_mode=WAL' )		# readers don't block the writer, nor the other way round
+		connection.execute ( 'PRAGMA synchronous=NORMAL' )
+		connection.executescript ( SCHEMA )
+		return connection
+
+
+	def record ( self, kind, keyword=None, name=None, text=None, latency_ms=None, **data ):
+		"""Queue an event (hot path: no I/O)"""
+		try:
+			self._queue.put_nowait ( (time(), kind, keyword, name, text, latency_ms, latency_bucket(latency_ms),
+				json.dumps(data) if data else None) )
+		except queue.Full:
+			self.dropped += 1
+
+
+	def _writer (self):
+		connection = self.connect()
+		next_retention = time()
+		closing = False
+		while not closing:
+			batch = []
+			try:
+				item = self._queue.get ( timeout=self.flush_interval_s )
+				while item is not None:
+					batch.append(item)
+					if len(batch) >= self.batch_size:
+						break
+					item = self._queue.get_nowait()
+				closing = item is None
+			except queue.Empty:
+				pass
+			if batch:
+				with connection:
+					connection.executemany ( _INSERT, batch )
+				self.written += len(batch)
+			if closing or time() >= next_retention:
+				self._retain(connection)
+				next_retention = time() + self.retention_interval_s
+		connection.close()
+
+
+	def _retain ( self, connection ):
+		with connection:
+			if self.max_age_days:
+				self.deleted += connection.execute ( 'DELETE FROM events WHERE time < ?',
+					(time() - self.max_age_days * 86400,) ).rowcount
+			if self.max_events:
+				# ids only grow, so the newest `max_events` are the highest ids
+				self.deleted += connection.execute ( 'DELETE FROM events WHERE id <= (SELECT max(id) FROM events) - ?',
+					(self.max_events,) ).rowcount
+
+
+	def stats (self):
+		return { 'written': self.written, 'dropped': self.dropped, 'deleted': self.deleted, 'queued': self._queue.qsize() }
+
+
+	def close (self):
+		"""Write out what is queued, apply retention, and stop the writer"""
+		self._queue.put(None)
+		self._thread.join()
+
+
+
+def parse_time ( value ):
+	"""Unix time from 'YYYY-MM-DD[ HH:MM]', or from a duration ago: '90s', '30m', '12h', '7d'"""
+	match = re.fullmatch ( r'(\d+(?:\.\d+)?)([smhd])', value )
+	if match:
+		return time() - float(match.group(1)) * {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[match.group(2)]
+	from datetime import datetime
+	return datetime.fromisoformat(value).timestamp()
+
+
+
+def main ():
+	parser = argparse.ArgumentParser ( description="Query Cmdr's event history" )
+	parser.add_argument ( 'database', nargs='?', default='events.db' )
+	parser.add_argument ( '--since', type=parse_time, help="start time: a date, or a duration ago (e.g. 7d, 12h)" )
+	parser.add_argument ( '--until', type=parse_time, help="end time, in the same formats" )
+	parser.add_argument ( '--kind', choices=('keyword', 'transcript', 'intent', 'command') )
+	parser.add_argument ( '--keyword', type=int, metavar='INDEX' )
+	parser.add_argument ( '--latency', metavar='MIN-MAX', help="latency range in ms, e.g. 100-500 or 1000-" )
+	parser.add_argument ( '--limit', type=int, default=50 )
+	parser.add_argument ( '--summary', action='store_true', help="per-keyword command counts and latency histograms" )
+	args = parser.parse_args()
+
+	store = EventHistory ( args.database )
+	if args.summary:
+		for keyword, figures in sorted ( store.summary(args.since, args.until).items(), key=lambda item: str(item[0]) ):
+			histogram = ', '.join ( '<%d ms: %d' % item for item in sorted(figures['latency_ms'].items()) )
+			print ( "keyword %s: %d command(s); %s" % (keyword, figures['count'], histogram) )
+		return
+
+	low = high = None
+	if args.latency:
+		low, _, high = args.latency.partition('-')
+		low, high = float(low or 0), float(high) if high else None
+	for event in reversed ( store.query(args.since, args.until, args.kind, args.keyword, low, high, args.limit) ):
+		latency = '%8.1f ms' % event['latency_ms'] if event['latency_ms'] is not None else '%11s' % ''
+		fields = ' '.join ( str(event[key]) for key in ('keyword', 'name', 'text') if event[key] is not None )
+		print ( strftime('%Y-%m-%d %H:%M:%S', localtime(event['time'])), '%-10s' % event['kind'], latency, fields )
+
+
+
+if __name__ == "__main__":
+	main()
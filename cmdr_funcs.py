@@ -1,5 +1,5 @@
-# std imports
-from subprocess import Popen, DEVNULL
+# utils
+import cmdr_process
 
 
 
@@ -13,8 +13,9 @@ def play_despacito ():
 def play_audio_background ( audio_file_path ):
 	"""
 	Using `ffplay`, a `ffmpeg` utility, to play audio in background.  
-	Return the process object so that it can be manipulated (i.e. send SIGINT, SIGTERM)
+	Return the process object so that it can be manipulated (i.e. send SIGINT, SIGTERM); the process supervisor
+	reaps it once it exits
 	"""
 	cmdlist = [ 'ffplay', '-nodisp', audio_file_path ]
 	print ( ' $', ' '.join(cmdlist) )
-	return Popen ( cmdlist, stdout=DEVNULL )
\ No newline at end of file
+	return cmdr_process.supervisor.launch ( cmdlist, action='play_audio_background' )
\ No newline at end of file
@@ -0,0 +1,86 @@
+# intent parsing: map Cheetah transcripts to the commands declared in config
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+
+Intent = namedtuple ( 'Intent', ['name', 'slots'] )		# `slots` are the named groups of a regex pattern
+
+_PUNCTUATION = re.compile ( r"[^\w' ]+" )
+_WHITESPACE = re.compile ( r"\s+" )
+
+
+
+def normalize ( transcript ):
+	"""Lower-case `transcript`, drop punctuation and collapse whitespace, so that equivalent commands look the same"""
+	return _WHITESPACE.sub ( ' ', _PUNCTUATION.sub(' ', transcript.lower()) ).strip()
+
+
+
+class IntentParser:
+	"""
+	Match transcripts against the intents in config. Each intent may list `patterns` (regular expressions, matched
+	against the whole normalized transcript, whose named groups become slots) and `tokens` (spaCy Matcher patterns,
+	e.g. on LEMMA). Everything is compiled once, up front; spaCy is only loaded if some intent uses token patterns,
+	and only with the pipeline components that token patterns need.
+	Results are kept in an LRU cache keyed by normalized transcript, so repeated commands skip matching entirely
+	"""
+
+	def __init__ ( self, cfg ):
+		self._regexes = []			# (intent name, compiled pattern), in config order
+		token_patterns = []			# (intent name, [spaCy patterns])
+		for intent in cfg.get('list', []):
+			for pattern in intent.get('patterns', []):
+				self._regexes.append ( (intent['name'], re.compile(pattern)) )
+			if intent.get('tokens'):
+				token_patterns.append ( (intent['name'], intent['tokens']) )
+
+		self._nlp = None
+		self._matcher = None
+		if token_patterns:
+			self._load_spacy ( cfg, token_patterns )
+
+		self.parse = lru_cache ( maxsize=cfg.get('cache_size', 256) )(self._parse)
+
+
+	def _load_spacy ( self, cfg, token_patterns ):
+		"""Load the spaCy pipeline once, without the components token patterns don't use, and build the Matcher"""
+		import spacy
+		from spacy.matcher import Matcher
+
+		self._nlp = spacy.load ( cfg.get('spacy_model', 'en'), disable=cfg.get('disable', ['parser', 'ner']) )
+		self._matcher = Matcher ( self._nlp.vocab )
+		for name, patterns in token_patterns:
+			if int(spacy.__version__.split('.')[0]) >= 3:
+				self._matcher.add ( name, patterns )
+			else:
+				self._matcher.add ( name, None, *patterns )
+
+
+	def _parse ( self, text ):
+		"""Return the Intent for an already normalized transcript, or None"""
+		for name, regex in self._regexes:
+			match = regex.fullmatch(text)
+			if match:
+				return Intent ( name, match.groupdict() )
+
+		if self._matcher is not None and text:
+			matches = self._matcher ( self._nlp(text) )
+			if matches:
+				match_id = min(matches, key=lambda match: match[1])[0]		# the earliest match in the sentence
+				return Intent ( self._nlp.vocab.strings[match_id], {} )
+		return None
+
+
+	def match ( self, transcript ):
+		"""Return the Intent `transcript` expresses, or None"""
+		return self.parse ( normalize(transcript) )
+
+
+	def cache_info (self):
+		return self.parse.cache_info()
+
+
+	def delete (self):
+		"""Drop cached results (for symmetry with the engines, which are all `delete`d on cleanup)"""
+		self.parse.cache_clear()
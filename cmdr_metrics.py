@@ -0,0 +1,325 @@
+# metrics: latency histograms around engine calls and state changes, exported for Prometheus or as JSON
+import json
+import os
+import sys
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter, sleep, time
+
+
+
+class Histogram:
+	"""
+	HDR-style latency histogram: values (recorded in seconds, kept in microseconds) fall into log-linear buckets with
+	`2 ** precision_bits` sub-buckets per power of two, so every value is kept within about 1.6% (at the default 7
+	bits) from a microsecond up to `highest` seconds. Buckets are allocated up front; `record` is a few integer
+	operations and one list increment
+	"""
+
+	def __init__ ( self, highest=60.0, precision_bits=7 ):
+		self.sub_bits = precision_bits
+		self.sub_count = 1 << precision_bits
+		self.half = self.sub_count >> 1
+		self.highest = int(highest * 1e6)
+		self.counts = [0] * (self._index(self.highest) + 1)
+		self.count = 0
+		self.total = 0.0			# seconds
+		self.min = None
+		self.max = 0.0
+
+
+	def _index ( self, value ):
+		"""Bucket index of `value` (microseconds)"""
+		if value < self.sub_count:
+			return value
+		shift = value.bit_length() - self.sub_bits
+		return self.sub_count + (shift - 1) * self.half + (value >> shift) - self.half
+
+
+	def _value ( self, index ):
+		"""Middle of bucket `index`, in microseconds"""
+		if index < self.sub_count:
+			return index
+		shift = (index - self.sub_count) // self.half + 1
+		mantissa = (index - self.sub_count) % self.half + self.half
+		return (mantissa << shift) + (1 << shift) / 2
+
+
+	def record ( self, seconds ):
+		value = min ( int(seconds * 1e6), self.highest )
+		self.counts[self._index(value)] += 1
+		self.count += 1
+		self.total += seconds
+		if seconds > self.max:
+			self.max = seconds
+		if self.min is None or seconds < self.min:
+			self.min = seconds
+
+
+	def percentile ( self, q ):
+		"""Value (seconds) below which a fraction `q` of the recorded values fall"""
+		if not self.count:
+			return 0.0
+		target = max ( 1, q * self.count )
+		seen = 0
+		for index, count in enumerate(self.counts):
+			seen += count
+			if seen >= target:
+				return min ( self._value(index) / 1e6, self.max )
+		return self.max
+
+
+	def summary (self):
+		return {
+			'count': self.count,
+			'sum': self.total,
+			'min': self.min or 0.0,
+			'max': self.max,
+			'p50': self.percentile(0.5),
+			'p90': self.percentile(0.9),
+			'p99': self.percentile(0.99),
+			'p999': self.percentile(0.999),
+		}
+
+
+
+class Metrics:
+	"""
+	Registry of histograms, counters and gauges (callables sampled at export time), keyed by metric name and an
+	optional Prometheus label string such as 'state="IDLE"'
+	"""
+
+	QUANTILES = ( 0.5, 0.9, 0.99, 0.999 )
+
+	def __init__ ( self, prefix='cmdr_' ):
+		self.prefix = prefix
+		self.histograms = {}		# (name, labels) -> Histogram
+		self.counters = {}			# (name, labels) -> int
+		self.gauges = {}			# (name, labels) -> callable
+		self._state_since = perf_counter()
+
+
+	def histogram ( self, name, labels='' ):
+		key = (self.prefix + name, labels)
+		histogram = self.histograms.get(key)
+		if histogram is None:
+			histogram = self.histograms[key] = Histogram()
+		return histogram
+
+
+	def observe ( self, name, seconds, labels='' ):
+		self.histogram(name, labels).record(seconds)
+
+
+	def count ( self, name, amount=1, labels='' ):
+		key = (self.prefix + name, labels)
+		self.counters[key] = self.counters.get(key, 0) + amount
+
+
+	def gauge ( self, name, read, labels='' ):
+		"""Report `read()` as a gauge at export time"""
+		self.gauges[(self.prefix + name, labels)] = read
+
+
+	def state_hook ( self, old, new ):
+		"""`Cmdr` state hook: count transitions and time spent in each state"""
+		now = perf_counter()
+		if old is not None:
+			self.observe ( 'state_seconds', now - self._state_since, 'state="%s"' % old.name )
+			self.count ( 'state_transitions_total', labels='from="%s",to="%s"' % (old.name, new.name) )
+		self._state_since = now
+
+
+	def prometheus (self):
+		"""Everything, in the Prometheus text exposition format (histograms as summaries)"""
+		lines = []
+		typed = set()
+		def declare ( name, kind ):
+			if name not in typed:
+				typed.add(name)
+				lines.append ( "# TYPE %s %s" % (name, kind) )
+		def labelled ( name, labels, extra='' ):
+			inner = ','.join ( part for part in (labels, extra) if part )
+			return '%s{%s}' % (name, inner) if inner else name
+
+		for (name, labels), histogram in sorted(self.histograms.items()):
+			if not histogram.count:
+				continue
+			declare ( name, 'summary' )
+			for q in self.QUANTILES:
+				lines.append ( "%s %.9f" % (labelled(name, labels, 'quantile="%s"' % q), histogram.percentile(q)) )
+			lines.append ( "%s %.9f" % (labelled(name + '_sum', labels), histogram.total) )
+			lines.append ( "%s %d" % (labelled(name + '_count', labels), histogram.count) )
+		for (name, labels), value in sorted(self.counters.items()):
+			declare ( name, 'counter' )
+			lines.append ( "%s %d" % (labelled(name, labels), value) )
+		for (name, labels), read in sorted(self.gauges.items()):
+			declare ( name, 'gauge' )
+			lines.append ( "%s %s" % (labelled(name, labels), read()) )
+		return '\n'.join(lines) + '\n'
+
+
+	def as_dict (self):
+		"""Everything, as a JSON-friendly dict"""
+		key = lambda name, labels: '%s{%s}' % (name, labels) if labels else name
+		return {
+			'time': time(),
+			'histograms': { key(*k): histogram.summary() for k, histogram in self.histograms.items() if histogram.count },
+			'counters': { key(*k): value for k, value in self.counters.items() },
+			'gauges': { key(*k): read() for k, read in self.gauges.items() },
+		}
+
+
+
+class InstrumentedEngine:
+	"""
+	Proxy for an engine (Porcupine, Cheetah, or a stand-in for either) that times each call to `methods` into the
+	histogram '<name>_<method>_seconds'; anything else is forwarded untouched
+	"""
+
+	def __init__ ( self, engine, metrics, name, methods=('process', 'process_many', 'transcribe') ):
+		self._engine = engine
+		for method in methods:
+			setattr ( self, method, self._timed(method, metrics.histogram('%s_%s_seconds' % (name, method))) )
+
+
+	def _timed ( self, method, histogram ):
+		engine = self._engine
+		def timed ( *args ):
+			start = perf_counter()
+			try:
+				return getattr(engine, method)(*args)		# looked up per call: `engine` may still be loading
+			finally:
+				histogram.record ( perf_counter() - start )
+		return timed
+
+
+	def __getattr__ ( self, name ):
+		return getattr ( self._engine, name )
+
+
+
+class PrintSink:
+	"""
+	Console output kept off the audio path: `emit` only appends to a bounded buffer (dropping, and counting, what
+	overflows it), and a thread writes the buffer out in one go at most `rate_hz` times a second.
+	With a `prefix`, each write is a whole line starting with it, so that sinks sharing a terminal never interleave
+	"""
+
+	_write_lock = threading.Lock()		# shared by every sink
+
+	def __init__ ( self, rate_hz=10, max_items=4096, file=None, prefix=None ):
+		self.rate_hz = rate_hz
+		self.prefix = prefix
+		self.dropped = 0
+		self._items = deque ( maxlen=max_items )
+		self._file = file
+		self._lock = threading.Lock()
+		self._thread = None
+
+
+	def emit ( self, text ):
+		if self._thread is None:
+			self._thread = threading.Thread ( target=self._run, daemon=True )
+			self._thread.start()
+		if len(self._items) == self._items.maxlen:
+			self.dropped += 1
+		self._items.append(text)
+
+
+	def _run (self):
+		while True:
+			sleep ( 1 / self.rate_hz )
+			self.flush()
+
+
+	def flush (self):
+		"""Write out whatever is buffered now"""
+		with self._lock:
+			items = []
+			while self._items:
+				items.append ( self._items.popleft() )
+			if items:
+				text = ''.join(items)
+				if self.prefix is not None:
+					text = self.prefix + text.rstrip('\n') + '\n'
+				file = self._file or sys.stdout
+				with self._write_lock:
+					file.write(text)
+					file.flush()
+
+
+
+class MetricsExporter:
+	"""
+	Serve `metrics` over HTTP on `host`:`port` (Prometheus text at /metrics, JSON at /metrics.json), and/or write
+	them to `json_path` every `json_interval_s`; both run on their own threads
+	"""
+
+	def __init__ ( self, metrics, port=None, host='127.0.0.1', json_path=None, json_interval_s=10 ):
+		self.metrics = metrics
+		self.json_path = json_path
+		self.json_interval_s = json_interval_s
+		self._server = None
+		if port:
+			self._server = ThreadingHTTPServer ( (host, port), self._handler() )
+			self._server.daemon_threads = True
+
+
+	@classmethod
+	def from_config ( cls, metrics, cfg ):
+		return cls ( metrics, port=cfg.get('prometheus_port'), host=cfg.get('host', '127.0.0.1'),
+			json_path=cfg.get('json_path'), json_interval_s=cfg.get('json_interval_s', 10) )
+
+
+	def _handler (self):
+		metrics = self.metrics
+		class Handler ( BaseHTTPRequestHandler ):
+			def do_GET (self):
+				if self.path == '/metrics':
+					body, kind = metrics.prometheus().encode(), 'text/plain; version=0.0.4'
+				elif self.path == '/metrics.json':
+					body, kind = json.dumps(metrics.as_dict()).encode(), 'application/json'
+				else:
+					self.send_error(404)
+					return
+				self.send_response(200)
+				self.send_header ( 'Content-Type', kind )
+				self.send_header ( 'Content-Length', str(len(body)) )
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message ( self, *args ):
+				pass			# no per-scrape console noise
+		return Handler
+
+
+	def start (self):
+		if self._server:
+			threading.Thread ( target=self._server.serve_forever, daemon=True ).start()
+		if self.json_path:
+			threading.Thread ( target=self._write_json, daemon=True ).start()
+		return self
+
+
+	def _write_json (self):
+		while True:
+			sleep ( self.json_interval_s )
+			self.write_json()
+
+
+	def write_json (self):
+		"""Replace `json_path` with the current metrics (atomically, so readers never see a partial file)"""
+		temp_path = self.json_path + '.tmp'
+		with open ( temp_path, 'w' ) as f:
+			json.dump ( self.metrics.as_dict(), f, indent='\t' )
+		os.replace ( temp_path, self.json_path )
+
+
+	def close (self):
+		if self._server:
+			self._server.shutdown()
+			self._server.server_close()
+		if self.json_path:
+			self.write_json()
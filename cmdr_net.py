@@ -0,0 +1,372 @@
+# network PCM ingestion: satellite microphones stream frames to cmdr over TCP, UDP or Unix sockets
+import os
+import selectors
+import socket
+import struct
+import threading
+from time import perf_counter
+from urllib.parse import urlparse
+
+import cmdr_audio
+
+
+# every packet (UDP) or record (TCP/Unix stream) is a fixed-size header followed by one frame of 16-bit mono PCM
+HEADER = struct.Struct('<IIQ')		# stream id, sequence number, sender timestamp (microseconds)
+END_OF_STREAM = 0xFFFFFFFF			# sequence number of the (empty-payload) packet closing a stream; its timestamp
+									# field holds the number of frames sent, so that trailing losses are counted
+
+
+
+def parse_address ( url ):
+	"""Split 'tcp://host:port', 'udp://host:port' or 'unix:///path' into `(scheme, address)`"""
+	parts = urlparse(url)
+	if parts.scheme == 'unix':
+		return 'unix', parts.path
+	if parts.scheme in ('tcp', 'udp'):
+		return parts.scheme, (parts.hostname or '0.0.0.0', parts.port)
+	raise ValueError ( "Unsupported address '%s'; expected tcp://, udp:// or unix://" % url )
+
+
+
+def connect ( url ):
+	"""Return a socket connected to `url` (sender side); UDP sockets are connected too, so `send` works everywhere"""
+	scheme, address = parse_address(url)
+	if scheme == 'unix':
+		sock = socket.socket ( socket.AF_UNIX, socket.SOCK_STREAM )
+	elif scheme == 'tcp':
+		sock = socket.socket ( socket.AF_INET, socket.SOCK_STREAM )
+		sock.setsockopt ( socket.IPPROTO_TCP, socket.TCP_NODELAY, 1 )
+	else:
+		sock = socket.socket ( socket.AF_INET, socket.SOCK_DGRAM )
+	sock.connect(address)
+	return sock
+
+
+
+class NetworkStream ( cmdr_audio.AudioSource ):
+	"""
+	One satellite's audio, reassembled from sequenced frames. A small jitter buffer of `jitter_frames` preallocated
+	slots puts reordered packets back in order; a gap still open when the buffer is full is treated as packet loss
+	and played out as silence. In-order frames land in a `FrameRingBuffer` that the engines `read` from.
+	`last_arrival` (perf_counter time) lets the server close a stream whose sender went away without saying so
+	"""
+
+	def __init__ ( self, stream_id, sample_rate, frame_length, jitter_frames=8, ring_frames=64 ):
+		self.stream_id = stream_id
+		self.sample_rate = sample_rate
+		self.frame_length = frame_length
+		self.ring = cmdr_audio.FrameRingBuffer ( frame_length, ring_frames )
+
+		frame_bytes = frame_length * 2
+		view = memoryview ( bytearray(frame_bytes * jitter_frames) )
+		self._slots = [ view[i * frame_bytes : (i + 1) * frame_bytes] for i in range(jitter_frames) ]
+		self._present = [False] * jitter_frames
+		self._silence = bytes(frame_bytes)
+		self._expected = None		# next sequence number to play out
+
+		# counters
+		self.received = 0
+		self.lost = 0				# frames never received, replaced by silence
+		self.late = 0				# frames that arrived after their slot was played out (or duplicates)
+		self.lag = 0.0				# how far arrival lags the sender's clock, relative to the first packet (s)
+		self.max_lag = 0.0
+		self.last_arrival = perf_counter()
+		self._clock_offset = None
+
+
+	def put ( self, seq, timestamp, payload ):
+		"""Network thread: accept one frame with sequence number `seq` and sender timestamp (microseconds)"""
+		self.received += 1
+		now = self.last_arrival = perf_counter()
+		if self._clock_offset is None:
+			self._clock_offset = now - timestamp / 1e6
+			self._expected = seq
+		self.lag = now - timestamp / 1e6 - self._clock_offset
+		if self.lag > self.max_lag:
+			self.max_lag = self.lag
+
+		if seq < self._expected:
+			self.late += 1
+			return
+
+		window = len(self._slots)
+		while seq >= self._expected + window:		# the oldest gap can not be filled any more
+			self._play_out()
+
+		index = seq % window
+		if self._present[index]:
+			self.late += 1
+			return
+		self._slots[index][:] = payload
+		self._present[index] = True
+		while self._present[self._expected % window]:
+			self._play_out()
+
+
+	def _play_out (self):
+		"""Move the frame at the head of the jitter buffer (or silence, if it never arrived) into the ring"""
+		index = self._expected % len(self._slots)
+		if self._present[index]:
+			self.ring.write ( self._slots[index] )
+			self._present[index] = False
+		else:
+			self.ring.write ( self._silence )
+			self.lost += 1
+		self._expected += 1
+
+
+	def finish ( self, end_seq=None ):
+		"""
+		Network thread: the sender is done; play out what is buffered and let readers drain the ring. `end_seq`, if
+		known (from the end-of-stream packet), is the number of frames sent: those after the last one received are lost
+		"""
+		if self._expected is not None:
+			while any(self._present):
+				self._play_out()
+		if end_seq is not None:
+			self.lost += max ( 0, end_seq - (self._expected or 0) )
+		self.ring.close()
+
+
+	@property
+	def full (self):
+		"""True while the ring has no room for a whole jitter buffer (the most one frame can play out)"""
+		return self.ring.free <= len(self._slots)
+
+
+	def read ( self, timeout=None ):
+		return self.ring.read(timeout)
+
+
+	@property
+	def overruns (self):
+		return self.ring.overruns
+
+
+	def stats (self):
+		return {
+			'received': self.received,
+			'lost': self.lost,
+			'late': self.late,
+			'overruns': self.ring.overruns,
+			'depth': self.ring.depth,
+			'lag_ms': round(self.lag * 1000, 1),
+			'max_lag_ms': round(self.max_lag * 1000, 1),
+		}
+
+
+
+class _Connection:
+	"""Receive state of one stream socket: a preallocated record buffer, filled with `recv_into`"""
+
+	def __init__ ( self, sock, record_bytes ):
+		self.sock = sock
+		self.buffer = memoryview ( bytearray(record_bytes) )
+		self.filled = 0
+		self.stream_ids = set()
+		self.on_readable = None		# its selector callback, kept while it is paused
+
+
+
+class IngestServer:
+	"""
+	Accept PCM from satellites on any number of TCP, UDP and Unix socket endpoints, on one selector thread.
+	Packets are demultiplexed by stream id; `on_stream(stream)` is called with each new `NetworkStream`.
+	A stream that receives nothing for `stream_timeout_s` is finished, as if its end-of-stream packet had come
+	(a UDP one can be lost). A stream connection (TCP, Unix) is not read while the ring of one of its streams is
+	full, so that flow control slows the sender down instead of frames being dropped; UDP frames are dropped
+	"""
+
+	def __init__ ( self, sample_rate, frame_length, on_stream, jitter_frames=8, ring_frames=64, stream_timeout_s=5.0 ):
+		self.sample_rate = sample_rate
+		self.frame_length = frame_length
+		self.on_stream = on_stream
+		self.jitter_frames = jitter_frames
+		self.ring_frames = ring_frames
+		self.stream_timeout_s = stream_timeout_s
+		self.record_bytes = HEADER.size + frame_length * 2
+
+		self.streams = {}			# stream id -> NetworkStream; changed on the selector thread only, under `_lock`
+		self.malformed = 0			# datagrams of the wrong size
+		self.timed_out = 0			# streams finished for inactivity
+		self._selector = selectors.DefaultSelector()
+		self._datagram = memoryview ( bytearray(self.record_bytes + 1) )	# one spare byte detects oversize packets
+		self._unix_paths = []
+		self._paused = []			# stream connections not read until their streams have room again
+		self._running = False
+		self._lock = threading.Lock()		# so that `stats`, from another thread, sees `streams` whole
+		self._thread = threading.Thread ( target=self._serve, daemon=True )
+
+
+	def listen ( self, url ):
+		"""Start accepting on `url` ('tcp://host:port', 'udp://host:port' or 'unix:///path')"""
+		scheme, address = parse_address(url)
+		if scheme == 'udp':
+			sock = socket.socket ( socket.AF_INET, socket.SOCK_DGRAM )
+			sock.bind(address)
+			self._selector.register ( sock, selectors.EVENT_READ, self._on_datagram )
+			return sock
+
+		if scheme == 'unix':
+			if os.path.exists(address):
+				os.unlink(address)
+			sock = socket.socket ( socket.AF_UNIX, socket.SOCK_STREAM )
+			self._unix_paths.append(address)
+		else:
+			sock = socket.socket ( socket.AF_INET, socket.SOCK_STREAM )
+			sock.setsockopt ( socket.SOL_SOCKET, socket.SO_REUSEADDR, 1 )
+		sock.bind(address)
+		sock.listen()
+		self._selector.register ( sock, selectors.EVENT_READ, self._on_accept )
+		return sock
+
+
+	def start (self):
+		self._running = True
+		self._thread.start()
+		return self
+
+
+	def _serve (self):
+		while self._running:
+			for key, events in self._selector.select ( timeout=0.01 if self._paused else 0.5 ):
+				key.data ( key.fileobj )
+			if self._paused:
+				self._resume()
+			if self.stream_timeout_s:
+				self._expire ( perf_counter() - self.stream_timeout_s )
+
+
+	def _expire ( self, deadline ):
+		"""Finish the streams that have received nothing since `deadline`"""
+		for stream_id, stream in list(self.streams.items()):
+			if stream.last_arrival < deadline and not stream.full:		# a full stream waits on its reader, not sender
+				print ( "Satellite %d: no audio for %g s; closing the stream" % (stream_id, self.stream_timeout_s),
+					flush=True )
+				self._remove(stream_id)
+				self.timed_out += 1
+				stream.finish()
+
+
+	def _stream ( self, stream_id ):
+		stream = self.streams.get(stream_id)
+		if stream is None:
+			stream = NetworkStream ( stream_id, self.sample_rate, self.frame_length,
+				jitter_frames=self.jitter_frames, ring_frames=self.ring_frames )
+			with self._lock:
+				self.streams[stream_id] = stream
+			self.on_stream(stream)
+		return stream
+
+
+	def _remove ( self, stream_id ):
+		"""Forget a stream; return it (None if unknown)"""
+		with self._lock:
+			return self.streams.pop ( stream_id, None )
+
+
+	def _on_packet ( self, record ):
+		"""Dispatch one complete record; return its stream id"""
+		stream_id, seq, timestamp = HEADER.unpack_from(record)
+		if seq == END_OF_STREAM:
+			stream = self._remove(stream_id)
+			if stream:
+				stream.finish ( timestamp or None )		# the number of frames sent (0: not given)
+		else:
+			self._stream(stream_id).put ( seq, timestamp, record[HEADER.size:] )
+		return stream_id
+
+
+	def _on_datagram ( self, sock ):
+		count = sock.recv_into(self._datagram)
+		if count == self.record_bytes:
+			self._on_packet ( self._datagram[:count] )
+		elif count == HEADER.size and HEADER.unpack_from(self._datagram)[1] == END_OF_STREAM:
+			self._on_packet ( self._datagram[:count] )
+		else:
+			self.malformed += 1
+
+
+	def _on_accept ( self, sock ):
+		conn, _ = sock.accept()
+		conn.setblocking(False)
+		connection = _Connection ( conn, self.record_bytes )
+		connection.on_readable = self._reader(connection)
+		self._selector.register ( conn, selectors.EVENT_READ, connection.on_readable )
+
+
+	def _reader ( self, connection ):
+		"""Return the selector callback for a stream connection"""
+		buffer = connection.buffer
+		def on_readable ( sock ):
+			try:
+				count = sock.recv_into ( buffer[connection.filled:] )
+			except (BlockingIOError, InterruptedError):
+				return
+			except OSError:
+				count = 0
+			if not count:
+				self._on_disconnect(connection)
+				return
+			connection.filled += count
+
+			while connection.filled >= HEADER.size:
+				if HEADER.unpack_from(buffer)[1] == END_OF_STREAM:
+					# an end-of-stream record has no payload; keep whatever followed it
+					connection.stream_ids.discard ( self._on_packet(buffer[:HEADER.size]) )
+					buffer[:connection.filled - HEADER.size] = buffer[HEADER.size:connection.filled]
+					connection.filled -= HEADER.size
+				elif connection.filled == len(buffer):
+					connection.stream_ids.add ( self._on_packet(buffer) )
+					connection.filled = 0
+				else:
+					break
+
+			if self._full(connection):
+				self._selector.unregister(sock)
+				self._paused.append(connection)
+		return on_readable
+
+
+	def _full ( self, connection ):
+		return any ( self.streams[stream_id].full for stream_id in connection.stream_ids if stream_id in self.streams )
+
+
+	def _resume (self):
+		"""Read the paused connections whose streams have room again"""
+		for connection in list(self._paused):
+			if not self._full(connection):
+				self._paused.remove(connection)
+				self._selector.register ( connection.sock, selectors.EVENT_READ, connection.on_readable )
+
+
+	def _on_disconnect ( self, connection ):
+		"""A satellite hung up: end every stream it was sending"""
+		self._selector.unregister(connection.sock)
+		connection.sock.close()
+		for stream_id in connection.stream_ids:
+			stream = self._remove(stream_id)
+			if stream:
+				stream.finish()
+
+
+	def stats (self):
+		"""Return a dict of per-stream counters (safe from any thread)"""
+		with self._lock:
+			streams = list(self.streams.items())
+		return { stream_id: stream.stats() for stream_id, stream in streams }
+
+
+	def close (self):
+		self._running = False
+		self._thread.join()
+		for key in list(self._selector.get_map().values()):
+			key.fileobj.close()
+		for connection in self._paused:
+			connection.sock.close()
+		self._selector.close()
+		for stream in self.streams.values():
+			stream.finish()
+		for unix_path in self._unix_paths:
+			if os.path.exists(unix_path):
+				os.unlink(unix_path)
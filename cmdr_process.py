@@ -0,0 +1,198 @@
+# process supervisor: launch command actions with posix_spawn, reap them and enforce timeouts off the wake-word loop
+import os
+import signal
+import subprocess
+import threading
+from time import perf_counter
+
+
+
+class SupervisedProcess:
+	"""
+	Handle on a launched process, in the spirit of `subprocess.Popen`: `terminate`, `kill` and `poll` never block
+	(the supervisor's thread reaps the process), and signals are never sent once it has been reaped
+	"""
+
+	def __init__ ( self, supervisor, pid, action, deadline=None ):
+		self.pid = pid
+		self.action = action
+		self.returncode = None
+		self.deadline = deadline			# perf_counter() time at which the process is stopped
+		self.signalled = False			# SIGTERM sent: the next deadline is the SIGKILL
+		self._popen = None				# the `subprocess.Popen` behind it, where `os.posix_spawnp` is missing
+		self._supervisor = supervisor
+
+
+	def poll (self):
+		return self.returncode
+
+
+	def send_signal ( self, sig ):
+		with self._supervisor._lock:
+			if self.returncode is None:
+				try:
+					os.kill ( self.pid, sig )
+				except ProcessLookupError:
+					pass
+
+
+	def terminate (self):
+		"""SIGTERM now, and SIGKILL if the process is still there after the supervisor's `kill_after_s`"""
+		self.send_signal ( signal.SIGTERM )
+		self._supervisor._escalate ( self )
+
+
+	def kill (self):
+		self.send_signal ( signal.SIGKILL )
+
+
+
+class ProcessSupervisor:
+	"""
+	Launches command actions with `os.posix_spawnp`, which (unlike fork+exec) does not copy the page tables of this
+	large process, so launch time does not grow with the loaded models. A thread reaps exited children with
+	non-blocking `waitpid` on their pids only (other children, e.g. Porcupine shard workers, are left alone), and
+	stops those that outlive their timeout: SIGTERM, then SIGKILL after `kill_after_s`.
+	Launch latency is tracked per action. On Python < 3.8 (no `os.posix_spawnp`), processes are launched with
+	`subprocess.Popen` instead
+	"""
+
+	def __init__ ( self, timeout_s=None, kill_after_s=2.0, poll_interval_s=0.1 ):
+		self.timeout_s = timeout_s
+		self.kill_after_s = kill_after_s
+		self.poll_interval_s = poll_interval_s
+		self._running = {}		# pid -> SupervisedProcess
+		self._actions = {}		# action -> launch figures
+		self._lock = threading.Lock()
+		self._wake = threading.Event()
+		self._thread = None
+
+
+	def configure ( self, cfg ):
+		"""Apply the `processes` config section"""
+		self.timeout_s = cfg.get('timeout_s', self.timeout_s)
+		self.kill_after_s = cfg.get('kill_after_s', self.kill_after_s)
+		self.poll_interval_s = cfg.get('poll_interval_s', self.poll_interval_s)
+		return self
+
+
+	def launch ( self, argv, action=None, timeout_s=None, quiet=True ):
+		"""
+		Start `argv` (looked up on PATH) and return its `SupervisedProcess`. With `quiet`, its stdout goes to
+		/dev/null. `timeout_s` overrides the supervisor's default timeout
+		"""
+		action = action or os.path.basename(argv[0])
+		timeout_s = self.timeout_s if timeout_s is None else timeout_s
+
+		start = perf_counter()
+		try:
+			pid, popen = _spawn ( argv, quiet )
+		except OSError:
+			self._record ( action, None )
+			raise
+		launched = perf_counter()
+		self._record ( action, launched - start )
+
+		process = SupervisedProcess ( self, pid, action, launched + timeout_s if timeout_s else None )
+		process._popen = popen
+		with self._lock:
+			self._running[pid] = process
+		self._start()
+		return process
+
+
+	def _record ( self, action, seconds ):
+		figures = self._actions.get(action)
+		if figures is None:
+			figures = self._actions[action] = { 'launches': 0, 'failures': 0, 'timeouts': 0, 'total': 0.0, 'max': 0.0 }
+		if seconds is None:
+			figures['failures'] += 1
+			return
+		figures['launches'] += 1
+		figures['total'] += seconds
+		figures['max'] = max ( figures['max'], seconds )
+
+
+	def _escalate ( self, process ):
+		"""Have the reaper SIGKILL `process` if it is still running after `kill_after_s`"""
+		deadline = perf_counter() + self.kill_after_s
+		with self._lock:
+			if process.returncode is None:
+				process.signalled = True
+				if process.deadline is None or process.deadline > deadline:
+					process.deadline = deadline
+		self._wake.set()
+
+
+	def _start (self):
+		if self._thread is None:
+			self._thread = threading.Thread ( target=self._reap, name='reaper', daemon=True )
+			self._thread.start()
+		self._wake.set()
+
+
+	def _reap (self):
+		"""Reaper thread: collect exited children, and stop those past their deadline"""
+		while True:
+			self._wake.wait ( self.poll_interval_s if self._running else None )
+			self._wake.clear()
+			now = perf_counter()
+			with self._lock:
+				for pid, process in list(self._running.items()):
+					try:
+						reaped, status = os.waitpid ( pid, os.WNOHANG )
+					except ChildProcessError:
+						reaped, status = pid, 0			# reaped elsewhere
+					if reaped:
+						process.returncode = _exitcode(status)
+						if process._popen is not None:
+							process._popen.returncode = process.returncode		# so it never waits on the pid itself
+						del self._running[pid]
+					elif process.deadline is not None and now >= process.deadline:
+						if process.signalled:
+							os.kill ( pid, signal.SIGKILL )
+							process.deadline = None
+						else:
+							print ( "Timeout:", process.action, "(pid %d)" % pid, flush=True )
+							self._actions[process.action]['timeouts'] += 1
+							os.kill ( pid, signal.SIGTERM )
+							process.signalled = True
+							process.deadline = now + self.kill_after_s
+
+
+	def running (self):
+		with self._lock:
+			return list(self._running.values())
+
+
+	def stats (self):
+		"""Per action: launch count, launch latency, spawn failures and timeouts"""
+		return { action: {
+			'launches': figures['launches'],
+			'avg_launch_ms': round(figures['total'] / figures['launches'] * 1000, 2) if figures['launches'] else 0,
+			'max_launch_ms': round(figures['max'] * 1000, 2),
+			'failures': figures['failures'],
+			'timeouts': figures['timeouts'],
+		} for action, figures in self._actions.items() }
+
+
+
+def _spawn ( argv, quiet ):
+	"""Start `argv` (looked up on PATH); return its pid, and the `subprocess.Popen` if one was needed"""
+	if hasattr(os, 'posix_spawnp'):
+		file_actions = [ (os.POSIX_SPAWN_OPEN, 1, os.devnull, os.O_WRONLY, 0) ] if quiet else []
+		return os.posix_spawnp ( argv[0], argv, os.environ, file_actions=file_actions ), None
+	popen = subprocess.Popen ( argv, stdout=subprocess.DEVNULL if quiet else None )
+	return popen.pid, popen
+
+
+def _exitcode ( status ):
+	"""`waitpid` status as a return code, negative for a signal (as `os.waitstatus_to_exitcode`, Python 3.9+)"""
+	if os.WIFSIGNALED(status):
+		return -os.WTERMSIG(status)
+	return os.WEXITSTATUS(status)
+
+
+
+# the supervisor shared by command actions (see `cmdr_funcs`)
+supervisor = ProcessSupervisor()
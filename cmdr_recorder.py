@@ -0,0 +1,176 @@
+# flight recorder: the last N seconds of audio kept in a memory-mapped ring file, snapshotted around wake events
+import json
+import mmap
+import os
+import struct
+import threading
+import wave
+from queue import Queue
+from time import time, sleep, strftime, localtime
+
+import cmdr_audio
+import cmdr_utils
+
+
+# the ring file starts with a header, followed by `capacity` frames of 16-bit mono PCM;
+# `frames` (total frames ever written) is kept up to date, so the file can be read back after a crash
+HEADER = struct.Struct('<8sIIIQ')		# magic, sample rate, frame length, capacity (frames), frames
+MAGIC = b'CMDRFLT1'
+_FRAMES = struct.Struct('<Q')
+_FRAMES_OFFSET = HEADER.size - _FRAMES.size
+
+
+
+class FlightRecorder:
+	"""
+	Always-on recorder of the last `seconds` of audio, in a fixed-size memory-mapped ring file at `path`.
+	`write` copies a frame into its slot of the mapping, with no allocation and no system call; the kernel writes
+	dirty pages back in its own time. `snapshot` only queues the event: a writer thread waits for `after_ms` of
+	audio following it, then saves the window (from `before_ms` earlier) as WAV, with the event's metadata as JSON
+	"""
+
+	def __init__ ( self, path, sample_rate, frame_length, seconds=30, snapshot_dir='recordings', before_ms=3000,
+			after_ms=1000 ):
+		self.sample_rate = sample_rate
+		self.frame_length = frame_length
+		self.frame_bytes = frame_length * 2
+		self.capacity = cmdr_utils.ms_to_frames ( seconds * 1000, sample_rate, frame_length )
+		self.before = cmdr_utils.ms_to_frames ( before_ms, sample_rate, frame_length )
+		self.after = cmdr_utils.ms_to_frames ( after_ms, sample_rate, frame_length )
+		if self.before + self.after >= self.capacity:
+			raise ValueError ( "Flight recorder snapshots must be shorter than the %d s it keeps" % seconds )
+		self.snapshot_dir = snapshot_dir
+		os.makedirs ( snapshot_dir, exist_ok=True )
+
+		size = HEADER.size + self.capacity * self.frame_bytes
+		self._file = open ( path, 'w+b' )
+		self._file.truncate(size)
+		self._map = mmap.mmap ( self._file.fileno(), size )
+		HEADER.pack_into ( self._map, 0, MAGIC, sample_rate, frame_length, self.capacity, 0 )
+		view = memoryview(self._map)
+		self._slots = [ view[HEADER.size + i * self.frame_bytes : HEADER.size + (i + 1) * self.frame_bytes]
+			for i in range(self.capacity) ]
+
+		self.frames = 0				# frames written so far
+		self.snapshots = 0			# snapshots saved
+		self._closed = False
+		self._queue = Queue()
+		self._thread = threading.Thread ( target=self._writer, daemon=True )
+		self._thread.start()
+
+
+	@classmethod
+	def from_config ( cls, cfg, sample_rate, frame_length ):
+		"""Build a recorder from the `recorder` config section, or return None if it is disabled"""
+		if not cfg.get('enabled', False):
+			return None
+		return cls ( cfg.get('path', 'flight_recorder.pcm'), sample_rate, frame_length,
+			seconds=cfg.get('seconds', 30), snapshot_dir=cfg.get('snapshot_dir', 'recordings'),
+			before_ms=cfg.get('before_ms', 3000), after_ms=cfg.get('after_ms', 1000) )
+
+
+	def write ( self, pcm ):
+		"""Copy one frame into the ring (hot path)"""
+		frames = self.frames
+		self._slots[frames % self.capacity][:] = pcm
+		self.frames = frames + 1
+		_FRAMES.pack_into ( self._map, _FRAMES_OFFSET, frames + 1 )
+
+
+	def snapshot ( self, event, **metadata ):
+		"""Save the audio around now, tagged with `event` and `metadata`, once the following audio is in"""
+		self._queue.put ( (self.frames, time(), event, metadata) )
+
+
+	def _writer (self):
+		"""Writer thread: turn queued events into WAV + JSON files, off the audio path"""
+		while True:
+			item = self._queue.get()
+			if item is None:
+				return
+			at, wall_time, event, metadata = item
+
+			# wait for the audio following the event (not for long, if the source has stalled or ended)
+			deadline = time() + 2 * self.after * self.frame_length / self.sample_rate + 1
+			while self.frames < at + self.after and not self._closed and time() < deadline:
+				sleep(0.05)
+			self._save ( at, wall_time, event, metadata )
+
+
+	def _save ( self, at, wall_time, event, metadata ):
+		end = min ( at + self.after, self.frames )
+		# skip the slot being overwritten, and anything already gone
+		start = max ( at - self.before, self.frames - self.capacity + 1, 0 )
+		pcm = b''.join ( self._slots[i % self.capacity] for i in range(start, end) )
+
+		name = '%s.%03d-%s' % ( strftime('%Y%m%d-%H%M%S', localtime(wall_time)), wall_time * 1000 % 1000, event )
+		base = os.path.join ( self.snapshot_dir, name )
+		with wave.open ( base + '.wav', 'wb' ) as wav:
+			wav.setnchannels(1)
+			wav.setsampwidth(2)
+			wav.setframerate(self.sample_rate)
+			wav.writeframes(pcm)
+
+		with open ( base + '.json', 'w' ) as f:
+			json.dump ( dict(metadata, event=event, time=wall_time, sample_rate=self.sample_rate,
+				event_offset_s=(at - start) * self.frame_length / self.sample_rate,
+				duration_s=(end - start) * self.frame_length / self.sample_rate), f, indent='\t' )
+		self.snapshots += 1
+
+
+	def close (self):
+		"""Save pending snapshots with whatever audio there is, and unmap the ring file"""
+		self._closed = True
+		self._queue.put(None)
+		self._thread.join()
+		self._slots = []
+		self._map.flush()
+		self._map.close()
+		self._file.close()
+
+
+
+class RecordingSource ( cmdr_audio.AudioSource ):
+	"""Pass-through AudioSource that feeds every new frame read from `source` to a FlightRecorder"""
+
+	def __init__ ( self, source, recorder ):
+		self.source = source
+		self.recorder = recorder
+		self.sample_rate = source.sample_rate
+		self.frame_length = source.frame_length
+		self.history = source.history
+		self._replay = 0			# rewound frames, already recorded once
+
+
+	def read ( self, timeout=None ):
+		pcm = self.source.read(timeout)
+		if pcm is not None:
+			if self._replay:
+				self._replay -= 1
+			else:
+				self.recorder.write(pcm)
+		return pcm
+
+
+	def rewind ( self, frames ):
+		frames = self.source.rewind(frames)
+		self._replay += frames
+		return frames
+
+
+	@property
+	def overruns (self):
+		return self.source.overruns
+
+
+	def stats (self):
+		return self.source.stats()
+
+
+	def __getattr__ ( self, name ):
+		return getattr ( self.source, name )
+
+
+	def close (self):
+		self.source.close()
+		self.recorder.close()
@@ -0,0 +1,144 @@
+# command registry: maps keywords (and intents) to the handlers declared for them in config
+import importlib
+import importlib.util
+import inspect
+from time import perf_counter
+
+
+
+class Handler:
+	"""
+	One command handler named in config: either a built-in registered with `CommandRegistry.register`, or a
+	'module.function' path whose module is only imported the first time the handler runs.
+	Calls `function(*args, **kwargs)` with the `args`/`kwargs` from config, and records its latency (for a function
+	returning a coroutine, e.g. `listen` in asyncio mode, up to the end of the coroutine, which is returned wrapped)
+	"""
+
+	def __init__ ( self, name, func=None, args=(), kwargs=None ):
+		self.name = name
+		self.args = tuple(args)
+		self.kwargs = dict(kwargs or {})		# a copy: config dicts may be reused
+		self._func = func
+
+		# latency figures, in seconds
+		self.calls = 0
+		self.total_time = 0.0
+		self.max_time = 0.0
+
+
+	def resolve (self):
+		"""Import the handler's module and look the function up"""
+		module_name, _, func_name = self.name.rpartition('.')
+		self._func = getattr ( importlib.import_module(module_name), func_name )
+		return self._func
+
+
+	def __call__ ( self, *args, **kwargs ):
+		func = self._func or self.resolve()
+		start = perf_counter()
+		try:
+			result = func ( *self.args, *args, **self.kwargs, **kwargs )
+		except BaseException:
+			self._record ( perf_counter() - start )
+			raise
+		if inspect.iscoroutine(result):
+			return self._timed ( result, start )
+		self._record ( perf_counter() - start )
+		return result
+
+
+	async def _timed ( self, coroutine, start ):
+		try:
+			return await coroutine
+		finally:
+			self._record ( perf_counter() - start )
+
+
+	def _record ( self, elapsed ):
+		self.calls += 1
+		self.total_time += elapsed
+		if elapsed > self.max_time:
+			self.max_time = elapsed
+
+
+	def stats (self):
+		return {
+			'calls': self.calls,
+			'avg_ms': round(self.total_time / self.calls * 1000, 2) if self.calls else 0,
+			'max_ms': round(self.max_time * 1000, 2),
+		}
+
+
+
+class CommandRegistry:
+	"""
+	Dispatch table from keys (keyword indices, intent names) to `Handler`s.
+	Handler specs are validated when loaded, so a typo in config fails at startup instead of on first use;
+	dispatching is a single dict lookup
+	"""
+
+	def __init__ (self):
+		self._builtins = {}
+		self._table = {}
+
+
+	def register ( self, name, func ):
+		"""Make `func` available to config under the built-in handler name `name` (a name without dots)"""
+		self._builtins[name] = func
+
+
+	def handler ( self, spec ):
+		"""Build a Handler from a config spec: `{"handler": name, "args": [...], "kwargs": {...}}`"""
+		name = spec['handler']
+		if '.' not in name:
+			if name not in self._builtins:
+				raise ValueError ( "Unknown built-in command handler '%s'" % name )
+			func = self._builtins[name]
+		else:
+			if importlib.util.find_spec(name.rpartition('.')[0]) is None:
+				raise ValueError ( "Command handler module for '%s' not found" % name )
+			func = None			# imported lazily, on first use
+		return Handler ( name, func, spec.get('args', ()), spec.get('kwargs', {}) )
+
+
+	def load_keywords ( self, keywords, default=None ):
+		"""
+		Add a handler for each Porcupine keyword (by index), from its `action` spec, or `default` if it has none
+		(by default, the built-in `listen`)
+		"""
+		default = dict(default) if default is not None else {'handler': 'listen'}
+		for index, keyword in enumerate(keywords):
+			self._table[index] = self.handler ( keyword.get('action', default) )
+
+
+	def load_intents ( self, intents ):
+		"""Add a handler for each intent (by name), from its `action` spec"""
+		for intent in intents:
+			self._table[intent['name']] = self.handler ( intent['action'] )
+
+
+	def rebuilt ( self, keywords, intents=() ):
+		"""
+		Return a registry with the same built-ins, and handlers for `keywords` and `intents` (e.g. after a config
+		reload); specs are validated here, so a bad config leaves the running table alone
+		"""
+		registry = CommandRegistry()
+		registry._builtins = self._builtins
+		registry.load_keywords(keywords)
+		registry.load_intents(intents)
+		return registry
+
+
+	def replace ( self, other ):
+		"""Dispatch from `other`'s table from now on (a single assignment: a lookup sees either table, whole)"""
+		self._table = other._table
+
+
+	def get ( self, key ):
+		"""Return the handler for `key`, or None"""
+		return self._table.get(key)
+
+
+	def stats (self):
+		"""Return per-handler latency figures, keyed by dispatch key"""
+		return { key: dict(handler.stats(), handler=handler.name) for key, handler in self._table.items() }
@@ -0,0 +1,50 @@
+#!/bin/python3
+# satellite sender: stream a recording (or stdin) to a cmdr ingest endpoint, e.g. to test on loopback
+import argparse
+import random
+from time import perf_counter
+
+import cmdr_audio
+import cmdr_net
+
+
+
+def main ():
+	parser = argparse.ArgumentParser ( description="Stream 16-bit mono PCM to a cmdr host, as a satellite would" )
+	parser.add_argument ( 'url', help="tcp://host:port, udp://host:port or unix:///path" )
+	parser.add_argument ( 'source', help="16-bit mono WAV or raw PCM file, or '-' for stdin" )
+	parser.add_argument ( '--stream-id', type=int, default=0 )
+	parser.add_argument ( '--sample-rate', type=int, default=16000 )
+	parser.add_argument ( '--frame-length', type=int, default=512 )
+	parser.add_argument ( '--fast', action='store_true', help="send as fast as possible instead of in real time" )
+	parser.add_argument ( '--drop', type=float, default=0.0, help="fraction of frames to drop, to simulate loss" )
+	args = parser.parse_args()
+
+	source = cmdr_audio.open_source ( args.source, args.sample_rate, args.frame_length, realtime=not args.fast )
+	sock = cmdr_net.connect ( args.url )
+	send = sock.send if args.url.startswith('udp') else sock.sendall
+
+	record = memoryview ( bytearray(cmdr_net.HEADER.size + args.frame_length * 2) )
+	seq = 0
+	dropped = 0
+	while True:
+		pcm = source.read()
+		if pcm is None:
+			break
+		cmdr_net.HEADER.pack_into ( record, 0, args.stream_id, seq, int(perf_counter() * 1e6) )
+		record[cmdr_net.HEADER.size:] = pcm
+		if args.drop and random.random() < args.drop:
+			dropped += 1
+		else:
+			send(record)
+		seq += 1
+
+	send ( cmdr_net.HEADER.pack(args.stream_id, cmdr_net.END_OF_STREAM, seq) )		# with the number of frames sent
+	sock.close()
+	source.close()
+	print ( "Sent %d frames (%d dropped) on stream %d" % (seq, dropped, args.stream_id) )
+
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,215 @@
+#!/bin/python3
+# multi-stream wake-word server: many PCM streams, spread over a pool of Porcupine worker processes
+import argparse
+import multiprocessing
+import signal
+import sys
+import threading
+from time import perf_counter
+
+import cmdr_utils
+import cmdr_audio
+
+
+
+def _worker ( porcupine_cfg, jobs, results, pool_size=1 ):
+	"""
+	Worker process: run each stream's chunks through a Porcupine handle leased to that stream (engines are stateful,
+	so a stream always goes to the same worker). Handles come from a pre-warmed pool and go back to it, reset, when
+	the stream ends. Detections are reported as `(stream_id, frame_index, keyword_index)`, and the end of a stream as
+	`(stream_id, None, frames_processed)`
+	"""
+	from cmdr import init_porcupine, reset_porcupine
+	signal.signal ( signal.SIGINT, signal.SIG_IGN )		# ctrl+C is handled by the server process (after the import,
+														# which may run cmdr's top level again)
+
+	pool = cmdr_utils.EnginePool ( lambda: init_porcupine(porcupine_cfg), size=pool_size, reset=reset_porcupine )
+	engines = {}		# stream id -> [Porcupine, frames processed]
+	while True:
+		job = jobs.get()
+		if job is None:
+			break
+		stream_id, pcm = job
+
+		if pcm is None:		# end of stream
+			porcupine, frames = engines.pop ( stream_id, (None, 0) )
+			if porcupine:
+				pool.checkin(porcupine)
+			results.put ( (stream_id, None, frames) )
+			continue
+
+		if stream_id not in engines:
+			engines[stream_id] = [ pool.checkout(), 0 ]
+		engine = engines[stream_id]
+		for frame_index, keyword_index in engine[0].process_many(pcm):
+			results.put ( (stream_id, engine[1] + frame_index, keyword_index) )
+		engine[1] += len(pcm) // (2 * engine[0].frame_length)
+
+	for porcupine, frames in engines.values():
+		porcupine.delete()
+	pool.delete()
+
+
+
+class WakeWordServer:
+	"""
+	Wake-word detection for many concurrent PCM streams. Each stream is pinned to one of `workers` processes, each
+	holding a Porcupine handle per stream; frames are shipped to workers in chunks of `chunk_frames` frames
+	"""
+
+	def __init__ ( self, porcupine_cfg, sample_rate, frame_length, workers=None, chunk_frames=32, on_detection=None,
+			pool_size=1 ):
+		self.keywords = porcupine_cfg['keywords']['list']
+		self.sample_rate = sample_rate
+		self.frame_length = frame_length
+		self.chunk_frames = chunk_frames
+		self.on_detection = on_detection or self.print_detection
+
+		self.detections = {}	# stream id -> list of (seconds into stream, keyword index)
+		self.frames = {}		# stream id -> frames processed, once the stream has ended
+		self.error = None		# the first exception raised by `on_detection`, re-raised by `wait`
+
+		workers = workers or multiprocessing.cpu_count()
+		self._results = multiprocessing.Queue()
+		self._jobs = [ multiprocessing.Queue() for _ in range(workers) ]
+		self._workers = [
+			multiprocessing.Process ( target=_worker, args=(porcupine_cfg, jobs, self._results, pool_size), daemon=True )
+			for jobs in self._jobs
+		]
+		self._feeders = []
+		self._open_streams = 0
+		self._lock = threading.Lock()
+		self._all_done = threading.Event()
+		self._all_done.set()
+		self._collector = threading.Thread ( target=self._collect, daemon=True )
+
+
+	def start (self):
+		"""Start the worker processes and the result collector"""
+		for worker in self._workers:
+			worker.start()
+		self._collector.start()
+		return self
+
+
+	def add_stream ( self, stream_id, source ):
+		"""Start feeding `source` (an AudioSource) to the pool as stream `stream_id`"""
+		if source.sample_rate != self.sample_rate or source.frame_length != self.frame_length:
+			raise ValueError ( "Stream %s does not match Porcupine's sample rate and frame length" % stream_id )
+
+		jobs = self._jobs[ len(self.detections) % len(self._jobs) ]		# round-robin stream placement
+		self.detections[stream_id] = []
+		with self._lock:
+			self._open_streams += 1
+			self._all_done.clear()
+
+		feeder = threading.Thread ( target=self._feed, args=(stream_id, source, jobs), daemon=True )
+		self._feeders.append(feeder)
+		feeder.start()
+
+
+	def _feed ( self, stream_id, source, jobs ):
+		"""Feeder thread: batch frames from `source` into chunks and queue them for the stream's worker"""
+		frame_bytes = self.frame_length * 2
+		chunk = memoryview ( bytearray(frame_bytes * self.chunk_frames) )
+		filled = 0
+		while True:
+			pcm = source.read()
+			if pcm is not None:
+				chunk[filled : filled + frame_bytes] = pcm
+				filled += frame_bytes
+			if filled and (pcm is None or filled == len(chunk)):
+				jobs.put ( (stream_id, bytearray(chunk[:filled])) )	# queued objects are pickled later; copy
+				filled = 0
+			if pcm is None:
+				break
+		jobs.put ( (stream_id, None) )
+		source.close()
+
+
+	def _collect (self):
+		"""Collector thread: record detections and stream ends reported by the workers"""
+		while True:
+			stream_id, frame_index, value = self._results.get()
+			if frame_index is None:
+				self.frames[stream_id] = value
+				with self._lock:
+					self._open_streams -= 1
+					if not self._open_streams:
+						self._all_done.set()
+				continue
+
+			seconds = frame_index * self.frame_length / self.sample_rate
+			self.detections[stream_id].append ( (seconds, value) )
+			try:
+				self.on_detection ( stream_id, seconds, value )
+			except Exception as e:		# keep collecting, or `wait` would never return
+				print ( "Error: on_detection failed for stream %s -" % stream_id, repr(e), file=sys.stderr, flush=True )
+				if self.error is None:
+					self.error = e
+
+
+	def print_detection ( self, stream_id, seconds, keyword_index ):
+		print ( "[%s] Keyword detected! %d %s at %.2f s" % (
+			stream_id, keyword_index, self.keywords[keyword_index]['title'], seconds ), flush=True )
+
+
+	def wait (self):
+		"""Block until every stream added so far has been fully processed; re-raise the first `on_detection` error"""
+		for feeder in self._feeders:
+			feeder.join()
+		self._all_done.wait()
+		if self.error is not None:
+			raise self.error
+
+
+	def stop (self):
+		"""Shut down the worker processes"""
+		for jobs in self._jobs:
+			jobs.put(None)
+		for worker in self._workers:
+			worker.join()
+
+
+
+def main ():
+	parser = argparse.ArgumentParser ( description="Cmdr wake-word server: detect keywords on many audio streams" )
+	parser.add_argument ( 'sources', nargs='+', metavar='SOURCE',
+		help="16-bit mono WAV or raw PCM file, or '-' for stdin; one per stream" )
+	parser.add_argument ( '--workers', type=int, default=None, help="worker processes (default: one per core)" )
+	parser.add_argument ( '--chunk-frames', type=int, default=32, help="frames shipped to a worker at a time" )
+	parser.add_argument ( '--realtime', action='store_true', help="pace every stream in real time" )
+	parser.add_argument ( '--pool', type=int, default=1, help="Porcupine handles pre-warmed in each worker" )
+	args = parser.parse_args()
+
+	cmdr = cmdr_utils.Cmdr()
+
+	# a throw-away engine, for the audio format every stream must match
+	from cmdr import init_porcupine
+	porcupine = init_porcupine ( cmdr.config['porcupine'] )
+	sample_rate, frame_length = porcupine.sample_rate, porcupine.frame_length
+	porcupine.delete()
+
+	server = WakeWordServer ( cmdr.config['porcupine'], sample_rate, frame_length,
+		workers=args.workers, chunk_frames=args.chunk_frames, pool_size=args.pool ).start()
+	start = perf_counter()
+	for index, spec in enumerate(args.sources):
+		source = cmdr_audio.open_source ( spec, sample_rate, frame_length, realtime=args.realtime )
+		server.add_stream ( '%d:%s' % (index, spec), source )
+	server.wait()
+	elapsed = perf_counter() - start
+	server.stop()
+
+	# per-stream report
+	total_frames = sum ( server.frames.values() )
+	for stream_id, detections in server.detections.items():
+		print ( "%s: %d detection(s) in %.2f s of audio" % (
+			stream_id, len(detections), server.frames[stream_id] * frame_length / sample_rate ) )
+	audio_seconds = total_frames * frame_length / sample_rate
+	print ( "Processed %.2f s of audio over %d stream(s) in %.2f s (%.1fx real time)" % (
+		audio_seconds, len(server.detections), elapsed, audio_seconds / elapsed if elapsed else 0 ) )
+
+
+
+if __name__ == "__main__":
+	main()
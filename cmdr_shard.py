@@ -0,0 +1,108 @@
+# keyword sharding: split a large keyword list over several Porcupine instances, each in its own worker process
+import multiprocessing
+import signal
+from ctypes import c_bool
+from time import perf_counter
+
+
+
+def _shard_worker ( porcupine_cfg, index, frame, go, done, results, busy, stop ):
+	"""
+	Worker process: wait for each frame to be posted in the shared `frame`, run it through this shard's Porcupine and
+	leave the (shard-local) keyword index in `results[index]`, adding the time it took to `busy[index]`
+	"""
+	from cmdr import init_porcupine
+	signal.signal ( signal.SIGINT, signal.SIG_IGN )		# ctrl+C is handled by the main process (after the import,
+														# which may run cmdr's top level again)
+
+	porcupine = init_porcupine ( porcupine_cfg )
+	done.release()			# ready
+	while True:
+		go.acquire()
+		if stop.value:
+			break
+		start = perf_counter()
+		# reads the shared frame in place; unlike `process`, returns keyword indices even for a single keyword
+		detections = porcupine.process_many(frame)
+		results[index] = detections[0][1] if detections else -1
+		busy[index] += perf_counter() - start
+		done.release()
+	porcupine.delete()
+
+
+
+class ShardedPorcupine:
+	"""
+	Stand-in for Porcupine that spreads the configured keywords round-robin over `shards` Porcupine instances, one
+	per worker process, so that per-frame cost no longer grows with the keyword count on a single core.
+	`process` copies the frame once into shared memory, wakes every shard, waits for all of them, and returns the
+	detected keyword's index in the full config list (or -1), exactly like a single Porcupine would
+	"""
+
+	def __init__ ( self, porcupine_cfg, shards, sample_rate, frame_length, ready_timeout=30 ):
+		keywords = porcupine_cfg['keywords']['list']
+		shards = max ( 1, min(shards, len(keywords)) )
+		self.sample_rate = sample_rate
+		self.frame_length = frame_length
+		self.keyword_indices = [ list(range(shard, len(keywords), shards)) for shard in range(shards) ]
+		self.frames = 0
+
+		self._frame = multiprocessing.RawArray ( 'h', frame_length )
+		self._frame_bytes = memoryview(self._frame).cast('B')
+		self._results = multiprocessing.RawArray ( 'i', shards )
+		self._busy = multiprocessing.RawArray ( 'd', shards )		# seconds spent processing, per shard
+		self._stop = multiprocessing.RawValue ( c_bool, False )
+		self._done = multiprocessing.Semaphore(0)
+		self._go = [ multiprocessing.Semaphore(0) for _ in range(shards) ]
+		self._workers = []
+		for shard, indices in enumerate(self.keyword_indices):
+			cfg = dict ( porcupine_cfg,
+				keywords=dict(porcupine_cfg['keywords'], list=[keywords[index] for index in indices]) )
+			worker = multiprocessing.Process ( target=_shard_worker, daemon=True, args=(
+				cfg, shard, self._frame, self._go[shard], self._done, self._results, self._busy, self._stop) )
+			worker.start()
+			self._workers.append(worker)
+		self._wait_all ( ready_timeout )
+
+
+	def _wait_all ( self, timeout=None ):
+		"""Wait for every shard to signal `done`; fail, rather than hang, if a worker died"""
+		for _ in self._workers:
+			while not self._done.acquire ( timeout=1 if timeout is None else min(timeout, 1) ):
+				if not all ( worker.is_alive() for worker in self._workers ):
+					raise RuntimeError ( "A Porcupine shard worker exited unexpectedly" )
+				if timeout is not None:
+					timeout -= 1
+					if timeout <= 0:
+						raise RuntimeError ( "Porcupine shard workers did not start in time" )
+
+
+	def process ( self, pcm ):
+		"""Process one frame on every shard; return the global index of the detected keyword, or -1"""
+		self._frame_bytes[:] = pcm
+		for go in self._go:
+			go.release()
+		self._wait_all()
+		self.frames += 1
+
+		for shard, result in enumerate(self._results):
+			if result >= 0:
+				return self.keyword_indices[shard][result]
+		return -1
+
+
+	def stats (self):
+		"""Per-shard keyword count and average processing time per frame"""
+		return [ {
+			'keywords': len(indices),
+			'avg_us': round(self._busy[shard] / self.frames * 1e6, 1) if self.frames else 0,
+		} for shard, indices in enumerate(self.keyword_indices) ]
+
+
+	def delete (self):
+		"""Stop the worker processes (each releases its own Porcupine)"""
+		self._stop.value = True
+		for go in self._go:
+			go.release()
+		for worker in self._workers:
+			worker.join()
@@ -0,0 +1,213 @@
+#!/bin/python3
+# sensitivity sweep: replay a labeled corpus through Porcupine over a grid of keywords x sensitivities, in parallel
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import signal
+import wave
+from bisect import bisect_right
+from time import perf_counter
+
+import cmdr_utils
+import cmdr_audio
+
+
+_corpus = None		# worker processes: the decoded corpus, in shared memory
+
+
+
+def _init_worker ( corpus ):
+	signal.signal ( signal.SIGINT, signal.SIG_IGN )		# ctrl+C is handled by the parent process
+	global _corpus
+	_corpus = corpus
+
+
+def _run ( job ):
+	"""
+	Worker process: run the whole corpus through a Porcupine listening for one keyword at one sensitivity.
+	Return `(keyword, sensitivity, detected frame indices, seconds spent)`
+	"""
+	porcupine_cfg, keyword, sensitivity = job
+	from cmdr import init_porcupine
+
+	keywords = dict ( porcupine_cfg['keywords'], list=[{'prefix': keyword, 'title': keyword, 'sensitivity': sensitivity}] )
+	porcupine = init_porcupine ( dict(porcupine_cfg, keywords=keywords) )
+	start = perf_counter()
+	frames = [ frame_index for frame_index, _ in porcupine.process_many(_corpus) ]		# zero-copy, from shared memory
+	elapsed = perf_counter() - start
+	porcupine.delete()
+	return keyword, sensitivity, frames, elapsed
+
+
+
+def _num_samples ( file_path ):
+	"""Number of samples in a 16-bit mono WAV or raw PCM file, without decoding it"""
+	if file_path.lower().endswith('.wav'):
+		with wave.open ( file_path, 'rb' ) as wav:
+			return wav.getnframes()
+	return os.path.getsize(file_path) // 2
+
+
+
+class Corpus:
+	"""
+	A labeled set of recordings, decoded once into one shared-memory array (`multiprocessing.RawArray`) that every
+	worker reads in place. Files are laid out back to back, each padded to whole frames and followed by `gap_ms` of
+	silence so that one file's tail doesn't carry into the next.
+	The manifest is JSON: `{"files": [{"path": "a.wav", "keywords": {"hey_monica": [1.25, 7.9]}}, ...]}`, listing
+	for each file the times (seconds) at which each keyword ends; files without labels only count towards false alarms
+	"""
+
+	def __init__ ( self, manifest_path, sample_rate, frame_length, gap_ms=1000 ):
+		self.sample_rate = sample_rate
+		self.frame_length = frame_length
+		with open(manifest_path) as f:
+			manifest = json.load(f)
+		root = os.path.dirname(manifest_path)
+		self.files = manifest['files']
+		for entry in self.files:
+			entry['path'] = os.path.join ( root, entry['path'] )
+
+		# lay the files out, then decode each one straight into its place in shared memory
+		gap = cmdr_utils.ms_to_frames ( gap_ms, sample_rate, frame_length )
+		self.offsets = []			# first frame of each file
+		self.audio_frames = 0		# frames of actual audio, without the gaps
+		total = 0
+		for entry in self.files:
+			frames = -(-_num_samples(entry['path']) // frame_length)
+			self.offsets.append(total)
+			self.audio_frames += frames
+			total += frames + gap
+		self.array = multiprocessing.RawArray ( 'h', total * frame_length )
+
+		frame_bytes = frame_length * 2
+		view = memoryview(self.array).cast('B')
+		for entry, offset in zip(self.files, self.offsets):
+			position = offset * frame_bytes
+			with cmdr_audio.open_source ( entry['path'], sample_rate, frame_length ) as source:
+				while True:
+					pcm = source.read()
+					if pcm is None:
+						break
+					view[position : position + frame_bytes] = pcm
+					position += frame_bytes
+
+
+	@property
+	def hours (self):
+		return self.audio_frames * self.frame_length / self.sample_rate / 3600
+
+
+	def labels ( self, keyword ):
+		"""Return the (sorted) corpus frame indices at which `keyword` is labeled"""
+		return sorted (
+			offset + round(seconds * self.sample_rate / self.frame_length)
+			for entry, offset in zip(self.files, self.offsets)
+			for seconds in entry.get('keywords', {}).get(keyword, [])
+		)
+
+
+	def locate ( self, frame_index ):
+		"""Return `(file path, seconds into the file)` for a corpus frame index"""
+		file_index = bisect_right(self.offsets, frame_index) - 1
+		frames = frame_index - self.offsets[file_index]
+		return self.files[file_index]['path'], frames * self.frame_length / self.sample_rate
+
+
+
+def score ( labels, detections, tolerance ):
+	"""
+	Match detections to labels (each label at most once, within `tolerance` frames); return `(hits, false alarms)`
+	"""
+	hits = 0
+	label_index = 0
+	for frame in sorted(detections):
+		while label_index < len(labels) and labels[label_index] < frame - tolerance:
+			label_index += 1
+		if label_index < len(labels) and labels[label_index] <= frame + tolerance:
+			hits += 1
+			label_index += 1
+	return hits, len(detections) - hits
+
+
+
+def available_keywords ( porcupine_cfg ):
+	"""Prefixes of every keyword file for this platform under the configured keywords directory"""
+	suffix = '_%s.ppn' % cmdr_utils.porcupine_keyword_file_extension()
+	pattern = os.path.join ( porcupine_cfg['root_path'], porcupine_cfg['keywords']['path'], '*' + suffix )
+	return sorted ( os.path.basename(file_path)[:-len(suffix)] for file_path in glob.glob(pattern) )
+
+
+
+def main ():
+	parser = argparse.ArgumentParser ( description="Sweep Porcupine sensitivities over a labeled corpus" )
+	parser.add_argument ( 'manifest', help="JSON manifest of labeled 16-bit mono WAV or raw PCM recordings" )
+	parser.add_argument ( '--keywords', nargs='+', metavar='PREFIX',
+		help="keyword file prefixes to sweep (default: every keyword file for this platform)" )
+	parser.add_argument ( '--sensitivities', default=','.join('%.1f' % (step / 10) for step in range(1, 10)),
+		help="comma-separated sensitivities to try (default: 0.1 to 0.9)" )
+	parser.add_argument ( '--tolerance-ms', type=int, default=750, help="how far a detection may be from its label" )
+	parser.add_argument ( '--gap-ms', type=int, default=1000, help="silence inserted between files" )
+	parser.add_argument ( '--workers', type=int, default=None, help="worker processes (default: one per core)" )
+	parser.add_argument ( '--output', metavar='FILE', help="also write the curves to FILE, as JSON" )
+	args = parser.parse_args()
+
+	cmdr = cmdr_utils.Cmdr()
+	porcupine_cfg = cmdr.config['porcupine']
+	keywords = args.keywords or available_keywords(porcupine_cfg)
+	sensitivities = [ float(value) for value in args.sensitivities.split(',') ]
+
+	# a throw-away engine, for the audio format
+	from cmdr import init_porcupine
+	porcupine = init_porcupine ( porcupine_cfg )
+	sample_rate, frame_length = porcupine.sample_rate, porcupine.frame_length
+	porcupine.delete()
+
+	start = perf_counter()
+	corpus = Corpus ( args.manifest, sample_rate, frame_length, args.gap_ms )
+	print ( "Decoded %d file(s), %.2f h of audio, in %.2f s" % (len(corpus.files), corpus.hours, perf_counter() - start) )
+
+	# one job per (keyword, sensitivity), spread over the pool
+	jobs = [ (porcupine_cfg, keyword, sensitivity) for keyword in keywords for sensitivity in sensitivities ]
+	tolerance = cmdr_utils.ms_to_frames ( args.tolerance_ms, sample_rate, frame_length )
+	curves = { keyword: [] for keyword in keywords }
+	start = perf_counter()
+	busy = 0.0
+	with multiprocessing.Pool ( args.workers, initializer=_init_worker, initargs=(corpus.array,) ) as pool:
+		for keyword, sensitivity, detections, elapsed in pool.imap_unordered(_run, jobs):
+			busy += elapsed
+			labels = corpus.labels(keyword)
+			hits, false_alarms = score ( labels, detections, tolerance )
+			curves[keyword].append ({
+				'sensitivity': sensitivity,
+				'detections': len(detections),
+				'labels': len(labels),
+				'miss_rate': 1 - hits / len(labels) if labels else None,
+				'false_alarms': false_alarms,
+				'false_alarms_per_hour': false_alarms / corpus.hours if corpus.hours else None,
+			})
+	elapsed = perf_counter() - start
+
+	# report
+	for keyword, curve in curves.items():
+		curve.sort ( key=lambda point: point['sensitivity'] )
+		print ( "\n%s (%d labels)" % (keyword, curve[0]['labels'] if curve else 0) )
+		print ( "  sensitivity  detections  miss rate  false alarms/h" )
+		for point in curve:
+			miss_rate = '%9.3f' % point['miss_rate'] if point['miss_rate'] is not None else '%9s' % '-'
+			print ( "  %11.3f  %10d  %s  %14.2f" % (
+				point['sensitivity'], point['detections'], miss_rate, point['false_alarms_per_hour'] or 0) )
+	print ( "\n%d run(s) over %.2f h of audio in %.2f s (%.0fx real time per run, %.1fx overall)" % (
+		len(jobs), corpus.hours, elapsed, corpus.hours * 3600 * len(jobs) / busy if busy else 0,
+		corpus.hours * 3600 * len(jobs) / elapsed if elapsed else 0) )
+
+	if args.output:
+		with open ( args.output, 'w' ) as f:
+			json.dump ( curves, f, indent='\t' )
+
+
+
+if __name__ == "__main__":
+	main()
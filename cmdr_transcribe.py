@@ -0,0 +1,94 @@
+# streaming transcription: double-buffered Cheetah instances, decoding finished segments while listening goes on
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue, Empty
+
+
+
+class StreamingTranscriber:
+	"""
+	Transcribe an utterance segment by segment, on two Cheetah instances. At each internal pause, the instance that
+	heard the segment is decoded (`transcribe`) on a worker thread, while the other one keeps consuming frames.
+	Decoding runs one segment at a time, in order; each decoded segment is queued as a partial result.
+	Quacks like Cheetah (`process`, `transcribe`, `frame_length`, ...), so it can stand in for it
+	"""
+
+	def __init__ ( self, engines ):
+		if len(engines) != 2:
+			raise ValueError ( "StreamingTranscriber needs exactly two Cheetah instances" )
+		self._engines = engines
+		self._active = 0				# index of the engine consuming frames
+		self._decoding = [None, None]	# per engine: future of the segment it is decoding
+		self._segment_frames = 0		# frames fed to the active engine since its last segment
+		self._executor = ThreadPoolExecutor ( max_workers=1 )
+		self._partials = Queue()
+		self.segments = []				# decoded segments of the current utterance, in order
+
+
+	@property
+	def sample_rate (self):
+		return self._engines[0].sample_rate
+
+
+	@property
+	def frame_length (self):
+		return self._engines[0].frame_length
+
+
+	def process ( self, pcm ):
+		"""Feed one frame to the engine currently listening"""
+		self._engines[self._active].process(pcm)
+		self._segment_frames += 1
+
+
+	def _decode ( self, engine ):
+		"""Worker thread: decode one finished segment, and publish it"""
+		text = engine.transcribe()
+		if text:
+			self.segments.append(text)
+			self._partials.put(text)
+		return text
+
+
+	def end_segment (self):
+		"""Close the current segment: decode it in the background, and switch listening to the other engine"""
+		if not self._segment_frames:
+			return
+		self._decoding[self._active] = self._executor.submit ( self._decode, self._engines[self._active] )
+		self._active ^= 1
+		self._segment_frames = 0
+
+		# the other engine may still be decoding the segment before last; it must be done before it hears more
+		pending = self._decoding[self._active]
+		if pending is not None:
+			pending.result()
+
+
+	def poll (self):
+		"""Return the transcript so far if new segments were decoded since the last call, otherwise None"""
+		updated = False
+		while True:
+			try:
+				self._partials.get_nowait()
+			except Empty:
+				break
+			updated = True
+		return ' '.join(self.segments) if updated else None
+
+
+	def transcribe (self):
+		"""Decode the last segment, wait for every segment, and return the whole transcript; resets for the next one"""
+		self.end_segment()
+		for pending in self._decoding:
+			if pending is not None:
+				pending.result()
+		self._decoding = [None, None]
+		self.poll()
+		transcript = ' '.join(self.segments)
+		self.segments = []
+		return transcript
+
+
+	def delete (self):
+		self._executor.shutdown()
+		for engine in self._engines:
+			engine.delete()
@@ -0,0 +1,292 @@
+# spoken responses: fixed phrases pre-rendered at startup, others cached on disk, played on an already-open stream
+import hashlib
+import os
+import queue
+import sys
+import tempfile
+import threading
+import wave
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import pyaudio
+
+
+Clip = namedtuple ( 'Clip', 'pcm sample_rate channels' )
+
+
+
+def read_clip ( path ):
+	"""Read a rendered 16-bit WAV file into a Clip"""
+	with wave.open ( path, 'rb' ) as wav:
+		if wav.getsampwidth() != 2:
+			raise ValueError ( "'%s' is not 16-bit PCM" % path )
+		return Clip ( wav.readframes(wav.getnframes()), wav.getframerate(), wav.getnchannels() )
+
+
+
+class PhraseCache:
+	"""
+	Bounded on-disk LRU of rendered phrases: one WAV file per (voice, text), named by their hash. Once the files
+	add up to more than `max_bytes`, the least recently used go first; recency is kept in the files' mtime, so it
+	survives restarts
+	"""
+
+	def __init__ ( self, path, max_bytes ):
+		os.makedirs ( path, exist_ok=True )
+		self.path = path
+		self.max_bytes = max_bytes
+		self.hits = 0
+		self.misses = 0
+		self._lock = threading.Lock()
+
+		files = sorted ( (entry.stat().st_mtime, entry.path, entry.stat().st_size)
+			for entry in os.scandir(path) if entry.name.endswith('.wav') )
+		self._entries = OrderedDict ( (file_path, size) for _, file_path, size in files )		# oldest first
+		self.size = sum ( self._entries.values() )
+
+
+	def file_path ( self, text, voice ):
+		key = hashlib.sha1 ( ('%s\0%s' % (voice, text)).encode() ).hexdigest()
+		return os.path.join ( self.path, key + '.wav' )
+
+
+	def get ( self, text, voice ):
+		"""Return the cached Clip for `text` in `voice`, or None"""
+		file_path = self.file_path ( text, voice )
+		with self._lock:
+			if file_path not in self._entries:
+				self.misses += 1
+				return None
+			self._entries.move_to_end(file_path)
+			self.hits += 1
+		os.utime(file_path)
+		return read_clip(file_path)
+
+
+	def put ( self, text, voice, rendered_path ):
+		"""Move a freshly rendered file into the cache, evicting as needed"""
+		file_path = self.file_path ( text, voice )
+		os.replace ( rendered_path, file_path )
+		size = os.path.getsize(file_path)
+		with self._lock:
+			self.size += size - self._entries.pop(file_path, 0)
+			self._entries[file_path] = size
+			while self.size > self.max_bytes and len(self._entries) > 1:
+				old_path, old_size = self._entries.popitem ( last=False )
+				self.size -= old_size
+				try:
+					os.remove(old_path)
+				except FileNotFoundError:
+					pass
+
+
+	def stats (self):
+		return { 'files': len(self._entries), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses }
+
+
+
+class Reply:
+	"""
+	Handle on a reply being rendered or played. Like a background process, it can be stopped with `terminate`
+	(the listen loop does so on the next wake word)
+	"""
+
+	def __init__ ( self, text ):
+		self.text = text
+		self.cancelled = False
+		self.done = threading.Event()
+
+
+	def terminate (self):
+		self.cancelled = True
+
+
+	def wait ( self, timeout=None ):
+		return self.done.wait(timeout)
+
+
+
+class Player:
+	"""
+	Plays replies on output streams that are opened once (one per sample format) and kept open, from a thread of its
+	own. Clips are written `chunk_frames` at a time, so a cancelled reply stops within a chunk
+	"""
+
+	def __init__ ( self, device=None, chunk_frames=1024 ):
+		self.device = device
+		self.chunk_frames = chunk_frames
+		self._pa = pyaudio.PyAudio()
+		self._streams = {}			# (sample rate, channels) -> open stream
+		self._lock = threading.Lock()		# streams are opened from the TTS thread too (pre-rendering)
+		self._queue = queue.Queue()
+		self._thread = threading.Thread ( target=self._run, name='player', daemon=True )
+		self._thread.start()
+
+
+	def open ( self, sample_rate, channels ):
+		"""Return the output stream for this format, opening it the first time"""
+		with self._lock:
+			stream = self._streams.get((sample_rate, channels))
+			if stream is None:
+				stream = self._streams[(sample_rate, channels)] = self._pa.open (
+					rate=sample_rate,
+					channels=channels,
+					format=pyaudio.paInt16,
+					output=True,
+					output_device_index=self.device,	# leave as None to use sys default output device
+				)
+			return stream
+
+
+	def play ( self, reply, clip ):
+		self._queue.put ( (reply, clip) )
+
+
+	def _run (self):
+		while True:
+			item = self._queue.get()
+			if item is None:
+				return
+			reply, clip = item
+			try:
+				stream = self.open ( clip.sample_rate, clip.channels )
+				chunk = self.chunk_frames * clip.channels * 2
+				view = memoryview(clip.pcm)
+				for start in range(0, len(view), chunk):
+					if reply.cancelled:
+						break
+					stream.write ( view[start : start + chunk] )
+			except Exception as e:
+				print ( "Error: could not play", repr(reply.text), "-", e, file=sys.stderr, flush=True )
+			finally:
+				reply.done.set()
+
+
+	def close (self):
+		self._queue.put(None)
+		self._thread.join()
+		for stream in self._streams.values():
+			stream.stop_stream()
+			stream.close()
+		self._pa.terminate()
+
+
+
+class Responder:
+	"""
+	Spoken replies, with pyttsx3. The fixed `phrases` (name → text) are rendered at startup and kept in memory as
+	PCM; other text is looked up in the on-disk `PhraseCache`, and only rendered on a miss. Lookups and renders run
+	on a thread of their own (the pyttsx3 engine is not thread-safe, and `runAndWait` blocks), so `say` returns at once
+	"""
+
+	def __init__ ( self, cache_dir='tts_cache', voice=None, rate=None, max_cache_mb=64, phrases={}, device=None ):
+		self.voice = voice
+		self.rate = rate
+		self.phrases = dict(phrases)
+		self.cache = PhraseCache ( cache_dir, max_cache_mb * 1024 * 1024 )
+		self.player = Player ( device )
+		self._clips = {}			# text -> Clip, for the fixed phrases
+		self._engine = None
+		self._thread = ThreadPoolExecutor ( 1, thread_name_prefix='tts' )
+
+
+	@classmethod
+	def from_config ( cls, cfg ):
+		"""Build a Responder from the `responses` config section, or return None if it is disabled"""
+		if not cfg.get('enabled', False):
+			return None
+		return cls ( cfg.get('cache_dir', 'tts_cache'), cfg.get('voice'), cfg.get('rate'), cfg.get('max_cache_mb', 64),
+			cfg.get('phrases', {}), cfg.get('device') )
+
+
+	@property
+	def voice_key (self):
+		return '%s@%s' % (self.voice, self.rate)
+
+
+	def prerender (self):
+		"""Render the fixed phrases into memory, and open their output streams, in the background"""
+		for text in self.phrases.values():
+			self._thread.submit ( self._prerender, text )
+
+
+	def _prerender ( self, text ):
+		clip = self._clips[text] = self._clip(text)
+		self.player.open ( clip.sample_rate, clip.channels )
+
+
+	def _render ( self, text, path ):
+		if self._engine is None:
+			import pyttsx3
+			self._engine = pyttsx3.init()
+			if self.voice:
+				self._engine.setProperty ( 'voice', self.voice )
+			if self.rate:
+				self._engine.setProperty ( 'rate', self.rate )
+		self._engine.save_to_file ( text, path )
+		self._engine.runAndWait()
+
+
+	def _clip ( self, text ):
+		"""TTS thread: return the Clip for `text`, from the disk cache or freshly rendered into it"""
+		clip = self.cache.get ( text, self.voice_key )
+		if clip is None:
+			fd, temp_path = tempfile.mkstemp ( '.wav.tmp', dir=self.cache.path )
+			os.close(fd)
+			self._render ( text, temp_path )
+			clip = read_clip(temp_path)
+			self.cache.put ( text, self.voice_key, temp_path )
+		return clip
+
+
+	def _say ( self, reply ):
+		try:
+			if not reply.cancelled:
+				self.player.play ( reply, self._clip(reply.text) )
+				return
+		except Exception as e:
+			print ( "Error: could not speak", repr(reply.text), "-", e, file=sys.stderr, flush=True )
+		reply.done.set()
+
+
+	def say ( self, text ):
+		"""Speak `text` (a fixed phrase plays straight from memory); return its Reply"""
+		reply = Reply(text)
+		clip = self._clips.get(text)
+		if clip is not None:
+			self.player.play ( reply, clip )
+		else:
+			self._thread.submit ( self._say, reply )
+		return reply
+
+
+	def stats (self):
+		return dict ( self.cache.stats(), prerendered=len(self._clips) )
+
+
+	def close (self):
+		self._thread.shutdown()
+		self.player.close()
+
+
+
+# the responder shared by command handlers (see `say`); None while spoken responses are disabled
+responder = None
+
+
+
+def say ( text ):
+	"""Print `text` and, with spoken responses enabled, speak it; return the Reply (None if disabled)"""
+	print ( ' >', text, flush=True )
+	if responder is None:
+		return None
+	return responder.say(text)
+
+
+
+def respond ( name ):
+	"""Say the configured fixed phrase `name`, if there is one"""
+	if responder is not None and name in responder.phrases:
+		return say ( responder.phrases[name] )
+	return None
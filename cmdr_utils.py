@@ -1,5 +1,11 @@
 # cmdr utilities
 import importlib, importlib.util
+import threading
+from math import ceil
+from time import perf_counter
+from contextlib import contextmanager
+from functools import lru_cache
+from queue import LifoQueue, Empty
 import platform
 import os
 from json import load as json_load
@@ -19,9 +25,16 @@ class Cmdr:
 		ACTIVE_PROCESS = 2			# Another process was launched and is currently running
 
 
-	def __init__ (self, config_file="config.json"):
-		self.config = self.load_config(config_file)	# read in config file, config.json
+	def __init__ (self, config_file="config.json", config=None):
+		self.config_file = config_file
+		# read in config file, config.json (unless an already loaded `config` is given)
+		self.config = config if config is not None else self.load_config(config_file)
 		self.active_process = None
+		self.recorder = None			# flight recorder (cmdr_recorder), if enabled
+		self.metrics = None				# cmdr_metrics.Metrics, if enabled
+		self.events = None				# event history (cmdr_events), if enabled
+		self.console = None				# per-frame console sink of its own (satellites); None: the shared one
+		self.state_hooks = []			# called with (old state, new state) on every transition
 		self.state = self.CmdrStateEnum.IDLE
 
 
@@ -38,8 +51,14 @@ class Cmdr:
 	
 	@state.setter
 	def state (self, val):
-		try: self._state = self.CmdrStateEnum(val)
-		except:	print ("Error: invalid CmdrStateEnum", file=stderr)
+		try: new = self.CmdrStateEnum(val)
+		except:
+			print ("Error: invalid CmdrStateEnum", file=stderr)
+			return
+		old = getattr(self, '_state', None)
+		self._state = new
+		for hook in self.state_hooks:
+			hook(old, new)
 
 
 
@@ -69,6 +88,7 @@ def get_machine ( lower=False ) :
 	return platform.machine()  if not lower else platform.machine().lower()
 
 
+@lru_cache(maxsize=None)
 def rel_library_path():
 	system = platform.system()
 	machine = platform.machine()
@@ -90,6 +110,7 @@ def rel_library_path():
 	raise NotImplementedError('Porcupine is not supported on %s/%s yet!' % (system, machine))
 
 
+@lru_cache(maxsize=None)
 def porcupine_keyword_file_extension():
 	system = platform.system()
 	machine = platform.machine()
@@ -107,9 +128,231 @@ def porcupine_keyword_file_extension():
 
 
 
+def keyword_index ( result ):
+	"""Porcupine's `process` result as a keyword index, -1 for none (a single-keyword Porcupine returns a bool)"""
+	if isinstance(result, bool):
+		return 0 if result else -1
+	return result
+
+
+
 def abs_list_avg ( input_list ):
 	"""Given an input list of numbers, return the absolute value average of the list"""
 	sum = 0
 	for i in input_list:
 		sum += abs(i)
 	return sum / len(input_list)
+
+
+
+def ms_to_frames ( ms, sample_rate, frame_length ):
+	"""Return the number of whole frames needed to cover `ms` milliseconds of audio (rounded up)"""
+	return ceil ( ms * sample_rate / (1000 * frame_length) )
+
+
+
+
+class StartupTimer:
+	"""Record how long each phase of startup takes, for the startup timing report"""
+
+	def __init__ ( self, start=None ):
+		self.start = start if start is not None else perf_counter()
+		self.phases = []		# (name, seconds) in the order phases finished
+
+
+	@contextmanager
+	def phase ( self, name ):
+		"""Time the enclosed block as phase `name` (may run on any thread)"""
+		start = perf_counter()
+		try:
+			yield
+		finally:
+			self.phases.append ( (name, perf_counter() - start) )
+
+
+	def record ( self, name, seconds ):
+		"""Add a phase that was timed elsewhere"""
+		self.phases.append ( (name, seconds) )
+
+
+	def report ( self, title="Startup", prefix='' ):
+		"""Print every phase recorded so far (or those whose name starts with `prefix`), and the time since `start`"""
+		lines = [ "%s: %.0f ms" % (title, (perf_counter() - self.start) * 1000) ]
+		for name, seconds in list(self.phases):
+			if name.startswith(prefix):
+				lines.append ( "  %-28s %8.1f ms" % (name, seconds * 1000) )
+		print ( '\n'.join(lines) + '\n', end='', flush=True )		# in one write: engines may report from other threads
+
+
+
+class LazyEngine:
+	"""
+	Stand-in for an engine that is expensive to build (e.g. Cheetah and its models), built by `factory` according to
+	`policy`: 'eager' builds it immediately, 'background' starts building it on a thread immediately, and 'on-demand'
+	builds it on first use. Attribute access is forwarded to the engine, blocking until it is ready
+	"""
+
+	POLICIES = ('eager', 'background', 'on-demand')
+
+	def __init__ ( self, factory, policy='background', name='engine', timer=None ):
+		if policy not in self.POLICIES:
+			raise ValueError ( "Unknown load policy '%s'; expected one of %s" % (policy, ', '.join(self.POLICIES)) )
+		self.name = name
+		self._factory = factory
+		self._timer = timer
+		self._engine = None
+		self._error = None
+		self._lock = threading.Lock()
+		self._thread = None
+
+		if policy == 'eager':
+			self.get()
+		elif policy == 'background':
+			self._thread = threading.Thread ( target=self._build, daemon=True )
+			self._thread.start()
+
+
+	def _build (self):
+		with self._lock:
+			if self._engine is not None or self._error is not None:
+				return
+			try:
+				if self._timer:
+					# the factory may time phases of its own (e.g. 'cheetah library load'), reported along with its init
+					with self._timer.phase("%s init" % self.name):
+						self._engine = self._factory()
+					self._timer.report ( "%s ready" % self.name, prefix=self.name + ' ' )
+				else:
+					self._engine = self._factory()
+			except Exception as error:
+				# reported now, even if the engine is built in the background; raised again on use
+				print ( "Error: could not load %s -" % self.name, error, file=stderr, flush=True )
+				self._error = error
+
+
+	@property
+	def ready (self):
+		"""True once the engine has been built"""
+		return self._engine is not None
+
+
+	def get (self):
+		"""Return the engine, building it (or waiting for the background build) if needed"""
+		if self._engine is None:
+			self._build()		# waits on the lock if a background build is in progress
+			if self._error is not None:
+				raise self._error
+		return self._engine
+
+
+	def __getattr__ ( self, name ):
+		return getattr ( self.get(), name )
+
+
+	def delete (self):
+		"""Release the engine, if it was ever built"""
+		if self._thread:
+			self._thread.join()
+		if self._engine is not None:
+			self._engine.delete()
+
+
+
+class EnginePool:
+	"""
+	Thread-safe pool of pre-initialized engines (e.g. Porcupine or Cheetah handles), so that a new stream starts
+	without model-load latency. `size` engines are built up front; `checkout` hands out an idle one, building another
+	if none is left (up to `max_size`, after which it waits), and `checkin` resets an engine with `reset(engine)`
+	before it goes back, so that no state carries over from one stream to the next
+	"""
+
+	def __init__ ( self, factory, size=1, max_size=None, reset=None, name='engine' ):
+		self.name = name
+		self.max_size = max_size
+		self._factory = factory
+		self._reset = reset
+		self._idle = LifoQueue()		# the most recently used engine goes out first, while its memory is still warm
+		self._lock = threading.Lock()
+		self.created = 0
+		for _ in range(size):
+			self._idle.put ( self._create() )
+
+
+	def _create (self):
+		"""Build a new engine, or return None if the pool is at `max_size`"""
+		with self._lock:
+			if self.max_size is not None and self.created >= self.max_size:
+				return None
+			self.created += 1
+		try:
+			return self._factory()
+		except Exception:
+			with self._lock:
+				self.created -= 1
+			raise
+
+
+	def checkout ( self, timeout=None ):
+		"""Return an idle engine; raise `queue.Empty` if none frees up within `timeout` (once at `max_size`)"""
+		try:
+			return self._idle.get_nowait()
+		except Empty:
+			pass
+		engine = self._create()
+		if engine is None:
+			engine = self._idle.get ( timeout=timeout )
+		return engine
+
+
+	def checkin ( self, engine ):
+		"""Reset `engine` and make it available again; one that fails to reset is deleted and replaced with a new one"""
+		try:
+			if self._reset:
+				self._reset(engine)
+		except Exception as e:
+			# checked in from `finally` blocks: report rather than raise over the borrower's own error
+			print ( "Error: could not reset %s, replacing it -" % self.name, e, file=stderr, flush=True )
+			self._replace(engine)
+			return
+		self._idle.put(engine)
+
+
+	def _replace ( self, engine ):
+		"""Delete a broken `engine` and release its slot, then fill the slot with a new engine if one can be built"""
+		try:
+			engine.delete()
+		except Exception:
+			pass
+		finally:
+			with self._lock:
+				self.created -= 1
+		try:
+			fresh = self._create()
+		except Exception as e:
+			print ( "Error: could not replace %s -" % self.name, e, file=stderr, flush=True )
+			return
+		if fresh is not None:
+			self._idle.put(fresh)
+
+
+	@contextmanager
+	def lease ( self, timeout=None ):
+		"""Check an engine out for the duration of a `with` block"""
+		engine = self.checkout(timeout)
+		try:
+			yield engine
+		finally:
+			self.checkin(engine)
+
+
+	def stats (self):
+		return { 'created': self.created, 'idle': self._idle.qsize() }
+
+
+	def delete (self):
+		"""Release the idle engines (engines still checked out are the borrowers' to delete)"""
+		while True:
+			try:
+				self._idle.get_nowait().delete()
+			except Empty:
+				return
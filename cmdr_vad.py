@@ -0,0 +1,161 @@
+# voice activity detection: frame energy and endpointing
+import numpy as np
+
+import cmdr_utils
+
+
+
+class FrameEnergy:
+	"""Vectorized RMS energy of 16-bit PCM frames, computed in a preallocated float buffer"""
+
+	def __init__ ( self, frame_length ):
+		self._samples = np.empty(frame_length, dtype=np.float32)
+
+
+	def rms ( self, pcm ):
+		"""Return the root-mean-square amplitude of one frame (any buffer of `frame_length` int16 samples)"""
+		samples = self._samples
+		np.copyto ( samples, np.frombuffer(pcm, dtype=np.int16) )
+		return float ( np.sqrt(np.dot(samples, samples) / samples.size) )
+
+
+
+class Endpointer:
+	"""
+	Decide when a spoken command is over, from the energy of each frame.
+	The command ends after `trailing_silence_ms` of silence following speech, when nothing is said within
+	`leading_silence_ms`, or after `max_duration_ms` regardless.
+	With `pause_ms`, shorter pauses inside the command are reported too (`paused`), to split it into segments
+	"""
+
+	def __init__ ( self, sample_rate, frame_length, threshold=400, trailing_silence_ms=800,
+			leading_silence_ms=4000, max_duration_ms=10000, pause_ms=None ):
+		self.threshold = threshold				# RMS above which a frame counts as speech
+		self.pause_frames = cmdr_utils.ms_to_frames(pause_ms, sample_rate, frame_length) if pause_ms else None
+		self.trailing_silence_frames = cmdr_utils.ms_to_frames(trailing_silence_ms, sample_rate, frame_length)
+		self.leading_silence_frames = cmdr_utils.ms_to_frames(leading_silence_ms, sample_rate, frame_length)
+		self.max_frames = cmdr_utils.ms_to_frames(max_duration_ms, sample_rate, frame_length)
+		self._energy = FrameEnergy(frame_length)
+		self.reset()
+
+
+	@classmethod
+	def from_config ( cls, cfg, sample_rate, frame_length ):
+		"""Build an Endpointer from the `cheetah.endpoint` config section"""
+		return cls ( sample_rate, frame_length, **cfg )
+
+
+	def reset (self):
+		"""Start a new command"""
+		self.frames = 0				# frames seen so far
+		self.speech_frames = 0		# frames above the threshold
+		self.silent_run = 0			# consecutive frames below the threshold
+		self.energy = 0.0			# RMS of the last frame
+		self.reason = None			# why the endpoint was reached
+		self.paused = False			# True on the frame where a pause inside the command reaches `pause_ms`
+		self._segment_speech = 0	# speech frames since the last pause
+
+
+	def update ( self, pcm ):
+		"""Account for one more frame; return True once the command is over"""
+		self.energy = self._energy.rms(pcm)
+		self.frames += 1
+
+		if self.energy >= self.threshold:
+			self.speech_frames += 1
+			self._segment_speech += 1
+			self.silent_run = 0
+		else:
+			self.silent_run += 1
+
+		self.paused = bool ( self.pause_frames and self._segment_speech and self.silent_run == self.pause_frames )
+		if self.paused:
+			self._segment_speech = 0
+
+		if self.speech_frames and self.silent_run >= self.trailing_silence_frames:
+			self.reason = 'silence'
+		elif not self.speech_frames and self.frames >= self.leading_silence_frames:
+			self.reason = 'no speech'
+		elif self.frames >= self.max_frames:
+			self.reason = 'max duration'
+		return self.reason is not None
+
+
+
+class EnergyGate:
+	"""
+	Idle-mode gate in front of Porcupine, to skip the engine while the room is silent.
+	The gate closes after `hangover_ms` of frames below `threshold` and reopens on the first louder frame. While closed,
+	the last `preroll_ms` of frames are kept in a preallocated ring and replayed (oldest first) when the gate reopens,
+	so that the start of a wake word is never clipped
+	"""
+
+	def __init__ ( self, sample_rate, frame_length, threshold=150, hangover_ms=1500, preroll_ms=320, sample_width=2 ):
+		self.threshold = threshold
+		self.hangover_frames = cmdr_utils.ms_to_frames(hangover_ms, sample_rate, frame_length)
+		self.is_open = True
+		self._silent_run = 0
+		self._energy = FrameEnergy(frame_length)
+
+		# pre-roll ring, filled only while the gate is closed
+		frame_bytes = frame_length * sample_width
+		preroll_frames = cmdr_utils.ms_to_frames(preroll_ms, sample_rate, frame_length)
+		view = memoryview ( bytearray(frame_bytes * preroll_frames) )
+		self._preroll = [ view[i * frame_bytes : (i + 1) * frame_bytes] for i in range(preroll_frames) ]
+		self._preroll_count = 0		# frames held since the gate closed
+		self._frames = []			# reused return value of `feed`
+
+		# counters
+		self.frames_processed = 0
+		self.frames_skipped = 0
+
+
+	@classmethod
+	def from_config ( cls, cfg, sample_rate, frame_length ):
+		"""Build an EnergyGate from the `porcupine.idle_gate` config section, or return None if it is disabled"""
+		cfg = dict(cfg)
+		if not cfg.pop('enabled', False):
+			return None
+		return cls ( sample_rate, frame_length, **cfg )
+
+
+	def feed ( self, pcm ):
+		"""
+		Account for one captured frame and return the list of frames to run through the engine, in order: empty while
+		idle, the held pre-roll plus `pcm` on reopening. The list and the pre-roll views are reused by the next call
+		"""
+		frames = self._frames
+		frames.clear()
+		loud = self._energy.rms(pcm) >= self.threshold
+
+		if self.is_open:
+			self._silent_run = 0 if loud else self._silent_run + 1
+			if self._silent_run >= self.hangover_frames:
+				self.is_open = False
+				self._preroll_count = 0
+		elif loud:
+			self.is_open = True
+			self._silent_run = 0
+			held = min(self._preroll_count, len(self._preroll))
+			for i in range(self._preroll_count - held, self._preroll_count):
+				frames.append ( self._preroll[i % len(self._preroll)] )
+		else:
+			if self._preroll:
+				self._preroll[self._preroll_count % len(self._preroll)][:] = pcm
+			self._preroll_count += 1
+			self.frames_skipped += 1
+			return frames
+
+		frames.append(pcm)
+		self.frames_processed += len(frames)
+		self.frames_skipped -= len(frames) - 1		# replayed pre-roll frames were processed after all
+		return frames
+
+
+	def stats (self):
+		"""Return a dict of gate counters"""
+		return {
+			'open': self.is_open,
+			'frames_processed': self.frames_processed,
+			'frames_skipped': self.frames_skipped,
+		}
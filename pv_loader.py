@@ -0,0 +1,61 @@
+import os
+import threading
+from ctypes import CDLL, c_void_p
+from ctypes import util as ctypes_util
+from functools import lru_cache
+
+_libraries = {}
+_checked_files = set()
+_lock = threading.Lock()
+
+
+def load_library(library_path, bind=None, description='library'):
+    """
+    Loads a shared library and declares its function prototypes once per process; later calls for the same file
+    return the same, already bound, library object.
+
+    :param library_path: Path to the shared library.
+    :param bind: Callable taking the freshly loaded library and setting 'argtypes'/'restype' on its functions. Each
+    'bind' gets its own library object, so bindings with different prototypes for the same file don't clash.
+    :param description: Name of the library, for the error raised when it is missing.
+    :return: 'ctypes.CDLL' instance.
+    """
+
+    key = (os.path.realpath(library_path), bind)
+    library = _libraries.get(key)
+    if library is not None:
+        return library
+
+    with _lock:
+        library = _libraries.get(key)
+        if library is None:
+            if not os.path.exists(key[0]):
+                raise IOError("Could not find %s at '%s'" % (description, library_path))
+            library = CDLL(key[0])
+            if bind is not None:
+                bind(library)
+            _libraries[key] = library
+    return library
+
+
+def check_file(file_path, description):
+    """
+    Raises 'IOError' if 'file_path' does not exist. Files found once are not looked up again (models and keyword
+    files don't go away while the process runs).
+    """
+
+    if file_path in _checked_files:
+        return
+    if not os.path.exists(os.path.expanduser(file_path)):
+        raise IOError("Could not find %s at '%s'" % (description, file_path))
+    _checked_files.add(file_path)
+
+
+@lru_cache(maxsize=None)
+def libc():
+    """C runtime library, for freeing memory allocated by the engines ('find_library' is slow, so it runs once)."""
+
+    library = CDLL(ctypes_util.find_library('c'))
+    library.free.argtypes = [c_void_p]
+    library.free.restype = None
+    return library
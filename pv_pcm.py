@@ -0,0 +1,51 @@
+import sys
+from ctypes import addressof, c_char, c_char_p, c_short, c_void_p, cast, sizeof
+
+
+SAMPLE_WIDTH = sizeof(c_short)
+
+# buffer formats accepted: 16-bit signed samples, or raw bytes
+_FORMATS = ('h', 'B', 'b', 'c')
+_NATIVE_ORDER = ('@', '=', '<' if sys.byteorder == 'little' else '>')
+
+
+def pcm_view(pcm):
+    """
+    Resolves a block of 16-bit PCM into something the C libraries can read from directly.
+
+    :param pcm: Native-endian 16-bit samples. `bytes`, `bytearray`, `memoryview`, `array('h')`, NumPy int16 arrays and
+    ctypes arrays are handed over without copying or unpacking. Read-only buffers other than `bytes` (e.g. a
+    `memoryview` of `bytes`) are copied once. Sequences of Python ints (lists, tuples) are packed into a ctypes array,
+    as the bindings have always done.
+    :return: Tuple of `(address, num_samples, owner)`. `owner` keeps the memory at `address` alive and must be held
+    for as long as the address is used.
+    :raises TypeError: If a buffer holds anything other than native-endian 16-bit signed samples or raw bytes (e.g.
+    float16 or uint16).
+    """
+
+    if isinstance(pcm, bytes):
+        if len(pcm) % SAMPLE_WIDTH:
+            raise ValueError('PCM buffer length (%d bytes) is not a whole number of samples' % len(pcm))
+        owner = c_char_p(pcm)
+        return cast(owner, c_void_p).value, len(pcm) // SAMPLE_WIDTH, owner
+
+    try:
+        view = memoryview(pcm)
+    except TypeError:
+        owner = (c_short * len(pcm))(*pcm)
+        return addressof(owner), len(pcm), owner
+
+    if not view.c_contiguous:
+        raise ValueError('PCM buffer must be C-contiguous')
+    fmt = view.format[1:] if view.format[:1] in _NATIVE_ORDER else view.format
+    if fmt not in _FORMATS:
+        raise TypeError("PCM buffer must hold 16-bit signed samples or raw bytes (got format '%s')" % view.format)
+    if view.nbytes % SAMPLE_WIDTH:
+        raise ValueError('PCM buffer length (%d bytes) is not a whole number of samples' % view.nbytes)
+
+    if view.readonly:
+        owner = c_char_p(view.tobytes())
+        return cast(owner, c_void_p).value, view.nbytes // SAMPLE_WIDTH, owner
+
+    owner = (c_char * view.nbytes).from_buffer(view)
+    return addressof(owner), view.nbytes // SAMPLE_WIDTH, owner